@@ -1,5 +1,5 @@
 import os
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, send_file, Response, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 import requests
@@ -7,7 +7,6 @@ import speech_recognition as sr
 from gtts import gTTS
 import pygame
 import time
-from groq import Groq
 import random
 import string
 import smtplib
@@ -26,6 +25,8 @@ import json
 import re
 from PIL import Image
 from functools import wraps
+import threading
+import atexit
 
 try:
     import pytesseract
@@ -35,6 +36,24 @@ except ImportError:
 
 import training
 import model_utils
+from llm_gateway import LLMGateway
+import chat_context
+import chat_store
+from chat_writer import ChatWriteBehind
+from training_queue import TrainingDataQueue
+from audio_io import AudioTooLarge, decode_audio, read_upload
+import upload_io
+from upload_io import UploadRequest, UploadTooLarge
+from language_id import create_language_identifier
+from tts_cache import TTSCache
+import pdf_extract
+import file_cache
+import document_qa
+import summarizer
+from tts_stream import SpeechStreamer, TTS_STREAM_MAX_CHARS
+from speech_engine import SpeechRecognitionEngine, SPEECH_RECOGNIZER_BACKEND, google_backend, sphinx_backend
+from response_cache import ResponseCache, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_SEMANTIC
+from db import get_database, get_pool_stats
 
 # Configure logging first - before any logger references
 logging.basicConfig(
@@ -110,64 +129,11 @@ def create_directory_with_permissions(dir_path):
 create_directory_with_permissions("static")
 create_directory_with_permissions("temp")
 create_directory_with_permissions("pdf_files")
-create_directory_with_permissions("audio_files")
 create_directory_with_permissions("training_data")
 create_directory_with_permissions("trained_models")
 create_directory_with_permissions("embedding_models")
 create_directory_with_permissions("cached_embeddings")
 
-def get_database():
-    """
-    Initialize and return MongoDB connection
-    """
-    # Get MongoDB URI from environment variables
-    mongo_url = os.getenv('MONGO_URL') or os.getenv('MONGO_URI')
-    
-    if not mongo_url:
-        logger.error("MongoDB URI not found in environment variables")
-        return None
-    
-    try:
-        # Set MongoDB connection options
-        # Updated to use newer PyMongo SSL options
-        mongo_options = {
-            'tls': True,
-            'tlsAllowInvalidCertificates': True,
-            'retryWrites': False,
-            'connectTimeoutMS': 5000,
-            'socketTimeoutMS': 30000
-        }
-        
-        # Create a MongoDB client with the options
-        client = pymongo.MongoClient(mongo_url, **mongo_options)
-        # Test the connection
-        client.admin.command('ping')
-        logger.info("Successfully connected to MongoDB")
-        
-        # Initialize collections if they don't exist
-        db = client.get_database("chatbotDB")
-        if "users" not in db.list_collection_names():
-            db.create_collection("users")
-            db.users.create_index([("email", pymongo.ASCENDING)], unique=True)
-            logger.info("Created users collection")
-            
-        if "verifications" not in db.list_collection_names():
-            db.create_collection("verifications")
-            db.verifications.create_index([("email", pymongo.ASCENDING)])
-            db.verifications.create_index([("code", pymongo.ASCENDING)])
-            logger.info("Created verifications collection")
-            
-        if "chats" not in db.list_collection_names():
-            db.create_collection("chats")
-            db.chats.create_index([("user_id", pymongo.ASCENDING)])
-            db.chats.create_index([("updated_at", pymongo.DESCENDING)])
-            logger.info("Created chats collection")
-            
-        return db
-    except Exception as e:
-        logger.error(f"Failed to connect to MongoDB: {str(e)}")
-        return None
-    
 # Get database connection
 db = get_database()
 if db is None:  # Fixed comparison to check if db is None
@@ -175,12 +141,40 @@ if db is None:  # Fixed comparison to check if db is None
 
 # Initialize the Flask app
 app = Flask(__name__)
+# Keep speech uploads in memory and stream file uploads to disk with size limits and hashing
+app.request_class = UploadRequest
 
 # Configure CORS
 CORS(app, resources={r"/api/*": {"origins": "*", "supports_credentials": True}})
 
-# Initialize Groq client
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# All Groq calls go through the async gateway (per-model concurrency limits, request coalescing, retries)
+llm_gateway = LLMGateway(api_key=os.getenv("GROQ_API_KEY"))
+
+# Load the embedding model in the background so the first document search doesn't pay for it
+if os.getenv("EMBEDDING_WARMUP", "true").lower() == "true":
+    threading.Thread(target=model_utils.warm_up_embedding_models, daemon=True).start()
+
+# Optional write-behind for chat persistence: replies don't wait on MongoDB.
+# Turns are journaled locally and written in batches by a background thread.
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "false").lower() == "true"
+chat_writer = None
+if CHAT_WRITE_BEHIND:
+    chat_writer = ChatWriteBehind(get_database, on_written=lambda turn: on_chat_turn_written(turn))
+    chat_writer.start()
+    atexit.register(chat_writer.close)
+
+# Drop embeddings of expired files and reclaim their space in the embedding store
+document_qa.start_maintenance(get_database)
+
+# Uploaded training data is parsed by background workers sharing a MongoDB-backed queue
+training_queue = TrainingDataQueue(get_database, training.process_training_data)
+training_queue.start()
+atexit.register(training_queue.close)
+
+# Cache for repeated chat prompts; the semantic tier reuses the document embedding model
+chat_response_cache = ResponseCache(
+    embed=model_utils.generate_embeddings if RESPONSE_CACHE_SEMANTIC else None
+) if RESPONSE_CACHE_ENABLED else None
 
 # Supported languages
 LANGUAGES = {
@@ -203,6 +197,13 @@ except (ImportError, AttributeError):
     microphone = None
     speech_recognition_available = False
 
+# Recognition attempts for all candidate languages run in parallel
+speech_engine = SpeechRecognitionEngine(
+    sphinx_backend(recognizer) if SPEECH_RECOGNIZER_BACKEND == "sphinx" else google_backend(recognizer)
+)
+# Ranks the spoken language from the audio so recognition only runs in the likeliest languages
+language_identifier = create_language_identifier()
+
 # Model mapping
 MODEL_MAPPING = {
     "LLaMA3-versatile": "llama-3.3-70b-versatile",
@@ -258,12 +259,23 @@ def send_verification_email(email, code):
         logger.error(f"Email sending error: {str(e)}")
         return False
 
-def get_groq_response(prompt, language="en", model="llama3-70b-8192"):
-    """Get response from Groq API"""
+def build_groq_messages(prompt, history=None):
+    """Append the user prompt to the prior conversation in chat-completion format"""
+    return list(history or []) + [{"role": "user", "content": prompt}]
+
+def get_groq_response(prompt, language="en", model="llama3-70b-8192", history=None):
+    """Get response from Groq API, answering repeated prompts from the response cache"""
+    # Replies that depend on earlier turns can't be shared between chats
+    use_cache = chat_response_cache is not None and not history
+    if use_cache:
+        cached = chat_response_cache.get(prompt, model, language)
+        if cached is not None:
+            return cached
+
     try:
-        completion = groq_client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
+        response = llm_gateway.complete(
+            model,
+            build_groq_messages(prompt, history),
             temperature=0.5,
             max_tokens=1024,
             top_p=1,
@@ -271,11 +283,31 @@ def get_groq_response(prompt, language="en", model="llama3-70b-8192"):
             presence_penalty=0,
             stop=None,
         )
-        return completion.choices[0].message.content
+        if use_cache and response:
+            chat_response_cache.put(prompt, model, language, response)
+        return response
     except Exception as e:
         logger.error(f"Error with Groq API: {str(e)}")
         return get_error_message(language)
 
+def stream_groq_response(prompt, language="en", model="llama3-70b-8192", history=None):
+    """Return an iterator of response tokens from Groq API as they are generated"""
+    return llm_gateway.stream(
+        model,
+        build_groq_messages(prompt, history),
+        temperature=0.5,
+        max_tokens=1024,
+        top_p=1,
+        frequency_penalty=0,
+        presence_penalty=0,
+        stop=None,
+    )
+
+def format_sse(data, event=None):
+    """Format a Server-Sent Events message with a JSON payload"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 def get_error_message(language):
     """Return error message in appropriate language"""
     messages = {
@@ -297,35 +329,40 @@ def process_audio(audio_data, language="en"):
         logger.warning(f"Language {language} not supported for speech recognition")
         return None
 
-    try:
-        text = recognizer.recognize_google(audio_data, language=language)
-        logger.info(f"Recognized speech: {text}")
-        return text
-    except Exception as e:
-        logger.error(f"Error in speech recognition: {str(e)}")
+    result = speech_engine.recognize(audio_data, [language])
+    if result is None:
+        logger.error(f"Could not recognize speech in {language}")
         return None
+    logger.info(f"Recognized speech: {result['text']}")
+    return result["text"]
 
 # Languages supported for text-to-speech
 TTS_LANGUAGES = ["en", "hi", "kn", "ta", "te"]
 
+# Synthesized speech is cached on disk by hash(text, language); the audio for a key never changes
+tts_cache = TTSCache()
+TTS_AUDIO_MAX_AGE = 7 * 24 * 3600
+
+def synthesize_speech(text, lang, path):
+    """Synthesize text with gTTS and write the MP3 to path"""
+    gTTS(text=text, lang=lang).save(path)
+
 def text_to_speech(text, lang="en"):
-    """Convert text to speech and return audio file path"""
+    """Convert text to speech and return the path of the cached audio file"""
     if lang not in TTS_LANGUAGES:
         logger.warning(f"Language {lang} not supported for text-to-speech")
         return None
 
-    try:
-        tts = gTTS(text=text, lang=lang)
-        create_directory_with_permissions("audio_files")
-        filename = os.path.join("audio_files", f"response_{random.randint(1000, 9999)}.mp3")
-        tts.save(filename)
-        return filename
-    except Exception as e:
-        logger.error(f"Error in speech synthesis: {str(e)}")
-        return None
+    return tts_cache.get_or_create(text, lang, synthesize_speech)
+
+# Streaming mode synthesizes sentence by sentence, each cached on its own
+tts_streamer = SpeechStreamer(text_to_speech)
 
 from langdetect import detect
 
+# Large PDFs are extracted page range by page range on a process pool
+atexit.register(pdf_extract.shutdown)
+
 # Define PDF extraction functions at the module level (not inside a try/except block)
 def extract_text_with_pdfminer(pdf_path):
     """Extract text from PDF using pdfminer"""
@@ -350,61 +387,19 @@ def extract_text_with_pdftotext(pdf_path):
         logger.warning("pdftotext command not available")
         return None
 
-def extract_text_with_pypdf2(pdf_path):
-    """Extract text from PDF using PyPDF2"""
-    try:
-        import PyPDF2
-        text = ""
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-        return text
-    except ImportError:
-        logger.warning("PyPDF2 not installed")
-        return None
-    except Exception as e:
-        logger.warning(f"PyPDF2 extraction error: {str(e)}")
-        return None
-
-# Attempt to correctly import and configure PyMuPDF
-pdf_support = True  # Start with assumption of PDF support
-
-# PyMuPDF is optional - gracefully handle if missing
-try:
-    import fitz  # This is PyMuPDF
-    def extract_text_with_pymupdf(pdf_path):
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-        return text
-    logger.info("Successfully imported PyMuPDF as fitz module")
-except ImportError:
+# Set up the main extraction function that will try all available methods
+def extract_text_from_pdf(pdf_path):
+    """Extract text from PDF, page by page in parallel, with whole-document extractors as fallback"""
     try:
-        import PyMuPDF
-        fitz = PyMuPDF
-        def extract_text_with_pymupdf(pdf_path):
-            doc = fitz.open(pdf_path)
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            doc.close()
+        text = pdf_extract.extract_pdf_text(pdf_path)
+        if text and text.strip():
             return text
-        logger.info("Successfully imported PyMuPDF directly")
-    except (ImportError, AttributeError):
-        logger.warning("PyMuPDF/fitz not available - will use alternative PDF libraries")
-        extract_text_with_pymupdf = lambda path: None
+    except Exception as e:
+        logger.warning(f"Page-level PDF extraction failed: {str(e)}")
 
-# Set up the main extraction function that will try all available methods
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF using all available methods"""
-    # Try each method in order (reordering to prioritize more reliable methods)
+    # No page-level extractor installed, or the document couldn't be parsed page by page
     extractors = [
-        ("PyPDF2", extract_text_with_pypdf2),  # Move PyPDF2 first since it has fewer dependencies
-        ("pdfminer", extract_text_with_pdfminer),  # Then pdfminer which should work reliably
-        ("PyMuPDF", extract_text_with_pymupdf),  # Keep PyMuPDF as an option if available
+        ("pdfminer", extract_text_with_pdfminer),
         ("pdftotext", extract_text_with_pdftotext),  # Last option
     ]
     
@@ -572,6 +567,11 @@ def health_check():
         return jsonify({
             'status': 'healthy',
             'database': 'connected',
+            'connectionPool': get_pool_stats(),
+            'chatWriteBehind': chat_writer.stats() if chat_writer is not None else None,
+            'ttsCache': tts_cache.stats(),
+            'ttsStream': tts_streamer.stats(),
+            'trainingQueue': training_queue.stats(),
             'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
             'environment': {
                 'variables': {
@@ -594,13 +594,8 @@ def health_check():
             'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
         }), 500
 
-@app.route("/api/chat", methods=["POST"])
-def chat():
-    """Send a message to the AI and get a response"""
-    if db is None:  # Fixed comparison
-        return jsonify({"error": "Database connection is not available"}), 500
-
-    data = request.get_json()
+def parse_chat_request(data):
+    """Extract message, model, language and chat identifiers from a chat request"""
     user_message = data.get("message", "")
     model_name = data.get("model", "LLaMA3")
     language = data.get("language", "")
@@ -633,65 +628,169 @@ def chat():
             language = 'en'
 
     model = MODEL_MAPPING.get(model_name, MODEL_MAPPING["LLaMA3"])
+    return user_message, model, language, chat_id, user_id
+
+def load_chat_history(user_id, chat_id, user_message, model):
+    """
+    Get the earlier turns of a chat that fit the model's prompt budget
+
+    Returns:
+        Tuple of (history messages, message index to extend the chat's rolling summary to, or None)
+    """
+    if not (user_id and chat_id):
+        return [], None
+    try:
+        return chat_context.build_context(db, chat_id, user_id, user_message, model)
+    except Exception as e:
+        logger.error(f"Error loading chat history: {str(e)}")
+        return [], None
+
+def schedule_summary_refresh(user_id, chat_id, model, summarize_upto):
+    """Fold older messages of a chat into its rolling summary in the background"""
+    def summarize(prompt):
+        return llm_gateway.complete(model, [{"role": "user", "content": prompt}], temperature=0.2, max_tokens=400)
+
+    threading.Thread(
+        target=chat_context.refresh_summary,
+        args=(db, chat_id, user_id, summarize, summarize_upto),
+        daemon=True
+    ).start()
+
+def build_chat_turn(user_message, response, language):
+    """Build the user/bot message pair for a chat turn and the title to use if it starts the chat"""
+    # Add user message
+    user_msg = {
+        "role": "user",
+        "content": user_message,
+        "language": language,
+        "timestamp": datetime.now()
+    }
     
+    # Add bot response
+    bot_msg = {
+        "role": "bot",
+        "content": response,
+        "language": language,
+        "timestamp": datetime.now()
+    }
+    
+    # Auto-generate title from the first message; only used if this creates the chat
+    words = user_message.split()
+    auto_title = " ".join(words[:3]) + ("..." if len(words) > 3 else "")
+    return [user_msg, bot_msg], auto_title.capitalize()
+
+def save_chat_messages(user_id, chat_id, messages, title):
+    """Append a chat turn's messages to a chat, creating the chat if needed"""
     try:
-        response = get_groq_response(user_message, language, model)
+        # One atomic upsert of the chat header, then a push to its tail bucket
+        chat_store.append_messages(db, chat_id, user_id, messages, title=title)
+        logger.info(f"Saved chat messages for user {user_id}, chat {chat_id}")
+        return True
+    except Exception as db_error:
+        logger.error(f"Error saving chat messages: {str(db_error)}")
+        # Continue to return response even if DB operation fails
+        return False
+
+def on_chat_turn_written(turn):
+    """Refresh a chat's rolling summary once a turn that pushed it over the window is stored"""
+    if turn.get("summarize_upto") is not None:
+        schedule_summary_refresh(turn["user_id"], turn["chat_id"], turn["model"], turn["summarize_upto"])
+
+def submit_chat_turn(user_id, chat_id, user_message, response, language, model, summarize_upto=None):
+    """Persist a chat turn, through the write-behind buffer when it is enabled"""
+    messages, title = build_chat_turn(user_message, response, language)
+    if chat_writer is not None and chat_writer.submit(
+            chat_id, user_id, messages, title, model=model, summarize_upto=summarize_upto):
+        return
+
+    # Write-behind disabled, or its buffer is full: write on the request thread
+    if save_chat_messages(user_id, chat_id, messages, title) and summarize_upto is not None:
+        schedule_summary_refresh(user_id, chat_id, model, summarize_upto)
+
+@app.route("/api/chat", methods=["POST"])
+def chat():
+    """Send a message to the AI and get a response"""
+    if db is None:  # Fixed comparison
+        return jsonify({"error": "Database connection is not available"}), 500
+
+    data = request.get_json()
+    if data.get("stream"):
+        return chat_stream()
+
+    user_message, model, language, chat_id, user_id = parse_chat_request(data)
+    
+    try:
+        history, summarize_upto = load_chat_history(user_id, chat_id, user_message, model)
+        response = get_groq_response(user_message, language, model, history)
         
         # Save message to chat history if user is authenticated and valid chat ID provided
         if user_id and chat_id:
-            try:
-                # Add user message
-                user_msg = {
-                    "role": "user",
-                    "content": user_message,
-                    "language": language,
-                    "timestamp": datetime.now()
-                }
-                
-                # Add bot response
-                bot_msg = {
-                    "role": "bot",
-                    "content": response,
-                    "language": language,
-                    "timestamp": datetime.now()
-                }
-                
-                # Check if chat exists
-                chat = db.chats.find_one({"_id": chat_id, "user_id": user_id})
-                
-                if chat:
-                    # Update existing chat with new messages
-                    db.chats.update_one(
-                        {"_id": chat_id, "user_id": user_id},
-                        {
-                            "$push": {"messages": {"$each": [user_msg, bot_msg]}},
-                            "$set": {"updated_at": datetime.now()}
-                        }
-                    )
-                else:
-                    # Create new chat with initial messages
-                    # Auto-generate title from the first message
-                    words = user_message.split()
-                    auto_title = " ".join(words[:3]) + ("..." if len(words) > 3 else "")
-                    title = auto_title.capitalize();
-                    
-                    db.chats.insert_one({
-                        "_id": chat_id,
-                        "user_id": user_id,
-                        "title": title,
-                        "messages": [user_msg, bot_msg],
-                        "created_at": datetime.now(),
-                        "updated_at": datetime.now()
-                    })
-                logger.info(f"Saved chat messages for user {user_id}, chat {chat_id}")
-            except Exception as db_error:
-                logger.error(f"Error saving chat messages: {str(db_error)}")
-                # Continue to return response even if DB operation fails
+            submit_chat_turn(user_id, chat_id, user_message, response, language, model, summarize_upto)
         return jsonify({"reply": response})
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
         return jsonify({"reply": get_error_message(language)}), 500
 
+@app.route("/api/chat/stream", methods=["POST"])
+def chat_stream():
+    """Send a message to the AI and stream the response as Server-Sent Events"""
+    if db is None:
+        return jsonify({"error": "Database connection is not available"}), 500
+
+    data = request.get_json()
+    user_message, model, language, chat_id, user_id = parse_chat_request(data)
+    history, summarize_upto = load_chat_history(user_id, chat_id, user_message, model)
+    use_cache = chat_response_cache is not None and not history
+
+    def generate():
+        tokens = []
+        completed = False
+        try:
+            cached = chat_response_cache.get(user_message, model, language) if use_cache else None
+            if cached is not None:
+                tokens.append(cached)
+                yield format_sse({"token": cached})
+            else:
+                for token in stream_groq_response(user_message, language, model, history):
+                    tokens.append(token)
+                    yield format_sse({"token": token})
+                if use_cache and tokens:
+                    chat_response_cache.put(user_message, model, language, "".join(tokens))
+            completed = True
+            yield format_sse({"reply": "".join(tokens)}, event="done")
+        except Exception as e:
+            logger.error(f"Chat stream error: {str(e)}")
+            if not tokens:
+                tokens.append(get_error_message(language))
+            yield format_sse({"error": get_error_message(language)}, event="error")
+        finally:
+            # Persist the assembled reply once, including partial replies if the client disconnected
+            if user_id and chat_id and tokens:
+                if not completed:
+                    logger.warning(f"Chat stream for chat {chat_id} ended before completion")
+                submit_chat_turn(user_id, chat_id, user_message, "".join(tokens), language, model, summarize_upto)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable proxy buffering so tokens arrive immediately
+        }
+    )
+
+@app.route("/api/chat/cache-stats", methods=["GET"])
+def chat_cache_stats():
+    """Get hit-rate metrics for the chat response cache"""
+    if chat_response_cache is None:
+        return jsonify({"success": True, "enabled": False, "gateway": llm_gateway.stats()})
+    return jsonify({
+        "success": True,
+        "enabled": True,
+        "stats": chat_response_cache.stats(),
+        "gateway": llm_gateway.stats()
+    })
+
 @app.route("/api/signup", methods=["POST"])
 def signup():
     """Direct signup without email verification"""
@@ -982,7 +1081,13 @@ def send_verification():
 
 @app.route("/api/chats", methods=["GET"])
 def get_chats():
-    """Get all chats for a user"""
+    """
+    Get chats for a user
+
+    With a limit or cursor query parameter, returns one page of chat summaries
+    (title, last-message preview, message count) ordered by last update.
+    Without them, returns every chat with its full message history.
+    """
     if db is None:  # Fixed comparison
         return jsonify({"error": "Database connection is not available"}), 500
 
@@ -991,26 +1096,24 @@ def get_chats():
     if not user_id:
         return jsonify({"success": False, "message": "User ID is required"}), 400
 
+    if "limit" in request.args or "cursor" in request.args:
+        try:
+            limit = int(request.args.get("limit", chat_store.DEFAULT_CHAT_PAGE_SIZE))
+            chats, next_cursor = chat_store.list_chats(db, user_id, limit, request.args.get("cursor"))
+            return jsonify({
+                "success": True,
+                "chats": chats,
+                "nextCursor": next_cursor
+            })
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        except Exception as e:
+            logger.error(f"List chats error: {str(e)}")
+            return jsonify({"success": False, "message": f"An error occurred while retrieving chats: {str(e)}"}), 500
+
     try:
-        # Find all chats for the user
-        chats_cursor = db.chats.find({"user_id": user_id}).sort("updated_at", -1)
-
-        # Convert to the format expected by the frontend
-        formatted_chats = {}
-        for chat in chats_cursor:
-            formatted_messages = []
-            for msg in chat.get("messages", []):
-                formatted_messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"],
-                    "language": msg.get("language", "en"),
-                    "timestamp": msg["timestamp"].isoformat() if isinstance(msg["timestamp"], datetime) else msg["timestamp"]
-                })
-            
-            formatted_chats[chat["_id"]] = {
-                "title": chat["title"],
-                "messages": formatted_messages
-            }
+        # Find all chats for the user, in the format expected by the frontend
+        formatted_chats = chat_store.get_all_chats(db, user_id)
         logger.info(f"Retrieved {len(formatted_chats)} chats for user {user_id}")
         
         return jsonify({
@@ -1021,6 +1124,33 @@ def get_chats():
         logger.error(f"Get chats error: {str(e)}")
         return jsonify({"success": False, "message": f"An error occurred while retrieving chats: {str(e)}"}), 500
 
+@app.route("/api/chats/<chat_id>/messages", methods=["GET"])
+def get_chat_messages(chat_id):
+    """Get a page of a chat's messages, newest page first; pass nextBefore as before for older messages"""
+    if db is None:
+        return jsonify({"error": "Database connection is not available"}), 500
+
+    user_id = request.args.get("userId", "")
+
+    if not user_id:
+        return jsonify({"success": False, "message": "User ID is required"}), 400
+
+    try:
+        before = request.args.get("before")
+        before = int(before) if before not in (None, "") else None
+        limit = int(request.args.get("limit", chat_store.DEFAULT_MESSAGE_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"success": False, "message": "before and limit must be integers"}), 400
+
+    try:
+        page = chat_store.get_messages(db, chat_id, user_id, before, limit)
+        if page is None:
+            return jsonify({"success": False, "message": "Chat not found"}), 404
+        return jsonify({"success": True, "chatId": chat_id, **page})
+    except Exception as e:
+        logger.error(f"Get chat messages error: {str(e)}")
+        return jsonify({"success": False, "message": f"An error occurred while retrieving messages: {str(e)}"}), 500
+
 @app.route("/api/chats", methods=["POST"])
 def create_chat():
     """Create a new chat"""
@@ -1036,23 +1166,12 @@ def create_chat():
         return jsonify({"success": False, "message": "User ID is required"}), 400
 
     try:
-        # Check if chat ID already exists
-        existing_chat = db.chats.find_one({"_id": chat_id})
-        if existing_chat:
-            # Generate a new unique chat ID
+        # Create new chat in one insert, generating a new unique chat ID if this one is taken
+        try:
+            chat_store.create_chat(db, chat_id, user_id, title)
+        except pymongo.errors.DuplicateKeyError:
             chat_id = f"chat_{datetime.now().timestamp()}_{random.randint(1000, 9999)}"
-
-        # Create new chat
-        chat = {
-            "_id": chat_id,
-            "user_id": user_id,
-            "title": title,
-            "messages": [],
-            "created_at": datetime.now(),
-            "updated_at": datetime.now()
-        }
-        
-        db.chats.insert_one(chat)
+            chat_store.create_chat(db, chat_id, user_id, title)
         logger.info(f"Created new chat {chat_id} for user {user_id}")
         
         return jsonify({
@@ -1082,7 +1201,7 @@ def update_chat(chat_id):
 
     try:
         # Find the chat
-        chat = db.chats.find_one({"_id": chat_id, "user_id": user_id})
+        chat = chat_store.get_header(db, chat_id, user_id)
         if not chat:
             return jsonify({"success": False, "message": "Chat not found"}), 404
 
@@ -1094,23 +1213,14 @@ def update_chat(chat_id):
             )
             logger.info(f"Updated title of chat {chat_id} to '{title}'")
         
-        # Get the updated chat
-        updated_chat = db.chats.find_one({"_id": chat_id, "user_id": user_id})
-        
         # Format messages for response
-        formatted_messages = []
-        for msg in updated_chat.get("messages", []):
-            formatted_messages.append({
-                "role": msg["role"],
-                "content": msg["content"],
-                "language": msg.get("language", "en"),
-                "timestamp": msg["timestamp"].isoformat() if isinstance(msg["timestamp"], datetime) else msg["timestamp"]
-            })
+        messages = chat_store.get_message_range(db, chat_id, 0, chat.get("message_count", 0))
+        formatted_messages = [chat_store.format_message(msg) for msg in messages]
         
         return jsonify({
             "success": True,
             "chat": {
-                "title": updated_chat["title"],
+                "title": title or chat["title"],
                 "messages": formatted_messages
             }
         })
@@ -1130,9 +1240,8 @@ def delete_chat(chat_id):
         return jsonify({"success": False, "message": "User ID is required"}), 400
 
     try:
-        # Find and delete the chat
-        result = db.chats.delete_one({"_id": chat_id, "user_id": user_id})
-        if result.deleted_count == 0:
+        # Delete the chat and its message buckets
+        if not chat_store.delete_chat(db, chat_id, user_id):
             return jsonify({"success": False, "message": "Chat not found"}), 404
         logger.info(f"Deleted chat {chat_id} for user {user_id}")
         
@@ -1150,92 +1259,56 @@ def speech_to_text():
     if not speech_recognition_available:
         return jsonify({"error": "Speech recognition is not available on the server"}), 503
 
-    if 'audio' not in request.files:
-        return jsonify({"error": "No audio file provided"}), 400
+    try:
+        if request.mimetype.startswith("audio/"):
+            # Raw audio body, possibly sent with chunked transfer encoding
+            preferred_lang = request.args.get('language', '').lower()
+            logger.info(f"Receiving raw audio body ({request.mimetype})")
+            buffer = read_upload(request.stream)
+        else:
+            if 'audio' not in request.files:
+                return jsonify({"error": "No audio file provided"}), 400
 
-    audio_file = request.files['audio']
-    if not audio_file.filename:
-        return jsonify({"error": "Empty audio file"}), 400
+            audio_file = request.files['audio']
+            if not audio_file.filename:
+                return jsonify({"error": "Empty audio file"}), 400
 
-    logger.info(f"Received audio file: {audio_file.filename}, size: {audio_file.content_length} bytes")
+            preferred_lang = request.form.get('language', '').lower()
+            logger.info(f"Received audio file: {audio_file.filename}, size: {audio_file.content_length} bytes")
+            buffer = read_upload(audio_file.stream)
+    except AudioTooLarge as e:
+        return jsonify({"error": e.description}), 413
 
     try:
-        # Create temp directory if it doesn't exist with proper permissions
-        create_directory_with_permissions("temp")
-        
-        # Save the audio file temporarily with a unique name
-        temp_filename = f"temp_audio_{datetime.now().timestamp()}_{random.randint(1000, 9999)}.wav"
-        temp_path = os.path.join("temp", temp_filename)
-        audio_file.save(temp_path)
-        logger.info(f"Saved audio file to: {temp_path}")
-
-        preferred_lang = request.form.get('language', '').lower()
-        
-        with sr.AudioFile(temp_path) as source:
-            logger.info("Attempting to recognize speech...")
-            audio_data = recognizer.record(source)
-
-            # If preferred language is specified, try that first
-            if preferred_lang and preferred_lang in SPEECH_LANGUAGES:
-                try:
-                    text = recognizer.recognize_google(audio_data, language=preferred_lang)
-                    if text:
-                        logger.info(f"Detected language: {preferred_lang}, text: {text}")
-                        return jsonify({
-                            "text": text,
-                            "language": preferred_lang
-                        })
-                except Exception as e:
-                    logger.warning(f"Recognition failed for preferred language {preferred_lang}: {str(e)}")
-
-            # Fallback to trying all supported languages
-            detected_text = None
-            detected_lang = "en"  # default fallback
-
-            # Try Kannada first if not already tried
-            if preferred_lang != "kn" and "kn" in SPEECH_LANGUAGES:
-                try:
-                    text = recognizer.recognize_google(audio_data, language="kn")
-                    if text:
-                        detected_text = text
-                        detected_lang = "kn"
-                        logger.info(f"Detected language: kn, text: {text}")
-                except Exception as e:
-                    logger.warning(f"Recognition failed for Kannada: {str(e)}")
-
-            if not detected_text:
-                for lang in SPEECH_LANGUAGES:
-                    if lang == "kn":  # Already tried
-                        continue
-                    try:
-                        text = recognizer.recognize_google(audio_data, language=lang)
-                        if text:
-                            detected_text = text
-                            detected_lang = lang
-                            logger.info(f"Detected language: {lang}, text: {text}")
-                            break
-                    except Exception as e:
-                        logger.warning(f"Recognition failed for language {lang}: {str(e)}")
-
-            if detected_text:
-                return jsonify({
-                    "text": detected_text,
-                    "language": detected_lang
-                })
+        # Decode and resample in memory - no temporary file
+        logger.info("Attempting to recognize speech...")
+        audio_data = decode_audio(buffer, recognizer)
+
+        # Preferred language first, then Kannada, then the other supported languages.
+        # All attempts run at once; the first language in the final order that succeeds wins.
+        candidates = []
+        if preferred_lang and preferred_lang in SPEECH_LANGUAGES:
+            candidates.append(preferred_lang)
+        if "kn" in SPEECH_LANGUAGES:
+            candidates.append("kn")
+        candidates.extend(SPEECH_LANGUAGES)
+
+        # Narrow the candidates to the top-ranked spoken languages (keeps all of them if no identifier is configured)
+        candidates = language_identifier.select(audio_data, candidates, preferred=preferred_lang)
+
+        result = speech_engine.recognize(audio_data, candidates)
+        if result:
+            logger.info(f"Detected language: {result['language']}, text: {result['text']}")
+            return jsonify({
+                "text": result["text"],
+                "language": result["language"]
+            })
 
-            logger.warning("Could not recognize speech in any supported language")
-            return jsonify({"error": "Could not recognize speech"}), 400
+        logger.warning("Could not recognize speech in any supported language")
+        return jsonify({"error": "Could not recognize speech"}), 400
     except Exception as e:
         logger.error(f"Speech recognition error: {str(e)}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        # Clean up temp file
-        try:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-                logger.info(f"Removed temporary file: {temp_path}")
-        except Exception as cleanup_error:
-            logger.warning(f"Failed to remove temporary file: {str(cleanup_error)}")
 
 @app.route("/api/text-to-speech", methods=["POST"])
 def text_to_speech_endpoint():
@@ -1251,6 +1324,9 @@ def text_to_speech_endpoint():
         if not text:
             return jsonify({"error": "No text provided"}), 400
 
+        if data.get("stream"):
+            return stream_text_to_speech(text, language)
+
         # Limit text length for performance reasons
         if len(text) > 5000:
             text = text[:5000]
@@ -1266,7 +1342,7 @@ def text_to_speech_endpoint():
         audio_path = text_to_speech(text, language)
         if audio_path:
             logger.info(f"Successfully generated speech, sending file: {audio_path}")
-            return send_from_directory(os.path.dirname(audio_path), os.path.basename(audio_path))
+            return send_tts_audio(audio_path)
         else:
             logger.error("Failed to generate speech audio")
             return jsonify({"error": "Could not generate speech"}), 500
@@ -1274,94 +1350,171 @@ def text_to_speech_endpoint():
         logger.error(f"Text-to-speech error: {str(e)}")
         return jsonify({"error": f"An error occurred during speech synthesis: {str(e)}"}), 500
 
+@app.route("/api/text-to-speech/stream", methods=["POST"])
+def text_to_speech_stream_endpoint():
+    """Stream speech as chunked MP3, synthesizing sentences in parallel"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Invalid JSON data"}), 400
+
+    text = data.get("text", "")
+    if not text:
+        return jsonify({"error": "No text provided"}), 400
+    return stream_text_to_speech(text, data.get("language", "en"))
+
+def stream_text_to_speech(text, language):
+    """Build a chunked MP3 response that starts as soon as the first sentence is synthesized"""
+    if len(text) > TTS_STREAM_MAX_CHARS:
+        text = text[:TTS_STREAM_MAX_CHARS]
+        logger.warning(f"Text truncated to {TTS_STREAM_MAX_CHARS} characters")
+
+    if language not in TTS_LANGUAGES:
+        logger.warning(f"Language {language} not supported, falling back to English")
+        language = "en"
+
+    logger.info(f"Streaming text to speech in {language}. Text length: {len(text)} characters")
+    return Response(
+        stream_with_context(tts_streamer.stream(text, language)),
+        mimetype="audio/mpeg",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@app.route("/api/text-to-speech/<key>.mp3", methods=["GET"])
+def get_tts_audio(key):
+    """Serve previously synthesized speech by its content key (supports ETag and Range requests)"""
+    if not re.fullmatch(r"[0-9a-f]{64}", key):
+        return jsonify({"error": "Invalid audio key"}), 400
+    audio_path = tts_cache.get(key)
+    if not audio_path:
+        return jsonify({"error": "Audio not found"}), 404
+    return send_tts_audio(audio_path)
+
+def send_tts_audio(audio_path):
+    """Send a cached MP3 with its content hash as ETag; conditional requests get 304/206 responses"""
+    key = os.path.basename(audio_path)[:-len(".mp3")]
+    response = send_file(
+        audio_path,
+        mimetype="audio/mpeg",
+        conditional=True,
+        etag=key,
+        max_age=TTS_AUDIO_MAX_AGE
+    )
+    response.headers["X-Audio-Key"] = key
+    return response
+
+# Model used for file summaries; cached summaries from other models are regenerated
+FILE_SUMMARY_MODEL = "llama3-8b-8192"
+
+def complete_summary_prompts(prompts, max_tokens):
+    """Run a batch of summarization prompts concurrently; failed prompts give None"""
+    return llm_gateway.complete_many(
+        FILE_SUMMARY_MODEL,
+        [[{"role": "user", "content": prompt}] for prompt in prompts],
+        max_concurrency=summarizer.SUMMARY_MAX_CONCURRENCY,
+        temperature=0.5,
+        max_tokens=max_tokens,
+        top_p=1,
+    )
+
+def summarize_file_text(text):
+    """Summarize extracted file text with map-reduce, returning the summary tree or None if the model calls fail"""
+    try:
+        result = summarizer.summarize(text, complete_summary_prompts)
+        logger.info(f"Generated summary of length {len(result['summary'])} with {result['calls']} model calls")
+        return summarizer.build_tree(result, FILE_SUMMARY_MODEL)
+    except Exception as api_error:
+        logger.error(f"Error calling Groq API: {str(api_error)}")
+        return None
+
 @app.route("/api/summarize-pdf", methods=["POST"])
 def summarize_pdf():
     """Endpoint to summarize uploaded file content"""
     if db is None:
         return jsonify({"success": False, "message": "Database connection is not available"}), 500
 
-    if 'pdf' not in request.files:
-        return jsonify({"success": False, "message": "No file provided"}), 400
-
-    uploaded_file = request.files['pdf']
+    # The upload is streamed to disk, size-limited and hashed while the form is parsed
+    try:
+        if 'pdf' not in request.files:
+            return jsonify({"success": False, "message": "No file provided"}), 400
+        uploaded_file = request.files['pdf']
+    except UploadTooLarge as e:
+        return jsonify({"success": False, "message": e.description}), 413
 
     if uploaded_file.filename == '':
         return jsonify({"success": False, "message": "Empty file"}), 400
 
-    # Check file size (limit to 10MB)
-    if uploaded_file.content_length and uploaded_file.content_length > 10 * 1024 * 1024:
-        return jsonify({"success": False, "message": "File size exceeds 10MB limit"}), 400
-
     try:
-        # Create temp directory if it doesn't exist with proper permissions
-        create_directory_with_permissions("temp")
+        upload = upload_io.ingest(uploaded_file.stream, "temp", upload_io.FILE_UPLOAD_MAX_BYTES, uploaded_file.filename)
+    except UploadTooLarge as e:
+        return jsonify({"success": False, "message": e.description}), 413
 
-        # Get file extension
-        file_ext = os.path.splitext(uploaded_file.filename)[1].lower()
+    try:
         content_type = uploaded_file.content_type
-        
-        # Save the file to a temporary location
-        temp_file_name = f"temp_file_{datetime.now().timestamp()}_{random.randint(1000, 9999)}{file_ext}"
-        temp_file_path = os.path.join("temp", temp_file_name)
-        uploaded_file.save(temp_file_path)
-        logger.info(f"Saved temporary file to {temp_file_path}, type: {content_type}")
 
-        # Extract text based on file type
-        try:
-            full_text = extract_text_from_file(temp_file_path, content_type)
-            if not full_text or not full_text.strip():
-                return jsonify({"success": False, "message": "Could not extract any text from the file. The file might be empty, encrypted, or contains no readable text."}), 400
-            logger.info(f"Extracted {len(full_text)} characters from file")
-        except Exception as extraction_error:
-            logger.error(f"Error extracting text from file: {str(extraction_error)}")
-            return jsonify({"success": False, "message": f"Failed to extract text from file: {str(extraction_error)}"}), 500
-        finally:
-            # Clean up temporary file
+        # Pick the extractor from the file's actual bytes, not just its declared type
+        file_type = upload_io.detect_file_type(upload.kind, uploaded_file.filename, content_type)
+        if file_type is None:
+            logger.warning(f"Rejected upload {uploaded_file.filename}: content sniffed as {upload.kind}")
+            return jsonify({"success": False, "message": "Unsupported file type or the file content does not match its extension"}), 415
+
+        # The same file uploaded again is served from the content-addressed cache
+        content_hash = upload.sha256
+        cached_doc = file_cache.lookup(db, content_hash)
+        summary = file_cache.get_summary(cached_doc, FILE_SUMMARY_MODEL)
+        if summary is not None:
+            logger.info(f"Serving cached summary for file {content_hash[:12]}")
+            file_content_id = str(cached_doc["_id"])
+            document_qa.schedule_index(
+                file_content_id,
+                lambda: file_cache.get_content(db, file_content_id),
+                {"filename": cached_doc.get("filename")}
+            )
+            return jsonify({
+                "success": True,
+                "summary": summary,
+                "fileContentId": file_content_id,
+                "fileName": uploaded_file.filename,
+                "fileType": content_type,
+                "sectionCount": (cached_doc.get("summary_tree") or {}).get("sections"),
+                "cached": True
+            })
+
+        if cached_doc is not None:
+            # Text was extracted before but the summary is missing or from another model
+            file_content_id = str(cached_doc["_id"])
+            truncated_text = file_cache.get_content(db, file_content_id) or ""
+        else:
+            # Extract text from the file as it was streamed to disk
+            logger.info(f"Ingested {upload.size} bytes to {upload.path}, type: {file_type} (sniffed {upload.kind})")
+            upload.flush()
             try:
-                if os.path.exists(temp_file_path):
-                    os.remove(temp_file_path)
-                    logger.info(f"Removed temporary file: {temp_file_path}")
-            except Exception as cleanup_error:
-                logger.warning(f"Failed to remove temporary file: {str(cleanup_error)}")
-
-        # Initialize content collection if it doesn't exist
-        if "file_contents" not in db.list_collection_names():
-            db.create_collection("file_contents")
-            logger.info("Created file_contents collection")
-
-        # Store extracted text in MongoDB collection
-        # Limit text length to avoid MongoDB document size limits
-        max_text_length = 500000  # MongoDB documents have a 16MB limit
-        truncated_text = full_text[:max_text_length] if len(full_text) > max_text_length else full_text
-        file_content_doc = {
-            "filename": uploaded_file.filename,
-            "content_type": content_type,
-            "content": truncated_text,
-            "uploaded_at": datetime.utcnow()
-        }
-        result = db.file_contents.insert_one(file_content_doc)
-        file_content_id = str(result.inserted_id)
+                full_text = extract_text_from_file(upload.path, file_type)
+                if not full_text or not full_text.strip():
+                    return jsonify({"success": False, "message": "Could not extract any text from the file. The file might be empty, encrypted, or contains no readable text."}), 400
+                logger.info(f"Extracted {len(full_text)} characters from file")
+            except Exception as extraction_error:
+                logger.error(f"Error extracting text from file: {str(extraction_error)}")
+                return jsonify({"success": False, "message": f"Failed to extract text from file: {str(extraction_error)}"}), 500
+
+            # Store extracted text in MongoDB collection, once per distinct file
+            # Limit text length to avoid MongoDB document size limits
+            max_text_length = 500000  # MongoDB documents have a 16MB limit
+            truncated_text = full_text[:max_text_length] if len(full_text) > max_text_length else full_text
+            file_content_id = file_cache.store_content(
+                db, content_hash, uploaded_file.filename, content_type, truncated_text
+            )
 
-        # Use Groq API to summarize the extracted text
-        # Limit prompt size to avoid token limits
-        max_prompt_size = 4000
-        text_to_summarize = truncated_text[:max_prompt_size] if len(truncated_text) > max_prompt_size else truncated_text
-        
-        try:
-            prompt = f"Summarize the following text extract from a file. Provide a clear, concise overview that tells what the file is about, including key topics, structure, and important insights:\n\n{text_to_summarize}"
-            summary = groq_client.chat.completions.create(
-                model="llama3-8b-8192",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.5,
-                max_tokens=512,
-                top_p=1,
-                frequency_penalty=0,
-                presence_penalty=0,
-                stop=None,
-            ).choices[0].message.content
-            logger.info(f"Generated summary of length {len(summary)}")
-        except Exception as api_error:
-            logger.error(f"Error calling Groq API: {str(api_error)}")
+        # Chunk and embed the file for question answering while the summary is generated
+        document_qa.schedule_index(file_content_id, lambda: truncated_text, {"filename": uploaded_file.filename})
+
+        summary_tree = summarize_file_text(truncated_text)
+        if summary_tree is not None:
+            summary = summary_tree["levels"][-1][0]["summary"]
+            file_cache.store_summary(db, file_content_id, summary, FILE_SUMMARY_MODEL, summary_tree)
+        else:
             summary = "Failed to generate summary. You can still ask questions about the document below."
 
         return jsonify({
@@ -1369,7 +1522,9 @@ def summarize_pdf():
             "summary": summary,
             "fileContentId": file_content_id,
             "fileName": uploaded_file.filename,
-            "fileType": content_type
+            "fileType": content_type,
+            "sectionCount": summary_tree["sections"] if summary_tree else None,
+            "cached": cached_doc is not None
         })
     except Exception as e:
         logger.error(f"Error summarizing file: {str(e)}")
@@ -1377,6 +1532,87 @@ def summarize_pdf():
             "success": False,
             "message": f"Failed to process file: {str(e)}"
         }), 500
+    finally:
+        # Removes the ingested file
+        upload.close()
+
+@app.route("/api/file-summary/<file_content_id>", methods=["GET"])
+def get_file_summary(file_content_id):
+    """
+    Answer follow-up summary requests from a file's stored summary tree
+
+    Query parameters (at most one):
+        section: 1-based section number - that section's summary
+        level: 0-based tree level - every summary on that level (0 = sections)
+        detail: "short", "medium" (default) or "detailed" - summary length
+    """
+    if db is None:
+        return jsonify({"success": False, "message": "Database connection is not available"}), 500
+
+    try:
+        file_doc = file_cache.get_summary_tree(db, file_content_id)
+    except Exception:
+        return jsonify({"success": False, "message": "Invalid file content ID"}), 400
+    if not file_doc:
+        return jsonify({"success": False, "message": "File content not found"}), 404
+
+    try:
+        tree = file_doc.get("summary_tree")
+        generated = False
+        if not tree or tree.get("model") != FILE_SUMMARY_MODEL:
+            # Summarized before trees were stored, or by another model: build it once from the stored text
+            text = file_cache.get_content(db, file_content_id)
+            tree = summarize_file_text(text or "")
+            if tree is None:
+                return jsonify({"success": False, "message": "Failed to generate summary"}), 502
+            file_cache.store_summary(db, file_content_id, tree["levels"][-1][0]["summary"], FILE_SUMMARY_MODEL, tree)
+            generated = True
+
+        levels = tree["levels"]
+        response = {"success": True, "fileContentId": file_content_id, "fileName": file_doc.get("filename"),
+                    "sectionCount": tree["sections"], "levelCount": len(levels)}
+
+        section = request.args.get("section", type=int)
+        level = request.args.get("level", type=int)
+        detail = request.args.get("detail", "medium")
+
+        if section is not None:
+            if not 1 <= section <= tree["sections"]:
+                return jsonify({"success": False, "message": f"Section must be between 1 and {tree['sections']}"}), 400
+            node = summarizer.get_section(tree, section - 1)
+            if node is None:
+                # Skipped by the call budget when the tree was built
+                text = file_cache.get_content(db, file_content_id) or ""
+                node = summarizer.summarize_section(text, tree, section - 1, complete_summary_prompts)
+                file_cache.add_tree_section(db, file_content_id, node)
+                generated = True
+            response.update({"section": section, "summary": node["summary"]})
+        elif level is not None:
+            if not 0 <= level < len(levels):
+                return jsonify({"success": False, "message": f"Level must be between 0 and {len(levels) - 1}"}), 400
+            response.update({"level": level, "summaries": [
+                {"sections": [node["start"] + 1, node["end"]], "summary": node["summary"]} for node in levels[level]
+            ]})
+        elif detail == "short":
+            short = tree.get("short")
+            if not short:
+                # Condensed from the root summary, not the document
+                short = summarizer.condense(levels[-1][0]["summary"], complete_summary_prompts)
+                file_cache.set_tree_short_summary(db, file_content_id, short)
+                generated = True
+            response.update({"detail": "short", "summary": short})
+        elif detail == "detailed":
+            # The level below the root: one summary per group of sections
+            nodes = levels[-2] if len(levels) > 1 else levels[-1]
+            response.update({"detail": "detailed", "summary": "\n\n".join(node["summary"] for node in nodes)})
+        else:
+            response.update({"detail": "medium", "summary": levels[-1][0]["summary"]})
+
+        response["cached"] = not generated
+        return jsonify(response)
+    except Exception as e:
+        logger.error(f"Error getting file summary: {str(e)}")
+        return jsonify({"success": False, "message": f"Failed to get summary: {str(e)}"}), 500
 
 @app.route("/api/ask-pdf-question", methods=["POST"])
 def ask_pdf_question():
@@ -1392,12 +1628,14 @@ def ask_pdf_question():
         return jsonify({"success": False, "message": "Missing fileContentId or question"}), 400
 
     try:
-        # Retrieve file content from MongoDB
+        # Retrieve file metadata from MongoDB; the text itself is only loaded if it has to be indexed
         try:
             # Look in both collections for backward compatibility
-            file_doc = db.file_contents.find_one({"_id": ObjectId(file_content_id)})
+            file_collection = db.file_contents
+            file_doc = file_collection.find_one({"_id": ObjectId(file_content_id)}, {"content": 0})
             if not file_doc:
-                file_doc = db.pdf_contents.find_one({"_id": ObjectId(file_content_id)})
+                file_collection = db.pdf_contents
+                file_doc = file_collection.find_one({"_id": ObjectId(file_content_id)}, {"content": 0})
                 
         except Exception as db_error:
             logger.error(f"Error retrieving file content: {str(db_error)}")
@@ -1406,12 +1644,15 @@ def ask_pdf_question():
         if not file_doc:
             return jsonify({"success": False, "message": "File content not found"}), 404
 
-        file_text = file_doc.get("content", "")
         file_name = file_doc.get("filename", "Document")
         content_type = file_doc.get("content_type", "text/plain")
 
-        if not file_text.strip():
-            return jsonify({"success": False, "message": "Stored file content is empty"}), 400
+        loaded_text = []
+        def load_text():
+            if not loaded_text:
+                doc = file_collection.find_one({"_id": file_doc["_id"]}, {"content": 1}) or {}
+                loaded_text.append(doc.get("content", ""))
+            return loaded_text[0]
 
         # Use a larger model for better comprehension, if available
         model = "llama3-70b-8192" if "llama3-70b-8192" in MODEL_MAPPING.values() else "llama3-8b-8192"
@@ -1423,41 +1664,47 @@ def ask_pdf_question():
             Please respond professionally, let them know you're ready to answer questions about the document,
             and provide a brief 1-2 sentence overview of what the document appears to be about."""
         else:
-            # Limit context size to avoid token limits but keep enough context
-            max_context_size = 6000  # Increased from 4000
-            truncated_text = file_text[:max_context_size] if len(file_text) > max_context_size else file_text
-            
-            prompt = f"""You are a document analysis AI assistant. Your task is to answer questions based EXCLUSIVELY on the 
-            information provided in the following {content_type} file named '{file_name}'.
+            prompt_template = f"""You are a document analysis AI assistant. Your task is to answer questions based EXCLUSIVELY on the 
+            information provided in the following excerpts of a {content_type} file named '{file_name}'.
 
-            DOCUMENT CONTENT:
+            DOCUMENT EXCERPTS:
             ```
-            {truncated_text}
+            {{context}}
             ```
 
             USER QUESTION: {question}
 
             Important instructions:
-            1. Answer ONLY based on information in the document above.
-            2. If the answer is not in the document, clearly state that you cannot find this information in the document.
+            1. Answer ONLY based on information in the document excerpts above.
+            2. If the answer is not in the excerpts, clearly state that you cannot find this information in the document.
             3. Do NOT make up information or use your general knowledge unless it directly relates to understanding the document.
             4. Provide specific references to where in the document you found the information when possible.
             5. Be concise but thorough in your answer.
             """
 
+            # Only the parts of the file relevant to the question are sent, within the model's budget
+            budget = chat_context.prompt_budget(model) - chat_context.estimate_tokens(prompt_template)
+            document_context = document_qa.build_context(
+                file_content_id, question, load_text, budget=budget, metadata={"filename": file_name}
+            )
+            if not document_context["context"].strip():
+                return jsonify({"success": False, "message": "Stored file content is empty"}), 400
+            prompt = prompt_template.replace("{context}", document_context["context"], 1)
+            logger.info(f"Using {document_context['chunks']} document chunks ({document_context['mode']})")
+
         logger.info(f"Sending document question to model {model} with prompt length {len(prompt)}")
         
         try:
-            answer = groq_client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
+            answer = llm_gateway.complete(
+                model,
+                [{"role": "user", "content": prompt}],
                 temperature=0.3,  # Lower temperature for more factual responses
                 max_tokens=800,   # Increased to allow for more detailed answers
                 top_p=1,
                 frequency_penalty=0,
                 presence_penalty=0,
                 stop=None,
-            ).choices[0].message.content
+            )
         except Exception as api_error:
             logger.error(f"Error calling Groq API: {str(api_error)}")
             answer = "I'm sorry, I encountered an error processing your question about this document. Please try again later."
@@ -1662,8 +1909,12 @@ def upload_training_data():
     if db is None:
         return jsonify({"success": False, "message": "Database connection is not available"}), 500
     
-    if 'file' not in request.files:
-        return jsonify({"success": False, "message": "No file provided"}), 400
+    # The upload is streamed to disk, size-limited and hashed while the form is parsed
+    try:
+        if 'file' not in request.files:
+            return jsonify({"success": False, "message": "No file provided"}), 400
+    except UploadTooLarge as e:
+        return jsonify({"success": False, "message": e.description}), 413
     
     user_id = request.form.get("userId")
     if not user_id:
@@ -1677,22 +1928,26 @@ def upload_training_data():
     if uploaded_file.filename == '':
         return jsonify({"success": False, "message": "Empty file"}), 400
     
-    # Check file size (limit to 50MB)
-    if uploaded_file.content_length and uploaded_file.content_length > 50 * 1024 * 1024:
-        return jsonify({"success": False, "message": "File size exceeds 50MB limit"}), 400
+    try:
+        upload = upload_io.ingest(
+            uploaded_file.stream, "training_data", upload_io.TRAINING_UPLOAD_MAX_BYTES, uploaded_file.filename
+        )
+    except UploadTooLarge as e:
+        return jsonify({"success": False, "message": e.description}), 413
+    
+    # Training data is CSV, JSON or plain text
+    if upload.kind != "text":
+        upload.close()
+        logger.warning(f"Rejected training upload {uploaded_file.filename}: content sniffed as {upload.kind}")
+        return jsonify({"success": False, "message": "Training data must be a CSV, JSON or text file"}), 415
     
     try:
-        # Create training_data directory if it doesn't exist
-        create_directory_with_permissions("training_data")
-        
-        # Save the file with a unique name
+        # Keep the streamed file under a unique name
         file_ext = os.path.splitext(uploaded_file.filename)[1].lower()
         content_type = uploaded_file.content_type
         file_name = f"training_{user_id}_{datetime.now().timestamp()}{file_ext}"
-        file_path = os.path.join("training_data", file_name)
-        
-        uploaded_file.save(file_path)
-        logger.info(f"Saved training data file to {file_path}")
+        file_path = upload.persist(os.path.join("training_data", file_name))
+        logger.info(f"Saved training data file to {file_path} ({upload.size} bytes, sha256 {upload.sha256[:12]})")
         
         # Create entry in training_data collection
         training_data = {
@@ -1702,24 +1957,27 @@ def upload_training_data():
             "file_path": file_path,
             "file_type": file_ext if file_ext else content_type,
             "data_format": data_format,
+            "file_size": upload.size,
+            "content_hash": upload.sha256,
             "created_at": datetime.now(),
-            "processed": False
+            "processed": False,
+            "status": "queued",
+            "progress": 0.0
         }
         
         result = db.training_data.insert_one(training_data)
         data_id = str(result.inserted_id)
         
-        # Process the training data in the background
-        # In production, you would use a task queue like Celery
-        # For simplicity, we'll do it synchronously here
-        processing_success = training.process_training_data(data_id)
+        # Parsing happens on the background workers; clients poll /api/training/data for status
+        training_queue.enqueue(db, data_id)
         
         return jsonify({
             "success": True,
-            "message": "Training data uploaded successfully",
+            "message": "Training data uploaded and queued for processing",
             "dataId": data_id,
-            "processed": processing_success
-        })
+            "status": "queued",
+            "processed": False
+        }), 202
     except Exception as e:
         logger.error(f"Error uploading training data: {str(e)}")
         return jsonify({"success": False, "message": f"Failed to upload training data: {str(e)}"}), 500
@@ -1748,6 +2006,10 @@ def get_training_data():
                 "format": data["data_format"],
                 "createdAt": data["created_at"].isoformat(),
                 "processed": data["processed"],
+                # Uploads from before the processing queue have no status
+                "status": data.get("status", "ready" if data["processed"] else "failed"),
+                "progress": data.get("progress", 1.0 if data["processed"] else 0.0),
+                "error": data.get("error"),
                 "rowCount": data.get("row_count", "Unknown")
             })
         
@@ -2103,6 +2365,8 @@ def index_document_endpoint():
     
     if not document_id or not text:
         return jsonify({"success": False, "message": "Document ID and text are required"}), 400
+    if str(document_id).startswith(document_qa.KEY_PREFIX):
+        return jsonify({"success": False, "message": "Document IDs starting with 'file:' are reserved"}), 400
     
     try:
         # Index the document
@@ -2122,6 +2386,45 @@ def index_document_endpoint():
         logger.error(f"Error indexing document: {str(e)}")
         return jsonify({"success": False, "message": f"Failed to index document: {str(e)}"}), 500
 
+@app.route("/api/document/index/batch", methods=["POST"])
+def index_documents_batch_endpoint():
+    """Index many documents for semantic search in one request"""
+    if db is None:
+        return jsonify({"success": False, "message": "Database connection is not available"}), 500
+    
+    data = request.get_json()
+    if not data:
+        return jsonify({"success": False, "message": "No data provided"}), 400
+    
+    documents = data.get("documents")
+    if not documents or not isinstance(documents, list):
+        return jsonify({"success": False, "message": "A non-empty list of documents is required"}), 400
+    
+    batch = []
+    for doc in documents:
+        if not isinstance(doc, dict) or not doc.get("documentId") or not doc.get("text"):
+            return jsonify({"success": False, "message": "Each document needs a documentId and text"}), 400
+        if str(doc["documentId"]).startswith(document_qa.KEY_PREFIX):
+            return jsonify({"success": False, "message": "Document IDs starting with 'file:' are reserved"}), 400
+        batch.append({
+            "document_id": doc["documentId"],
+            "text": doc["text"],
+            "metadata": doc.get("metadata", {})
+        })
+    
+    try:
+        results = model_utils.index_documents(batch)
+        failed = [document_id for document_id, indexed in results.items() if not indexed]
+        
+        return jsonify({
+            "success": not failed,
+            "message": "Documents indexed successfully" if not failed else f"Failed to index {len(failed)} document(s). Check logs for details.",
+            "results": results
+        }), (200 if not failed else 207)
+    except Exception as e:
+        logger.error(f"Error indexing documents: {str(e)}")
+        return jsonify({"success": False, "message": f"Failed to index documents: {str(e)}"}), 500
+
 @app.route("/api/document/search", methods=["POST"])
 def search_documents_endpoint():
     """Search indexed documents using semantic similarity"""
@@ -2139,8 +2442,8 @@ def search_documents_endpoint():
         return jsonify({"success": False, "message": "Search query is required"}), 400
     
     try:
-        # Search documents
-        results = model_utils.search_documents(query, limit)
+        # Search documents; chunks of uploaded files are private to the file's questions
+        results = model_utils.search_documents(query, limit, exclude_prefix=document_qa.KEY_PREFIX)
         
         return jsonify({
             "success": True,
@@ -2150,6 +2453,19 @@ def search_documents_endpoint():
         logger.error(f"Error searching documents: {str(e)}")
         return jsonify({"success": False, "message": f"Failed to search documents: {str(e)}"}), 500
 
+@app.route("/api/document/embedding-stats", methods=["GET"])
+def embedding_stats_endpoint():
+    """Get embedding model registry counters and vector index statistics"""
+    try:
+        return jsonify({
+            "success": True,
+            "stats": model_utils.get_embedding_model_stats(),
+            "index": model_utils.get_vector_index_stats()
+        })
+    except Exception as e:
+        logger.error(f"Error getting embedding stats: {str(e)}")
+        return jsonify({"success": False, "message": f"Failed to get embedding stats: {str(e)}"}), 500
+
 @app.route("/api/profile/<user_id>", methods=["GET"])
 def get_user_profile(user_id):
     """Get user profile by ID"""
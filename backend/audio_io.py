@@ -0,0 +1,124 @@
+"""
+In-memory audio ingestion for speech recognition.
+
+Speech uploads are read in fixed-size chunks straight into memory, whether
+they arrive as a multipart form field or as a raw (optionally chunked
+transfer-encoded) audio body, then decoded and resampled in memory. No
+temporary file is written per request.
+"""
+import io
+import os
+import logging
+from typing import BinaryIO, Optional
+
+import speech_recognition as sr
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+logger = logging.getLogger(__name__)
+
+AUDIO_MAX_UPLOAD_BYTES = int(os.getenv("AUDIO_MAX_UPLOAD_MB", "10")) * 1024 * 1024
+AUDIO_READ_CHUNK_BYTES = 64 * 1024
+# Recognition services work at 16 kHz; resampling once here keeps every recognition attempt small
+SPEECH_SAMPLE_RATE = int(os.getenv("SPEECH_SAMPLE_RATE", "16000"))
+
+# Endpoints whose multipart file fields are kept in memory instead of being spooled to disk
+IN_MEMORY_UPLOAD_PATHS = {"/api/speech-to-text"}
+
+
+class AudioTooLarge(RequestEntityTooLarge):
+    """Raised when an audio upload exceeds AUDIO_MAX_UPLOAD_BYTES"""
+
+
+class BoundedBuffer(io.BytesIO):
+    """
+    In-memory buffer that refuses to grow past a size limit
+
+    Chunked uploads carry no Content-Length, so the limit is enforced as the
+    multipart parser writes into the buffer.
+    """
+
+    def __init__(self, max_bytes: int = AUDIO_MAX_UPLOAD_BYTES):
+        super().__init__()
+        self.max_bytes = max_bytes
+
+    def write(self, data) -> int:
+        if self.tell() + len(data) > self.max_bytes:
+            raise AudioTooLarge(f"Audio upload exceeds {self.max_bytes} bytes")
+        return super().write(data)
+
+
+class InMemoryUploadRequest(Request):
+    """
+    Flask request that buffers file uploads of IN_MEMORY_UPLOAD_PATHS in memory
+
+    Werkzeug spools uploads larger than 500KB to a temporary file by default.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.path in IN_MEMORY_UPLOAD_PATHS:
+            if total_content_length is not None and total_content_length > AUDIO_MAX_UPLOAD_BYTES:
+                raise AudioTooLarge(f"Audio upload exceeds {AUDIO_MAX_UPLOAD_BYTES} bytes")
+            return BoundedBuffer()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+def read_upload(stream: BinaryIO, max_bytes: int = AUDIO_MAX_UPLOAD_BYTES) -> io.BytesIO:
+    """
+    Read an upload stream into an in-memory buffer
+
+    Buffers that are already in memory are used as they are, without copying.
+
+    Args:
+        stream: Uploaded file stream or raw request body
+        max_bytes: Maximum accepted size
+
+    Returns:
+        io.BytesIO positioned at the start
+
+    Raises:
+        AudioTooLarge: If the upload is larger than max_bytes
+    """
+    if isinstance(stream, io.BytesIO):
+        if stream.getbuffer().nbytes > max_bytes:
+            raise AudioTooLarge(f"Audio upload exceeds {max_bytes} bytes")
+        stream.seek(0)
+        return stream
+
+    buffer = io.BytesIO()
+    while True:
+        chunk = stream.read(AUDIO_READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        if buffer.tell() + len(chunk) > max_bytes:
+            raise AudioTooLarge(f"Audio upload exceeds {max_bytes} bytes")
+        buffer.write(chunk)
+    buffer.seek(0)
+    return buffer
+
+
+def decode_audio(buffer: BinaryIO, recognizer: sr.Recognizer,
+                 sample_rate: Optional[int] = SPEECH_SAMPLE_RATE) -> sr.AudioData:
+    """
+    Decode WAV/AIFF/FLAC audio from memory and resample it for recognition
+
+    Args:
+        buffer: In-memory audio file
+        recognizer: speech_recognition.Recognizer used to read the audio
+        sample_rate: Target sample rate (None keeps the original; audio is never upsampled)
+
+    Returns:
+        speech_recognition.AudioData as 16-bit mono PCM
+    """
+    with sr.AudioFile(buffer) as source:
+        audio_data = recognizer.record(source)
+
+    rate = audio_data.sample_rate
+    if sample_rate and rate > sample_rate:
+        rate = sample_rate
+    if rate == audio_data.sample_rate and audio_data.sample_width == 2:
+        return audio_data
+
+    logger.debug(f"Resampling audio from {audio_data.sample_rate} Hz/{audio_data.sample_width * 8}-bit "
+                 f"to {rate} Hz/16-bit")
+    return sr.AudioData(audio_data.get_raw_data(convert_rate=rate, convert_width=2), rate, 2)
@@ -0,0 +1,215 @@
+"""
+Conversation context for chat completions.
+
+Builds the message list sent to the LLM from the tail of a chat's history,
+keeping the prompt within a per-model token budget. Messages that fall out of
+the window are folded into a rolling per-chat summary, which is refreshed in
+the background and sent as a system message.
+"""
+import os
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import chat_store
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+    tiktoken_available = True
+except Exception:
+    _encoding = None
+    tiktoken_available = False
+
+# Context window of each Groq model in MODEL_MAPPING
+MODEL_CONTEXT_WINDOWS = {
+    "llama-3.3-70b-versatile": 131072,
+    "llama3-70b-8192": 8192,
+    "llama2-70b-4096": 4096
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Upper bound on prompt tokens regardless of window size, to bound latency and cost
+CHAT_CONTEXT_MAX_TOKENS = int(os.getenv("CHAT_CONTEXT_MAX_TOKENS", "6000"))
+# Number of most recent messages fetched from the chat
+CHAT_CONTEXT_MAX_MESSAGES = int(os.getenv("CHAT_CONTEXT_MAX_MESSAGES", "20"))
+# Refresh the summary once this many messages have fallen out of the window unsummarized
+CHAT_SUMMARY_MIN_MESSAGES = int(os.getenv("CHAT_SUMMARY_MIN_MESSAGES", "10"))
+
+# Tokens kept free for the reply and per-message formatting
+RESPONSE_TOKENS = 1024
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_summaries_in_progress = set()
+_summaries_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a text
+
+    Uses tiktoken when installed. Otherwise assumes ~4 ASCII characters per
+    token and ~1.5 characters per token for Indic and other non-Latin scripts.
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        int: Estimated token count
+    """
+    if not text:
+        return 0
+    if tiktoken_available:
+        return len(_encoding.encode(text, disallowed_special=()))
+
+    # Non-ASCII characters in these scripts are 3 bytes in UTF-8
+    non_ascii = (len(text.encode('utf-8')) - len(text)) // 2
+    return int((len(text) - non_ascii) / 4 + non_ascii / 1.5) + 1
+
+
+def prompt_budget(model: str) -> int:
+    """
+    Get the number of prompt tokens available for a model
+
+    Args:
+        model: Groq model name
+
+    Returns:
+        int: Token budget for the prompt messages
+    """
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    return min(window - RESPONSE_TOKENS, CHAT_CONTEXT_MAX_TOKENS)
+
+
+def fetch_recent_history(db, chat_id: str, user_id: str, limit: int = CHAT_CONTEXT_MAX_MESSAGES) -> Tuple[List[Dict[str, Any]], int, Optional[str], int]:
+    """
+    Fetch the last messages of a chat from its tail buckets
+
+    Args:
+        db: MongoDB database
+        chat_id: ID of the chat
+        user_id: ID of the chat owner
+        limit: Maximum number of messages to return
+
+    Returns:
+        Tuple of (recent messages, total message count, summary, number of messages covered by the summary)
+    """
+    header, messages = chat_store.get_recent_messages(db, chat_id, user_id, limit, ("context_summary", "summary_upto"))
+    if header is None:
+        return [], 0, None, 0
+    return (
+        messages,
+        header.get("message_count", 0),
+        header.get("context_summary"),
+        header.get("summary_upto", 0)
+    )
+
+
+def build_context(db, chat_id: str, user_id: str, user_message: str,
+                  model: str) -> Tuple[List[Dict[str, str]], Optional[int]]:
+    """
+    Build the prior conversation to send before the new user message
+
+    Args:
+        db: MongoDB database
+        chat_id: ID of the chat
+        user_id: ID of the chat owner
+        user_message: The new user message
+        model: Groq model name
+
+    Returns:
+        Tuple of (history messages in chat-completion format, index of the first message in the
+        window if the summary should be extended up to it, else None)
+    """
+    recent, total, summary, summary_upto = fetch_recent_history(db, chat_id, user_id)
+    if not recent:
+        return [], None
+
+    budget = prompt_budget(model) - estimate_tokens(user_message) - MESSAGE_OVERHEAD_TOKENS
+    summary_message = None
+    if summary:
+        summary_message = {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+        budget -= estimate_tokens(summary_message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    # Walk back from the newest message until the budget is spent
+    history = []
+    for message in reversed(recent):
+        cost = estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+        if cost > budget:
+            break
+        budget -= cost
+        history.append({
+            "role": "assistant" if message.get("role") == "bot" else "user",
+            "content": message.get("content", "")
+        })
+    history.reverse()
+
+    if summary_message:
+        history.insert(0, summary_message)
+
+    # Messages older than the window that the summary doesn't cover yet
+    window_start = total - (len(history) - (1 if summary_message else 0))
+    if window_start - summary_upto >= CHAT_SUMMARY_MIN_MESSAGES:
+        return history, window_start
+    return history, None
+
+
+def refresh_summary(db, chat_id: str, user_id: str, summarize: Callable[[str], str], upto: int) -> bool:
+    """
+    Fold messages that left the context window into the chat's rolling summary
+
+    Args:
+        db: MongoDB database
+        chat_id: ID of the chat
+        user_id: ID of the chat owner
+        summarize: Function that sends a prompt to the LLM and returns its reply
+        upto: Index of the first message still in the context window (from build_context);
+            the summary covers every message before it
+
+    Returns:
+        bool: True if the summary was updated
+    """
+    with _summaries_lock:
+        if chat_id in _summaries_in_progress:
+            return False
+        _summaries_in_progress.add(chat_id)
+
+    try:
+        chat = chat_store.get_header(db, chat_id, user_id, ("context_summary", "summary_upto"))
+        if not chat:
+            return False
+
+        summary_upto = chat.get("summary_upto", 0)
+        new_upto = min(upto, chat.get("message_count", 0))
+        if new_upto - summary_upto < CHAT_SUMMARY_MIN_MESSAGES:
+            return False
+
+        transcript = "\n".join(
+            f"{'Assistant' if message.get('role') == 'bot' else 'User'}: {message.get('content', '')}"
+            for message in chat_store.get_message_range(db, chat_id, summary_upto, new_upto)
+        )
+
+        previous = chat.get("context_summary")
+        prompt = (
+            "Update the running summary of a conversation. Keep names, facts, decisions and open questions; "
+            "drop small talk. Reply with the summary only, in at most 200 words.\n\n"
+            f"Current summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"
+        )
+        summary = summarize(prompt)
+        if not summary:
+            return False
+
+        db.chats.update_one(
+            {"_id": chat_id, "user_id": user_id},
+            {"$set": {"context_summary": summary, "summary_upto": new_upto}}
+        )
+        logger.info(f"Refreshed context summary for chat {chat_id} up to message {new_upto}")
+        return True
+    except Exception as e:
+        logger.error(f"Error refreshing chat summary: {str(e)}")
+        return False
+    finally:
+        with _summaries_lock:
+            _summaries_in_progress.discard(chat_id)
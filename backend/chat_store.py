@@ -0,0 +1,570 @@
+"""
+Bucketed storage for chat history.
+
+Each chat is a small header document in ``chats`` (title, owner, timestamps,
+message count, last message, rolling summary). Its messages live in
+``chat_messages`` buckets of at most CHAT_BUCKET_SIZE messages, keyed by
+(chat_id, bucket). Message ``seq`` numbers are allocated atomically with
+``$inc`` on the header, so a message's bucket is ``seq // CHAT_BUCKET_SIZE``
+and appends and tail reads only ever touch one or two small documents,
+however long the conversation grows.
+
+Chats written before buckets existed keep their messages in an embedded
+``messages`` array on the header. They are migrated the first time they are
+read or appended to, or in bulk with migrate_chats.py.
+"""
+import os
+import base64
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pymongo
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+CHAT_BUCKET_SIZE = int(os.getenv("CHAT_BUCKET_SIZE", "100"))
+
+DEFAULT_CHAT_PAGE_SIZE = 20
+MAX_CHAT_PAGE_SIZE = 100
+DEFAULT_MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+PREVIEW_CHARS = 120
+
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _preview(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Short copy of a message kept on the chat header for listings"""
+    return {
+        "role": message["role"],
+        "content": message["content"][:PREVIEW_CHARS],
+        "timestamp": message.get("timestamp")
+    }
+
+
+def format_message(message: Dict[str, Any], index: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Format a stored message for the API
+
+    Args:
+        message: Message document
+        index: Position of the message in the chat
+
+    Returns:
+        Dict with role, content, language and ISO timestamp
+    """
+    formatted = {
+        "role": message["role"],
+        "content": message["content"],
+        "language": message.get("language", "en"),
+        "timestamp": _isoformat(message.get("timestamp"))
+    }
+    if index is not None:
+        formatted["index"] = index
+    return formatted
+
+
+def encode_cursor(updated_at: datetime, chat_id: str) -> str:
+    """Encode a chat listing position as an opaque URL-safe cursor"""
+    payload = json.dumps([_isoformat(updated_at), chat_id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Decode a cursor produced by encode_cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        updated_at, chat_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(updated_at), chat_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def create_chat(db, chat_id: str, user_id: str, title: str) -> Dict[str, Any]:
+    """
+    Insert an empty chat header
+
+    Raises:
+        DuplicateKeyError: If a chat with this ID already exists
+    """
+    now = datetime.now()
+    header = {
+        "_id": chat_id,
+        "user_id": user_id,
+        "title": title,
+        "message_count": 0,
+        "last_message": None,
+        "created_at": now,
+        "updated_at": now
+    }
+    db.chats.insert_one(header)
+    return header
+
+
+def get_header(db, chat_id: str, user_id: str, fields: Sequence[str] = ()) -> Optional[Dict[str, Any]]:
+    """
+    Get a chat header, migrating the chat to buckets first if needed
+
+    Args:
+        db: MongoDB database
+        chat_id: ID of the chat
+        user_id: ID of the chat owner
+        fields: Header fields to return in addition to title and message_count
+
+    Returns:
+        Header document or None if the chat doesn't exist
+    """
+    projection = {"title": 1, "message_count": 1, "messages": {"$slice": 0}}
+    projection.update({field: 1 for field in fields})
+    header = db.chats.find_one({"_id": chat_id, "user_id": user_id}, projection)
+    if header is not None and "messages" in header:
+        migrate_chat(db, db.chats.find_one({"_id": chat_id}))
+        header = db.chats.find_one({"_id": chat_id, "user_id": user_id}, projection)
+    return header
+
+
+def append_messages(db, chat_id: str, user_id: str, messages: List[Dict[str, Any]],
+                    title: Optional[str] = None) -> Optional[int]:
+    """
+    Append messages to the tail of a chat
+
+    The header is updated with a single atomic find-and-modify. When a title
+    is given it is an upsert, so the chat is created by whichever request gets
+    there first and concurrent first messages can't race each other.
+
+    Args:
+        db: MongoDB database
+        chat_id: ID of the chat
+        user_id: ID of the chat owner
+        messages: Messages to append, oldest first
+        title: Title for the chat if this append creates it (None to only append to existing chats)
+
+    Returns:
+        int: Message count after the append, or None if the chat doesn't exist and no title was given
+
+    Raises:
+        DuplicateKeyError: If the chat ID belongs to another user
+    """
+    total = _reserve_seqs(db, chat_id, user_id, messages, title)
+    if total is None:
+        return None
+
+    for bucket_filter, update in _bucket_updates(chat_id, user_id, total - len(messages), messages):
+        try:
+            db.chat_messages.update_one(bucket_filter, update, upsert=True)
+        except DuplicateKeyError:
+            # Another writer created the bucket at the same moment; it exists now
+            db.chat_messages.update_one(bucket_filter, update)
+    return total
+
+
+def append_batch(db, turns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Append many chat turns with as few round trips as possible
+
+    Turns of the same chat are combined into one header update, and every
+    bucket push in the batch goes to MongoDB in a single unordered bulk_write.
+
+    Each turn's reserved seqs are recorded on it as first_seq. Passing turns
+    from a failed call again reuses them instead of reserving new ones, so the
+    message count never runs ahead of the stored messages; their pushes skip
+    buckets that already hold the turn.
+
+    Args:
+        db: MongoDB database
+        turns: Dicts with id, chat_id, user_id, messages and title, in arrival order
+
+    Returns:
+        List of the turns that were written
+    """
+    groups = {}
+    for turn in turns:
+        groups.setdefault((turn["chat_id"], turn["user_id"]), []).append(turn)
+
+    written = []
+    operations = []
+    for (chat_id, user_id), chat_turns in groups.items():
+        reserved = [turn for turn in chat_turns if "first_seq" in turn]
+        for turn in reserved:
+            operations.extend(_bucket_updates(chat_id, user_id, turn["first_seq"], turn["messages"], turn["id"]))
+        written.extend(reserved)
+
+        chat_turns = [turn for turn in chat_turns if "first_seq" not in turn]
+        if not chat_turns:
+            continue
+        messages = [message for turn in chat_turns for message in turn["messages"]]
+        try:
+            total = _reserve_seqs(db, chat_id, user_id, messages, chat_turns[0].get("title"))
+        except DuplicateKeyError as e:
+            logger.error(f"Dropping {len(chat_turns)} chat turns: {str(e)}")
+            continue
+        if total is None:
+            logger.warning(f"Dropping {len(chat_turns)} chat turns for missing chat {chat_id}")
+            continue
+        first_seq = total - len(messages)
+        for turn in chat_turns:
+            turn["first_seq"] = first_seq
+            first_seq += len(turn["messages"])
+        operations.extend(_bucket_updates(chat_id, user_id, total - len(messages), messages))
+        written.extend(chat_turns)
+
+    if operations:
+        try:
+            db.chat_messages.bulk_write(
+                [UpdateOne(bucket_filter, update, upsert=True) for bucket_filter, update in operations],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            # Buckets created concurrently by another writer: push into them without upserting
+            retry = [error["index"] for error in e.details.get("writeErrors", []) if error.get("code") == 11000]
+            if len(retry) < len(e.details.get("writeErrors", [])):
+                raise
+            db.chat_messages.bulk_write(
+                [UpdateOne(*operations[index]) for index in retry],
+                ordered=False
+            )
+    return written
+
+
+def find_written_turns(db, turns: List[Dict[str, Any]]) -> set:
+    """
+    Find which turns already reached their buckets, for replaying a write journal
+
+    Args:
+        db: MongoDB database
+        turns: Turns whose messages carry a turn_id
+
+    Returns:
+        Set of turn IDs already stored
+    """
+    if not turns:
+        return set()
+    buckets = db.chat_messages.find(
+        {
+            "chat_id": {"$in": list({turn["chat_id"] for turn in turns})},
+            "messages.turn_id": {"$in": [turn["id"] for turn in turns]}
+        },
+        {"messages.turn_id": 1}
+    )
+    return {message.get("turn_id") for bucket in buckets for message in bucket.get("messages", [])}
+
+
+def _reserve_seqs(db, chat_id: str, user_id: str, messages: List[Dict[str, Any]],
+                  title: Optional[str] = None) -> Optional[int]:
+    """Bump the header's message count for new messages, upserting the chat when a title is given"""
+    now = datetime.now()
+    update = {
+        "$inc": {"message_count": len(messages)},
+        "$set": {"updated_at": now, "last_message": _preview(messages[-1])}
+    }
+    if title is not None:
+        update["$setOnInsert"] = {"title": title, "created_at": now}
+
+    for attempt in range(2):
+        try:
+            header = db.chats.find_one_and_update(
+                {"_id": chat_id, "user_id": user_id, "messages": {"$exists": False}},
+                update,
+                projection={"message_count": 1},
+                upsert=title is not None,
+                return_document=pymongo.ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Another request created the chat first, or it still embeds its messages, or it isn't this user's
+            header = None
+        if header is not None:
+            return header["message_count"]
+
+        legacy = db.chats.find_one({"_id": chat_id, "user_id": user_id, "messages": {"$exists": True}})
+        if legacy is not None:
+            migrate_chat(db, legacy)
+        elif title is None:
+            return None
+        elif attempt:
+            raise DuplicateKeyError(f"Chat {chat_id} belongs to another user")
+    return None
+
+
+def _bucket_updates(chat_id: str, user_id: str, first_seq: int, messages: List[Dict[str, Any]],
+                    turn_id: Optional[str] = None) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    Build the (filter, update) pairs pushing messages with consecutive seq numbers into their buckets
+
+    With a turn_id, buckets already holding that turn are left alone. Their upsert then
+    hits the unique bucket index, and the non-upsert retry matches nothing.
+    """
+    by_bucket = {}
+    for offset, message in enumerate(messages):
+        seq = first_seq + offset
+        by_bucket.setdefault(seq // CHAT_BUCKET_SIZE, []).append({**message, "seq": seq})
+
+    bucket_filter = {"chat_id": chat_id}
+    if turn_id is not None:
+        bucket_filter["messages.turn_id"] = {"$ne": turn_id}
+    return [
+        (
+            {**bucket_filter, "bucket": bucket},
+            {
+                "$push": {"messages": {"$each": bucket_messages}},
+                "$inc": {"count": len(bucket_messages)},
+                "$setOnInsert": {"user_id": user_id, "start": bucket * CHAT_BUCKET_SIZE}
+            }
+        )
+        for bucket, bucket_messages in by_bucket.items()
+    ]
+
+
+def get_message_range(db, chat_id: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """
+    Get the messages with seq in [start, end), oldest first
+
+    Args:
+        db: MongoDB database
+        chat_id: ID of the chat
+        start: First message position
+        end: Position after the last message
+
+    Returns:
+        List of message documents
+    """
+    if end <= start:
+        return []
+    buckets = db.chat_messages.find(
+        {
+            "chat_id": chat_id,
+            "bucket": {"$gte": start // CHAT_BUCKET_SIZE, "$lte": (end - 1) // CHAT_BUCKET_SIZE}
+        },
+        {"messages": 1}
+    )
+    messages = [message for bucket in buckets for message in bucket.get("messages", [])
+                if start <= message["seq"] < end]
+    # Concurrent appends may land in a bucket out of order
+    messages.sort(key=lambda message: message["seq"])
+    return messages
+
+
+def get_recent_messages(db, chat_id: str, user_id: str, limit: int,
+                        fields: Sequence[str] = ()) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Get a chat header and its last messages
+
+    Args:
+        db: MongoDB database
+        chat_id: ID of the chat
+        user_id: ID of the chat owner
+        limit: Maximum number of messages to return
+        fields: Extra header fields to return
+
+    Returns:
+        Tuple of (header or None if the chat doesn't exist, messages oldest first)
+    """
+    header = get_header(db, chat_id, user_id, fields)
+    if header is None:
+        return None, []
+    total = header.get("message_count", 0)
+    return header, get_message_range(db, chat_id, max(0, total - limit), total)
+
+
+def migrate_chat(db, chat: Dict[str, Any]) -> bool:
+    """
+    Move a chat's embedded messages array into buckets
+
+    Safe to run concurrently and to re-run after a failure: buckets are only
+    created, never overwritten, and the header switches over last.
+
+    Args:
+        db: MongoDB database
+        chat: Full chat document
+
+    Returns:
+        bool: True if the chat was migrated by this call
+    """
+    if chat is None or "messages" not in chat:
+        return False
+
+    messages = chat["messages"]
+    for bucket_start in range(0, len(messages), CHAT_BUCKET_SIZE):
+        bucket_messages = [
+            {**message, "seq": bucket_start + offset}
+            for offset, message in enumerate(messages[bucket_start:bucket_start + CHAT_BUCKET_SIZE])
+        ]
+        try:
+            db.chat_messages.update_one(
+                {"chat_id": chat["_id"], "bucket": bucket_start // CHAT_BUCKET_SIZE},
+                {"$setOnInsert": {
+                    "user_id": chat.get("user_id"),
+                    "start": bucket_start,
+                    "count": len(bucket_messages),
+                    "messages": bucket_messages
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass
+
+    result = db.chats.update_one(
+        {"_id": chat["_id"], "messages": {"$exists": True}},
+        {
+            "$set": {
+                "message_count": len(messages),
+                "last_message": _preview(messages[-1]) if messages else None
+            },
+            "$unset": {"messages": ""}
+        }
+    )
+    if result.modified_count:
+        logger.info(f"Migrated chat {chat['_id']} to {-(-len(messages) // CHAT_BUCKET_SIZE)} message buckets")
+    return bool(result.modified_count)
+
+
+def delete_chat(db, chat_id: str, user_id: str) -> bool:
+    """
+    Delete a chat header and its message buckets
+
+    Returns:
+        bool: True if the chat existed
+    """
+    result = db.chats.delete_one({"_id": chat_id, "user_id": user_id})
+    if result.deleted_count == 0:
+        return False
+    db.chat_messages.delete_many({"chat_id": chat_id})
+    return True
+
+
+def get_all_chats(db, user_id: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Get every chat of a user with its full formatted history
+
+    Args:
+        db: MongoDB database
+        user_id: ID of the user
+
+    Returns:
+        Dict of chat ID -> {"title", "messages"}, most recently updated first
+    """
+    headers = list(db.chats.find({"user_id": user_id}).sort("updated_at", -1))
+    for header in headers:
+        if "messages" in header:
+            migrate_chat(db, header)
+
+    chats = {header["_id"]: {"title": header.get("title", ""), "messages": []} for header in headers}
+    if chats:
+        buckets = db.chat_messages.find(
+            {"chat_id": {"$in": list(chats)}},
+            {"chat_id": 1, "messages": 1}
+        ).sort([("chat_id", 1), ("bucket", 1)])
+        for bucket in buckets:
+            chats[bucket["chat_id"]]["messages"].extend(bucket.get("messages", []))
+
+    for chat in chats.values():
+        chat["messages"].sort(key=lambda message: message["seq"])
+        chat["messages"] = [format_message(message) for message in chat["messages"]]
+    return chats
+
+
+def list_chats(db, user_id: str, limit: int = DEFAULT_CHAT_PAGE_SIZE,
+               cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    List a user's chats, most recently updated first
+
+    Args:
+        db: MongoDB database
+        user_id: ID of the user
+        limit: Maximum number of chats to return
+        cursor: Cursor returned by the previous page
+
+    Returns:
+        Tuple of (chat summaries, cursor for the next page or None)
+    """
+    limit = max(1, min(limit, MAX_CHAT_PAGE_SIZE))
+    query = {"user_id": user_id}
+    if cursor:
+        updated_at, chat_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"updated_at": {"$lt": updated_at}},
+            {"updated_at": updated_at, "_id": {"$lt": chat_id}}
+        ]
+
+    chats_cursor = db.chats.find(
+        query,
+        {
+            "title": 1,
+            "created_at": 1,
+            "updated_at": 1,
+            "message_count": 1,
+            "last_message": 1,
+            # Chats not yet migrated to buckets
+            "messages": {"$slice": -1},
+            "legacy_count": {"$size": {"$ifNull": ["$messages", []]}}
+        }
+    ).sort([("updated_at", -1), ("_id", -1)]).limit(limit + 1)
+
+    chats = []
+    for chat in chats_cursor:
+        if "messages" in chat:
+            last_message = chat["messages"][-1] if chat["messages"] else None
+            message_count = chat.get("legacy_count", 0)
+        else:
+            last_message = chat.get("last_message")
+            message_count = chat.get("message_count", 0)
+        chats.append({
+            "chatId": chat["_id"],
+            "title": chat.get("title", ""),
+            "preview": last_message["content"][:PREVIEW_CHARS] if last_message else "",
+            "lastRole": last_message["role"] if last_message else None,
+            "messageCount": message_count,
+            "createdAt": _isoformat(chat.get("created_at")),
+            "updatedAt": _isoformat(chat.get("updated_at")),
+            "_updated_at": chat.get("updated_at")
+        })
+
+    next_cursor = None
+    if len(chats) > limit:
+        chats = chats[:limit]
+        next_cursor = encode_cursor(chats[-1]["_updated_at"], chats[-1]["chatId"])
+    for chat in chats:
+        del chat["_updated_at"]
+    return chats, next_cursor
+
+
+def get_messages(db, chat_id: str, user_id: str, before: Optional[int] = None,
+                 limit: int = DEFAULT_MESSAGE_PAGE_SIZE) -> Optional[Dict[str, Any]]:
+    """
+    Get a page of a chat's messages ending just before a position
+
+    Args:
+        db: MongoDB database
+        chat_id: ID of the chat
+        user_id: ID of the chat owner
+        before: Index of the first message not to return (None for the latest messages)
+        limit: Maximum number of messages to return
+
+    Returns:
+        Dict with title, messages, total count and the index to request the previous page with,
+        or None if the chat doesn't exist
+    """
+    limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+    header = get_header(db, chat_id, user_id)
+    if header is None:
+        return None
+
+    total = header.get("message_count", 0)
+    end = total if before is None else max(0, min(before, total))
+    start = max(0, end - limit)
+
+    return {
+        "title": header.get("title", ""),
+        "messages": [format_message(message, message["seq"]) for message in get_message_range(db, chat_id, start, end)],
+        "total": total,
+        "nextBefore": start if start > 0 else None
+    }
@@ -0,0 +1,317 @@
+"""
+Write-behind buffer for chat persistence.
+
+Request threads hand finished chat turns to ChatWriteBehind.submit(), which
+journals the turn to a local file and queues it. A background thread collects
+turns from all requests and writes them with chat_store.append_batch every
+CHAT_WRITE_FLUSH_MS milliseconds or CHAT_WRITE_BATCH_SIZE turns, whichever
+comes first. Chat replies therefore never wait on MongoDB writes.
+
+Crash safety: every process appends to its own journal
+(``journal-<pid>-<random>.jsonl``, unique even when a restarted process gets
+the same PID) and records flushed turn IDs in it. On startup, a
+process replays the unflushed turns of journals whose owner is gone. Replayed
+turns are checked against the stored buckets, so a turn is never stored twice.
+
+Backpressure: the queue is bounded. When it is full, submit() waits up to
+CHAT_WRITE_BLOCK_SECONDS and then returns False so the caller can write
+synchronously instead of growing the buffer without limit.
+"""
+import os
+import glob
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import json_util
+
+import chat_store
+
+try:
+    import fcntl
+    fcntl_available = True
+except ImportError:
+    # Windows - a single server process is assumed
+    fcntl_available = False
+
+logger = logging.getLogger(__name__)
+
+CHAT_WRITE_FLUSH_MS = int(os.getenv("CHAT_WRITE_FLUSH_MS", "50"))
+CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", "200"))
+CHAT_WRITE_QUEUE_MAX = int(os.getenv("CHAT_WRITE_QUEUE_MAX", "5000"))
+CHAT_WRITE_BLOCK_SECONDS = float(os.getenv("CHAT_WRITE_BLOCK_SECONDS", "2"))
+CHAT_JOURNAL_DIR = os.getenv(
+    "CHAT_JOURNAL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chat_journal')
+)
+CHAT_JOURNAL_FSYNC = os.getenv("CHAT_JOURNAL_FSYNC", "true").lower() == "true"
+
+# Rewrite the journal with only the unflushed turns once it grows past this size
+JOURNAL_COMPACT_BYTES = 16 * 1024 * 1024
+# Delay before retrying a batch that failed to write
+RETRY_DELAY_SECONDS = 1.0
+
+
+def _read_journal(path: str) -> List[Dict[str, Any]]:
+    """Return the turns in a journal that were never marked as flushed"""
+    turns = {}
+    flushed = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json_util.loads(line)
+            except ValueError:
+                # Torn final line from a crash mid-write
+                continue
+            if "flushed" in entry:
+                flushed.update(entry["flushed"])
+            else:
+                turns[entry["id"]] = entry
+    return [turn for turn_id, turn in turns.items() if turn_id not in flushed]
+
+
+class ChatWriteBehind:
+    """
+    Journaled, batching write-behind queue for chat turns
+    """
+
+    def __init__(self, get_db: Callable[[], Any], on_written: Callable[[Dict[str, Any]], None] = None,
+                 flush_ms: int = CHAT_WRITE_FLUSH_MS, batch_size: int = CHAT_WRITE_BATCH_SIZE,
+                 max_queue: int = CHAT_WRITE_QUEUE_MAX, block_seconds: float = CHAT_WRITE_BLOCK_SECONDS,
+                 journal_dir: str = CHAT_JOURNAL_DIR, fsync: bool = CHAT_JOURNAL_FSYNC):
+        """
+        Args:
+            get_db: Function returning the MongoDB database
+            on_written: Called with each turn after it has been stored
+            flush_ms: Maximum time a turn waits in the buffer
+            batch_size: Maximum turns per flush
+            max_queue: Maximum buffered turns before submit() applies backpressure
+            block_seconds: How long submit() waits for room in a full buffer
+            journal_dir: Directory holding the per-process journals
+            fsync: fsync the journal after every turn
+        """
+        self.get_db = get_db
+        self.on_written = on_written
+        self.flush_ms = flush_ms
+        self.batch_size = batch_size
+        self.block_seconds = block_seconds
+        self.journal_dir = journal_dir
+        self.fsync = fsync
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._journal_lock = threading.Lock()
+        self._pending = {}  # turn ID -> journal line, for turns not yet flushed
+        self._journal = None
+        self._lock_file = None
+        self._thread = None
+        self._closed = threading.Event()
+        self._stats = {
+            "submitted": 0,
+            "written": 0,
+            "batches": 0,
+            "rejected": 0,
+            "replayed": 0,
+            "errors": 0
+        }
+
+    def start(self) -> None:
+        """Open this process's journal, replay abandoned journals and start the flush thread"""
+        os.makedirs(self.journal_dir, exist_ok=True)
+        name = os.path.join(self.journal_dir, f"journal-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        self._lock_file = open(name + ".lock", 'a')
+        if fcntl_available:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._journal_path = name + ".jsonl"
+        self._journal = open(self._journal_path, 'a', encoding='utf-8')
+
+        self._thread = threading.Thread(target=self._run, name="chat-write-behind", daemon=True)
+        self._thread.start()
+        self._replay_abandoned()
+
+    def submit(self, chat_id: str, user_id: str, messages: List[Dict[str, Any]], title: Optional[str] = None,
+               **extra) -> bool:
+        """
+        Queue a chat turn for writing
+
+        Args:
+            chat_id: ID of the chat
+            user_id: ID of the chat owner
+            messages: Messages of the turn, oldest first
+            title: Title for the chat if this turn creates it
+            **extra: Extra fields passed back to on_written
+
+        Returns:
+            bool: False if the buffer stayed full and the caller should write the turn itself
+        """
+        turn_id = uuid.uuid4().hex
+        turn = {
+            "id": turn_id,
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "title": title,
+            "messages": [{**message, "turn_id": turn_id} for message in messages],
+            **extra
+        }
+        return self._enqueue(turn, timeout=self.block_seconds)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Flush buffered turns and stop the flush thread; anything left stays in the journal"""
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get queue depth and write counters
+
+        Returns:
+            Dict of write-behind statistics
+        """
+        return {
+            **self._stats,
+            "queued": self._queue.qsize(),
+            "unflushed": len(self._pending),
+            "max_queue": self._queue.maxsize,
+            "flush_ms": self.flush_ms,
+            "batch_size": self.batch_size
+        }
+
+    def _enqueue(self, turn: Dict[str, Any], timeout: Optional[float]) -> bool:
+        # Journal before queueing so the flush thread can never mark a turn flushed before it is journaled
+        line = json_util.dumps(turn) + "\n"
+        with self._journal_lock:
+            self._journal_write(line)
+            self._pending[turn["id"]] = line
+
+        try:
+            self._queue.put(turn, timeout=timeout)
+        except queue.Full:
+            with self._journal_lock:
+                self._pending.pop(turn["id"], None)
+                self._journal_write(json.dumps({"flushed": [turn["id"]]}) + "\n")
+            self._stats["rejected"] += 1
+            logger.warning(f"Chat write-behind buffer is full, writing turn for chat {turn['chat_id']} inline")
+            return False
+
+        self._stats["submitted"] += 1
+        return True
+
+    def _journal_write(self, line: str) -> None:
+        """Append a line to this process's journal (caller holds the journal lock)"""
+        self._journal.write(line)
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _run(self) -> None:
+        while not (self._closed.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+
+            deadline = time.monotonic() + self.flush_ms / 1000
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        """Write a batch, retrying while MongoDB is unavailable unless shutting down"""
+        failed = False
+        while True:
+            try:
+                db = self.get_db()
+                if db is None:
+                    raise RuntimeError("Database connection is not available")
+
+                # Replayed turns, and any turn after a failed attempt that may have written part of the
+                # batch, could already be stored; the missing ones keep the seqs they reserved, if any
+                check = batch if failed else [turn for turn in batch if turn.get("replayed")]
+                stored = chat_store.find_written_turns(db, check) if check else set()
+                turns = [turn for turn in batch if turn["id"] not in stored]
+
+                written = chat_store.append_batch(db, turns)
+                if failed:
+                    # Stored by the failed attempt, but on_written wasn't called for them yet
+                    written += [turn for turn in batch if turn["id"] in stored and not turn.get("replayed")]
+                self._stats["batches"] += 1
+                self._stats["written"] += len(written)
+                break
+            except Exception as e:
+                self._stats["errors"] += 1
+                failed = True
+                logger.error(f"Error writing {len(batch)} buffered chat turns: {str(e)}")
+                if self._closed.is_set():
+                    # Leave the batch in the journal for the next start
+                    return
+                time.sleep(RETRY_DELAY_SECONDS)
+
+        self._mark_flushed(batch)
+        if self.on_written is not None:
+            for turn in written:
+                try:
+                    self.on_written(turn)
+                except Exception as e:
+                    logger.error(f"Error in chat write callback: {str(e)}")
+
+    def _mark_flushed(self, batch: List[Dict[str, Any]]) -> None:
+        with self._journal_lock:
+            for turn in batch:
+                self._pending.pop(turn["id"], None)
+
+            if not self._pending:
+                # Nothing unflushed: start the journal over
+                self._journal.seek(0)
+                self._journal.truncate()
+                self._journal.flush()
+            elif self._journal.tell() > JOURNAL_COMPACT_BYTES:
+                # Rewrite with only the unflushed turns
+                tmp_path = self._journal_path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.writelines(self._pending.values())
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._journal.close()
+                os.replace(tmp_path, self._journal_path)
+                self._journal = open(self._journal_path, 'a', encoding='utf-8')
+            else:
+                self._journal_write(json.dumps({"flushed": [turn["id"] for turn in batch]}) + "\n")
+
+    def _replay_abandoned(self) -> None:
+        """Queue the unflushed turns of journals left behind by processes that exited"""
+        for lock_path in glob.glob(os.path.join(self.journal_dir, "journal-*.lock")):
+            if lock_path == self._lock_file.name:
+                continue
+            with open(lock_path, 'a') as lock_file:
+                if fcntl_available:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        # Owner is still running
+                        continue
+
+                journal_path = lock_path[:-len(".lock")] + ".jsonl"
+                try:
+                    turns = _read_journal(journal_path) if os.path.exists(journal_path) else []
+                    for turn in turns:
+                        turn["replayed"] = True
+                        self._enqueue(turn, timeout=None)
+                    self._stats["replayed"] += len(turns)
+                    if turns:
+                        logger.info(f"Replaying {len(turns)} unflushed chat turns from {journal_path}")
+                    if os.path.exists(journal_path):
+                        os.remove(journal_path)
+                    os.remove(lock_path)
+                except Exception as e:
+                    logger.error(f"Error replaying chat journal {journal_path}: {str(e)}")
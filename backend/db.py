@@ -1,133 +1,282 @@
 # backend/db.py
 import os
-from mongoengine import connect, disconnect
+import threading
 from dotenv import load_dotenv
 import logging
 import pymongo
+from pymongo import monitoring
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
+DATABASE_NAME = "chatbotDB"
+
+# Connection pool settings - one pooled client is shared by the whole process
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+
+# Indexes for every collection the backend uses, created once per process
+COLLECTION_INDEXES = {
+    "users": [
+        ([("email", pymongo.ASCENDING)], {"unique": True})
+    ],
+    "verifications": [
+        ([("email", pymongo.ASCENDING)], {}),
+        ([("code", pymongo.ASCENDING)], {})
+    ],
+    "chats": [
+        ([("user_id", pymongo.ASCENDING)], {}),
+        ([("updated_at", pymongo.DESCENDING)], {}),
+        ([("user_id", pymongo.ASCENDING), ("updated_at", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)], {})
+    ],
+    "chat_messages": [
+        ([("chat_id", pymongo.ASCENDING), ("bucket", pymongo.ASCENDING)], {"unique": True})
+    ],
+    "training_data": [
+        ([("user_id", pymongo.ASCENDING)], {}),
+        ([("created_at", pymongo.DESCENDING)], {})
+    ],
+    "training_data_queue": [
+        ([("status", pymongo.ASCENDING), ("enqueued_at", pymongo.ASCENDING)], {}),
+        ([("data_id", pymongo.ASCENDING)], {}),
+        # Finished items are kept for a week
+        ([("finished_at", pymongo.ASCENDING)], {"expireAfterSeconds": 7 * 24 * 3600})
+    ],
+    "model_configs": [
+        ([("user_id", pymongo.ASCENDING)], {}),
+        ([("model_type", pymongo.ASCENDING)], {})
+    ],
+    "model_training_jobs": [
+        ([("user_id", pymongo.ASCENDING)], {}),
+        ([("status", pymongo.ASCENDING)], {}),
+        ([("created_at", pymongo.DESCENDING)], {})
+    ],
+    "trained_models": [
+        ([("user_id", pymongo.ASCENDING)], {}),
+        ([("model_type", pymongo.ASCENDING)], {}),
+        ([("is_active", pymongo.ASCENDING)], {})
+    ],
+    "document_embeddings": [
+        ([("document_id", pymongo.ASCENDING)], {}),
+        ([("chunk_index", pymongo.ASCENDING)], {}),
+        ([("document_id", pymongo.ASCENDING), ("chunk_index", pymongo.ASCENDING)], {"unique": True})
+    ],
+    "file_contents": [
+        # One document per distinct upload; older documents have no hash
+        ([("content_hash", pymongo.ASCENDING)],
+         {"unique": True, "partialFilterExpression": {"content_hash": {"$exists": True}}}),
+        # Removes files once their retention period has passed without use
+        ([("expires_at", pymongo.ASCENDING)], {"expireAfterSeconds": 0})
+    ]
+}
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events so pool usage can be reported"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checked_out": 0,
+            "checkout_failures": 0,
+            "pools_cleared": 0
+        }
+
+    def _increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._increment("pools_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._increment("connections_created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._increment("connections_closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._increment("checkout_failures")
+
+    def connection_checked_out(self, event):
+        self._increment("checked_out")
+
+    def connection_checked_in(self, event):
+        self._increment("checked_out", -1)
+
+
+_client = None
+_client_lock = threading.Lock()
+_collections_ready = False
+_collections_lock = threading.Lock()
+_pool_stats = PoolStatsListener()
+
+
+def _get_mongo_url():
+    """Read the MongoDB URI from the environment - try both MONGO_URL and MONGO_URI"""
+    # Load environment variables if not already loaded
+    load_dotenv('/etc/bharatai.env')
+    load_dotenv('.env')
+    return os.getenv('MONGO_URL') or os.getenv('MONGO_URI')
+
+
+def get_client():
+    """
+    Get the process-wide pooled MongoDB client, creating it on first use
+
+    Returns:
+        pymongo.MongoClient or None if no MongoDB URI is configured
+    """
+    global _client
+    if _client is not None:
+        return _client
+
+    with _client_lock:
+        if _client is not None:
+            return _client
+
+        mongo_url = _get_mongo_url()
+        if not mongo_url:
+            logger.error("MongoDB URI not found in environment variables")
+            return None
+
+        _client = pymongo.MongoClient(
+            mongo_url,
+            tls=True,
+            tlsAllowInvalidCertificates=True,
+            retryWrites=False,
+            serverSelectionTimeoutMS=5000,  # 5 second timeout
+            connectTimeoutMS=5000,
+            socketTimeoutMS=30000,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+            event_listeners=[_pool_stats]
+        )
+        logger.info(
+            f"Created MongoDB client (maxPoolSize={MONGO_MAX_POOL_SIZE}, "
+            f"minPoolSize={MONGO_MIN_POOL_SIZE}, maxIdleTimeMS={MONGO_MAX_IDLE_TIME_MS})"
+        )
+        return _client
+
+
+def ensure_collections(db):
+    """
+    Create the backend's collections and indexes once per process
+
+    Args:
+        db: pymongo.database.Database
+    """
+    global _collections_ready
+    if _collections_ready:
+        return
+
+    with _collections_lock:
+        if _collections_ready:
+            return
+
+        existing_collections = db.list_collection_names()
+        for collection, indexes in COLLECTION_INDEXES.items():
+            if collection not in existing_collections:
+                try:
+                    db.create_collection(collection)
+                    logger.info(f"Created collection: {collection}")
+                except pymongo.errors.CollectionInvalid:
+                    # Created by another process meanwhile
+                    pass
+            for keys, options in indexes:
+                # A failing index (e.g. existing duplicates, or options conflicting with an
+                # existing index) must not take the whole database away
+                try:
+                    db[collection].create_index(keys, **options)
+                except pymongo.errors.PyMongoError as e:
+                    logger.error(f"Could not create index {keys} on {collection}: {str(e)}")
+
+        _collections_ready = True
+
+
 def initialize_db():
     """
     Initialize MongoDB connection using environment variables
     """
-    # Load environment variables if not already loaded
-    load_dotenv('/etc/bharatai.env')
-    load_dotenv('.env')    
-    # Get MongoDB URI from environment - try both MONGO_URL and MONGO_URI
-    mongo_url = os.getenv('MONGO_URL') or os.getenv('MONGO_URI')
-    
+    mongo_url = _get_mongo_url()
+
     if not mongo_url:
         logger.error("MongoDB URI not found in environment variables. Database connection failed.")
         return False
-    
+
     try:
-        # Try using pymongo first to verify the connection
+        # Verify the shared client can reach the server
         logger.info("Testing connection with PyMongo...")
-        client = pymongo.MongoClient(
-            mongo_url,
-            tlsAllowInvalidCertificates=True,
-            serverSelectionTimeoutMS=5000  # 5 second timeout
-        )
-        
-        # Force a connection attempt with a server ping
+        client = get_client()
         client.admin.command('ping')
         logger.info("PyMongo connection successful")
-        
-        # Now connect with mongoengine
-        logger.info("Connecting with MongoEngine...")
-        # Disconnect any existing connections
-        disconnect()
-        
-        # Connect to MongoDB with SSL settings
-        connect(
-            host=mongo_url,
-            ssl=True,
-            tlsAllowInvalidCertificates=True,
-            serverSelectionTimeoutMS=5000,  # 5 second timeout
-            connect=False  # Don't connect immediately
-        )
-        
+
         # Verify collections and create indexes for new collections
-        db = client.get_database("chatbotDB")
-        
-        # Check and create collections for model training if they don't exist
-        required_collections = [
-            "training_data", "model_configs", "model_training_jobs", 
-            "trained_models", "document_embeddings"
-        ]
-        
-        existing_collections = db.list_collection_names()
-        
-        for collection in required_collections:
-            if collection not in existing_collections:
-                db.create_collection(collection)
-                logger.info(f"Created collection: {collection}")
-        
-        # Create indexes for better query performance
-        if "training_data" in existing_collections or "training_data" in required_collections:
-            db.training_data.create_index([("user_id", pymongo.ASCENDING)])
-            db.training_data.create_index([("created_at", pymongo.DESCENDING)])
-            
-        if "model_configs" in existing_collections or "model_configs" in required_collections:
-            db.model_configs.create_index([("user_id", pymongo.ASCENDING)])
-            db.model_configs.create_index([("model_type", pymongo.ASCENDING)])
-            
-        if "model_training_jobs" in existing_collections or "model_training_jobs" in required_collections:
-            db.model_training_jobs.create_index([("user_id", pymongo.ASCENDING)])
-            db.model_training_jobs.create_index([("status", pymongo.ASCENDING)])
-            db.model_training_jobs.create_index([("created_at", pymongo.DESCENDING)])
-            
-        if "trained_models" in existing_collections or "trained_models" in required_collections:
-            db.trained_models.create_index([("user_id", pymongo.ASCENDING)])
-            db.trained_models.create_index([("model_type", pymongo.ASCENDING)])
-            db.trained_models.create_index([("is_active", pymongo.ASCENDING)])
-            
-        if "document_embeddings" in existing_collections or "document_embeddings" in required_collections:
-            db.document_embeddings.create_index([("document_id", pymongo.ASCENDING)])
-            db.document_embeddings.create_index([("chunk_index", pymongo.ASCENDING)])
-        
+        ensure_collections(client.get_database(DATABASE_NAME))
+
         logger.info("Successfully connected to MongoDB and verified collections")
         return True
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {str(e)}")
         return False
 
+
 def get_database():
     """
-    Get a reference to the MongoDB database
-    
+    Get a reference to the MongoDB database backed by the shared connection pool
+
     Returns:
         pymongo.database.Database or None if connection failed
     """
-    # Load environment variables if not already loaded
-    load_dotenv('/etc/bharatai.env')
-    load_dotenv('.env')
-    
-    # Get MongoDB URI from environment
-    mongo_url = os.getenv('MONGO_URL') or os.getenv('MONGO_URI')
-    
-    if not mongo_url:
-        logger.error("MongoDB URI not found in environment variables")
+    client = get_client()
+    if client is None:
         return None
-    
+
     try:
-        # Create a MongoDB client
-        client = pymongo.MongoClient(
-            mongo_url,
-            tlsAllowInvalidCertificates=True,
-            serverSelectionTimeoutMS=5000  # 5 second timeout
-        )
-        
-        # Test the connection
-        client.admin.command('ping')
-        
-        # Return the database
-        return client.get_database("chatbotDB")
+        db = client.get_database(DATABASE_NAME)
+        ensure_collections(db)
+        return db
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {str(e)}")
         return None
 
+
+def get_pool_stats():
+    """
+    Get connection pool settings and usage counters
+
+    Returns:
+        dict of pool statistics
+    """
+    with _pool_stats._lock:
+        counters = dict(_pool_stats.counters)
+    counters["open_connections"] = counters["connections_created"] - counters["connections_closed"]
+    counters.update({
+        "client_created": _client is not None,
+        "max_pool_size": MONGO_MAX_POOL_SIZE,
+        "min_pool_size": MONGO_MIN_POOL_SIZE,
+        "max_idle_time_ms": MONGO_MAX_IDLE_TIME_MS
+    })
+    return counters
+
 # Initialize database connection
-db_connected = initialize_db()
\ No newline at end of file
+db_connected = initialize_db()
@@ -0,0 +1,217 @@
+"""
+Retrieval for questions about uploaded files.
+
+When a file is summarized its text is chunked and embedded into the vector
+index under ``file:<fileContentId>``. A question then retrieves the chunks most
+similar to it from that file only, and as many of them as fit the prompt's
+token budget are sent to the model in document order. The prompt size no
+longer grows with the file, and every part of the file can be reached.
+
+If embeddings are unavailable (sentence-transformers not installed or
+indexing failed), the context falls back to the start of the file, cut to the
+same token budget.
+
+Files expire from file_contents through a TTL index, so a periodic sweep
+removes the embeddings of files that are gone and compacts the embedding store.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+
+import chat_context
+import model_utils
+
+logger = logging.getLogger(__name__)
+
+# Chunks retrieved per question before the token budget is applied
+DOC_QA_TOP_K = int(os.getenv("DOC_QA_TOP_K", "8"))
+# Upper bound on document tokens in a question prompt
+DOC_QA_CONTEXT_TOKENS = int(os.getenv("DOC_QA_CONTEXT_TOKENS", "3000"))
+# Characters per indexed chunk
+DOC_QA_CHUNK_SIZE = int(os.getenv("DOC_QA_CHUNK_SIZE", "800"))
+# Hours between sweeps for embeddings of expired files
+DOC_QA_MAINTENANCE_HOURS = float(os.getenv("DOC_QA_MAINTENANCE_HOURS", "6"))
+
+KEY_PREFIX = "file:"
+
+_index_locks = {}
+_index_locks_lock = threading.Lock()
+
+
+def document_key(file_content_id: str) -> str:
+    """Vector index document ID of an uploaded file"""
+    return f"{KEY_PREFIX}{file_content_id}"
+
+
+def ensure_indexed(file_content_id: str, load_text: Callable[[], Optional[str]],
+                   metadata: Dict[str, Any] = None) -> bool:
+    """
+    Index a file's chunks unless they are already indexed
+
+    Concurrent calls for the same file index it once; later callers wait for
+    the first one to finish.
+
+    Args:
+        file_content_id: ID of the file_contents document
+        load_text: Function returning the file's text (only called if indexing is needed)
+        metadata: Metadata stored with each chunk
+
+    Returns:
+        bool: True if the file's chunks are searchable
+    """
+    if not model_utils.sentence_transformers_available:
+        return False
+
+    key = document_key(file_content_id)
+    if model_utils.is_document_indexed(key):
+        return True
+
+    with _index_locks_lock:
+        lock = _index_locks.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            if model_utils.is_document_indexed(key):
+                return True
+            text = load_text()
+            if not text or not text.strip():
+                return False
+            indexed = model_utils.index_document(
+                key, text, {**(metadata or {}), "file_content_id": file_content_id}, chunk_size=DOC_QA_CHUNK_SIZE
+            )
+            if not indexed:
+                logger.warning(f"Could not index file {file_content_id} for retrieval")
+            return indexed
+    finally:
+        with _index_locks_lock:
+            _index_locks.pop(key, None)
+
+
+def schedule_index(file_content_id: str, load_text: Callable[[], Optional[str]],
+                   metadata: Dict[str, Any] = None) -> None:
+    """
+    Index a file in the background (see ensure_indexed)
+
+    Args:
+        file_content_id: ID of the file_contents document
+        load_text: Function returning the file's text
+        metadata: Metadata stored with each chunk
+    """
+    if not model_utils.sentence_transformers_available:
+        return
+    threading.Thread(
+        target=ensure_indexed,
+        args=(file_content_id, load_text, metadata),
+        daemon=True
+    ).start()
+
+
+def _fit(texts: List[str], budget: int) -> List[int]:
+    """Indexes of the leading texts whose combined size fits the token budget"""
+    selected = []
+    for i, text in enumerate(texts):
+        cost = chat_context.estimate_tokens(text) + chat_context.MESSAGE_OVERHEAD_TOKENS
+        if cost > budget:
+            break
+        budget -= cost
+        selected.append(i)
+    return selected
+
+
+def build_context(file_content_id: str, question: str, load_text: Callable[[], Optional[str]],
+                  budget: int = DOC_QA_CONTEXT_TOKENS, top_k: int = DOC_QA_TOP_K,
+                  metadata: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Select the parts of a file to answer a question from
+
+    Args:
+        file_content_id: ID of the file_contents document
+        question: The user's question
+        load_text: Function returning the file's text
+        budget: Maximum document tokens
+        top_k: Chunks to retrieve
+        metadata: Metadata stored with each chunk if the file has to be indexed
+
+    Returns:
+        Dict with the context text, the retrieval mode ("retrieval" or "truncated")
+        and the number of chunks used
+    """
+    budget = min(budget, DOC_QA_CONTEXT_TOKENS)
+
+    if ensure_indexed(file_content_id, load_text, metadata):
+        results = model_utils.search_documents(question, top_k, document_ids=[document_key(file_content_id)])
+        if results:
+            # Most relevant chunks get the budget first, then they are put back in document order
+            chosen = [results[i] for i in _fit([r["chunk_text"] for r in results], budget)]
+            chosen.sort(key=lambda r: r["chunk_index"])
+            excerpts = [f"[Excerpt {r['chunk_index'] + 1}]\n{r['chunk_text'].strip()}" for r in chosen]
+            logger.info(f"Retrieved {len(chosen)}/{len(results)} chunks of file {file_content_id} for the question")
+            return {"context": "\n\n".join(excerpts), "mode": "retrieval", "chunks": len(chosen)}
+
+    # No embeddings: use the start of the file, cut to the budget
+    text = load_text() or ""
+    chunks = model_utils.chunk_document(text[:budget * 8], chunk_size=DOC_QA_CHUNK_SIZE, overlap=0)
+    selected = [chunks[i] for i in _fit(chunks, budget)]
+    return {"context": "".join(selected), "mode": "truncated", "chunks": len(selected)}
+
+
+def prune_expired(db, batch_size: int = 500) -> int:
+    """
+    Remove the embeddings of files that no longer exist (expired or deleted)
+
+    Args:
+        db: pymongo.database.Database
+        batch_size: File IDs looked up per query
+
+    Returns:
+        int: Number of files removed from the index
+    """
+    keys = model_utils.list_indexed_documents(prefix=KEY_PREFIX)
+    stale = []
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        ids = []
+        for key in batch:
+            try:
+                ids.append(ObjectId(key[len(KEY_PREFIX):]))
+            except InvalidId:
+                continue
+        existing = set()
+        # Files summarized before file_contents existed live in pdf_contents
+        for collection in (db.file_contents, db.pdf_contents):
+            existing.update(str(doc["_id"]) for doc in collection.find({"_id": {"$in": ids}}, {"_id": 1}))
+        stale.extend(key for key in batch if key[len(KEY_PREFIX):] not in existing)
+
+    if not stale:
+        return 0
+    logger.info(f"Removing embeddings of {len(stale)} expired files")
+    return model_utils.delete_documents(stale)
+
+
+def start_maintenance(get_db: Callable[[], Any], interval_hours: float = DOC_QA_MAINTENANCE_HOURS) -> None:
+    """
+    Periodically prune the embeddings of expired files and compact the embedding store
+
+    Args:
+        get_db: Function returning the MongoDB database (or None while unavailable)
+        interval_hours: Hours between sweeps (0 disables them)
+    """
+    if interval_hours <= 0 or not model_utils.sentence_transformers_available:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval_hours * 3600)
+            try:
+                db = get_db()
+                if db is not None:
+                    prune_expired(db)
+                model_utils.compact_embedding_store()
+            except Exception as e:
+                logger.error(f"Error in document index maintenance: {str(e)}")
+
+    threading.Thread(target=run, name="document-index-maintenance", daemon=True).start()
@@ -0,0 +1,386 @@
+"""
+Segment-based on-disk store for document chunk embeddings.
+
+Vectors are appended as raw, L2-normalized float32 rows to segment files
+(``segment_NNNNN.f32``) with the chunk texts in a companion ``.jsonl`` file.
+A JSON manifest maps each document to its row range. Segments are opened with
+``np.memmap`` so every worker process shares one page-cached copy of the
+vectors, and cold starts don't need to re-read MongoDB.
+
+Writes only ever append to segments and then atomically replace the manifest,
+so readers never see a partially written document.
+"""
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+try:
+    import fcntl
+    fcntl_available = True
+except ImportError:
+    # Windows - writes are only serialized within this process
+    fcntl_available = False
+
+logger = logging.getLogger(__name__)
+
+# Start a new segment once the active one holds this many rows
+SEGMENT_ROWS = int(os.getenv("EMBEDDING_STORE_SEGMENT_ROWS", "100000"))
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = ".lock"
+
+
+def _empty_manifest() -> Dict[str, Any]:
+    return {
+        "version": 1,
+        "generation": 0,
+        "dim": None,
+        "segments": [],  # [{"name", "rows", "text_bytes"}]
+        "documents": {},  # document_id -> {"segment", "offset", "count", "metadata"}
+        "mongo_imported": False
+    }
+
+
+class EmbeddingStore:
+    """
+    Append-only embedding segments plus a document manifest in one directory
+    """
+
+    def __init__(self, directory: str, segment_rows: int = SEGMENT_ROWS):
+        """
+        Args:
+            directory: Directory holding the manifest and segment files
+            segment_rows: Rows per segment before a new one is started
+        """
+        self.directory = directory
+        self.segment_rows = segment_rows
+        self._lock = threading.Lock()
+        self._manifest = _empty_manifest()
+        self._manifest_mtime = None
+        os.makedirs(directory, exist_ok=True)
+        self.refresh()
+
+    @property
+    def generation(self) -> int:
+        """Counter bumped by every write, used to detect changes made by other processes"""
+        return self._manifest["generation"]
+
+    @property
+    def mongo_imported(self) -> bool:
+        return self._manifest.get("mongo_imported", False)
+
+    def has_document(self, document_id: str) -> bool:
+        return document_id in self._manifest["documents"]
+
+    def document_ids(self, prefix: str = "") -> List[str]:
+        """
+        List stored documents
+
+        Args:
+            prefix: Only return IDs starting with this prefix
+
+        Returns:
+            List of document IDs
+        """
+        return [document_id for document_id in self._manifest["documents"] if document_id.startswith(prefix)]
+
+    def refresh(self) -> bool:
+        """
+        Reload the manifest if another process changed it
+
+        Returns:
+            bool: True if the manifest was reloaded
+        """
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._manifest_mtime:
+            return False
+
+        with self._lock:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._manifest = json.load(f)
+                self._manifest_mtime = mtime
+                return True
+            except Exception as e:
+                logger.error(f"Error reading embedding store manifest: {str(e)}")
+                return False
+
+    def put_document(self, document_id: str, chunks: Sequence[str], embeddings: Sequence[Sequence[float]],
+                     metadata: Dict[str, Any] = None) -> int:
+        """
+        Append a document's chunk embeddings, replacing any previous version
+
+        Args:
+            document_id: ID of the document
+            chunks: Chunk texts
+            embeddings: Embedding for each chunk
+            metadata: Metadata stored with the document
+
+        Returns:
+            int: Store generation after the write
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(chunks), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        vectors = np.ascontiguousarray(vectors / norms)
+
+        with self._write_lock():
+            manifest = self._manifest
+            if manifest["dim"] is None:
+                manifest["dim"] = vectors.shape[1]
+            elif vectors.shape[1] != manifest["dim"]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {manifest['dim']}")
+
+            segment = self._active_segment()
+            lines = "".join(
+                json.dumps({"document_id": document_id, "chunk_index": i, "chunk_text": chunk}) + "\n"
+                for i, chunk in enumerate(chunks)
+            ).encode('utf-8')
+            self._write_segment(segment, vectors.tobytes(), lines)
+
+            manifest["documents"][document_id] = {
+                "segment": segment["name"],
+                "offset": segment["rows"],
+                "count": len(chunks),
+                "metadata": metadata
+            }
+            segment["rows"] += len(chunks)
+            segment["text_bytes"] += len(lines)
+            self._commit()
+            return manifest["generation"]
+
+    def delete_document(self, document_id: str) -> Optional[int]:
+        """
+        Remove a document from the manifest (its rows become garbage until compaction)
+
+        Args:
+            document_id: ID of the document
+
+        Returns:
+            int: Store generation after the write, or None if the document wasn't stored
+        """
+        with self._write_lock():
+            if self._manifest["documents"].pop(document_id, None) is None:
+                return None
+            self._commit()
+            return self._manifest["generation"]
+
+    def mark_mongo_imported(self) -> None:
+        """Record that embeddings stored in MongoDB have been copied into this store"""
+        with self._write_lock():
+            self._manifest["mongo_imported"] = True
+            self._commit()
+
+    def open_segments(self) -> List[Tuple[np.ndarray, List[Optional[Dict[str, Any]]]]]:
+        """
+        Memory-map every segment for reading
+
+        Returns:
+            List of (vectors, chunks) per segment, where vectors is a read-only
+            (rows, dim) memmap and chunks has one entry per row (None for rows
+            of deleted or replaced documents)
+        """
+        self.refresh()
+        with self._lock:
+            manifest = self._manifest
+            live = {}
+            for document_id, entry in manifest["documents"].items():
+                live.setdefault(entry["segment"], []).append((document_id, entry))
+
+            segments = []
+            for segment in manifest["segments"]:
+                if not segment["rows"]:
+                    continue
+
+                vectors = np.memmap(
+                    os.path.join(self.directory, segment["name"] + ".f32"),
+                    dtype=np.float32,
+                    mode='r',
+                    shape=(segment["rows"], manifest["dim"])
+                )
+
+                chunks = [None] * segment["rows"]
+                documents = live.get(segment["name"], [])
+                if documents:
+                    live_rows = {}
+                    for document_id, entry in documents:
+                        for row in range(entry["offset"], entry["offset"] + entry["count"]):
+                            live_rows[row] = entry["metadata"]
+
+                    with open(os.path.join(self.directory, segment["name"] + ".jsonl"), 'rb') as f:
+                        for row, line in enumerate(f):
+                            if row >= segment["rows"]:
+                                break
+                            if row in live_rows:
+                                record = json.loads(line)
+                                record["metadata"] = live_rows[row]
+                                chunks[row] = record
+
+                segments.append((vectors, chunks))
+            return segments
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get segment and row counts
+
+        Returns:
+            Dict of store statistics
+        """
+        manifest = self._manifest
+        total_rows = sum(segment["rows"] for segment in manifest["segments"])
+        live_rows = sum(entry["count"] for entry in manifest["documents"].values())
+        return {
+            "directory": self.directory,
+            "generation": manifest["generation"],
+            "dim": manifest["dim"],
+            "segments": len(manifest["segments"]),
+            "documents": len(manifest["documents"]),
+            "rows": total_rows,
+            "live_rows": live_rows,
+            "vector_bytes": total_rows * (manifest["dim"] or 0) * 4
+        }
+
+    def compact(self) -> int:
+        """
+        Rewrite live rows into fresh segments and delete the old segment files
+
+        Returns:
+            int: Store generation after compaction
+        """
+        with self._write_lock():
+            old_manifest = self._manifest
+            old_segments = {segment["name"] for segment in old_manifest["segments"]}
+            dim = old_manifest["dim"]
+
+            manifest = _empty_manifest()
+            manifest["generation"] = old_manifest["generation"]
+            manifest["dim"] = dim
+            manifest["mongo_imported"] = old_manifest.get("mongo_imported", False)
+            index = max((int(name.rsplit("_", 1)[1]) for name in old_segments), default=-1) + 1
+            self._manifest = manifest
+
+            try:
+                # Documents in old segment order, so each old segment's texts are read once
+                documents = sorted(old_manifest["documents"].items(),
+                                   key=lambda item: (item[1]["segment"], item[1]["offset"]))
+                source_name, source_lines = None, []
+                for document_id, entry in documents:
+                    if entry["segment"] != source_name:
+                        source_name = entry["segment"]
+                        with open(os.path.join(self.directory, source_name + ".jsonl"), 'rb') as f:
+                            source_lines = f.readlines()
+                    source = np.memmap(
+                        os.path.join(self.directory, source_name + ".f32"),
+                        dtype=np.float32,
+                        mode='r',
+                        offset=entry["offset"] * dim * 4,
+                        shape=(entry["count"], dim)
+                    )
+                    lines = b"".join(source_lines[entry["offset"]:entry["offset"] + entry["count"]])
+
+                    segment = self._active_segment(first_index=index)
+                    # Synced once per segment below, before the manifest points at it
+                    self._write_segment(segment, np.ascontiguousarray(source).tobytes(), lines, sync=False)
+
+                    manifest["documents"][document_id] = {
+                        "segment": segment["name"],
+                        "offset": segment["rows"],
+                        "count": entry["count"],
+                        "metadata": entry["metadata"]
+                    }
+                    segment["rows"] += entry["count"]
+                    segment["text_bytes"] += len(lines)
+
+                for segment in manifest["segments"]:
+                    for ext in (".f32", ".jsonl"):
+                        with open(os.path.join(self.directory, segment["name"] + ext), 'rb') as f:
+                            os.fsync(f.fileno())
+
+                self._commit()
+            except Exception:
+                # The old segments are untouched; keep serving them
+                self._manifest = old_manifest
+                raise
+
+            # Readers that still have the old segments mapped keep their open file handles
+            for name in old_segments:
+                for ext in (".f32", ".jsonl"):
+                    try:
+                        os.remove(os.path.join(self.directory, name + ext))
+                    except OSError as e:
+                        logger.warning(f"Could not remove old segment file {name}{ext}: {str(e)}")
+
+            logger.info(f"Compacted embedding store into {len(manifest['segments'])} segments")
+            return manifest["generation"]
+
+    def _write_segment(self, segment: Dict[str, Any], vector_bytes: bytes, text_bytes: bytes,
+                       sync: bool = True) -> None:
+        """
+        Write rows past a segment's last committed row (caller holds the write lock)
+
+        Anything beyond the committed rows was left by an interrupted write and is overwritten.
+        """
+        for ext, position, data in ((".f32", segment["rows"] * self._manifest["dim"] * 4, vector_bytes),
+                                    (".jsonl", segment["text_bytes"], text_bytes)):
+            path = os.path.join(self.directory, segment["name"] + ext)
+            with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+                f.seek(position)
+                f.write(data)
+                f.truncate()
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+
+    def _active_segment(self, first_index: int = 0) -> Dict[str, Any]:
+        """Return the segment to append to, starting a new one when full (caller holds the write lock)"""
+        segments = self._manifest["segments"]
+        if not segments or segments[-1]["rows"] >= self.segment_rows:
+            index = int(segments[-1]["name"].rsplit("_", 1)[1]) + 1 if segments else first_index
+            segments.append({"name": f"segment_{index:05d}", "rows": 0, "text_bytes": 0})
+        return segments[-1]
+
+    def _commit(self) -> None:
+        """Atomically replace the manifest (caller holds the write lock)"""
+        self._manifest["generation"] += 1
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._manifest_mtime = os.stat(path).st_mtime_ns
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize writers across threads and, where supported, across processes"""
+        with self._lock:
+            if not fcntl_available:
+                yield
+                return
+
+            with open(os.path.join(self.directory, LOCK_NAME), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # Another process may have written since our last read
+                    self._reload_locked()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reload_locked(self) -> None:
+        """Reload the manifest from disk unconditionally (caller holds the write lock)"""
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            self._manifest = json.load(f)
+        self._manifest_mtime = os.stat(path).st_mtime_ns
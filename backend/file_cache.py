@@ -0,0 +1,202 @@
+"""
+Content-addressed cache of extracted file text and summaries.
+
+Uploads are identified by the SHA-256 of their bytes. Each distinct file is
+stored once in ``file_contents`` (unique ``content_hash``) together with its
+summary, so uploading the same file again skips text extraction and the LLM
+call and returns the existing fileContentId.
+
+Retention: every use pushes ``expires_at`` FILE_CACHE_RETENTION_DAYS into the
+future and a TTL index removes files nobody has used for that long
+(0 keeps them forever). Documents stored before content hashing have no
+``expires_at`` and are never expired.
+"""
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+FILE_CACHE_RETENTION_DAYS = int(os.getenv("FILE_CACHE_RETENTION_DAYS", "30"))
+
+# Everything but the (up to 500KB) text
+METADATA_PROJECTION = {"content": 0}
+
+
+def _touch(now: datetime) -> Dict[str, Any]:
+    """Fields updated every time a cached file is used"""
+    fields = {"last_used_at": now}
+    if FILE_CACHE_RETENTION_DAYS > 0:
+        fields["expires_at"] = now + timedelta(days=FILE_CACHE_RETENTION_DAYS)
+    return fields
+
+
+def lookup(db, content_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    Find a previously uploaded file by content hash and mark it as used
+
+    Args:
+        db: pymongo.database.Database
+        content_hash: Hex SHA-256 of the upload
+
+    Returns:
+        file_contents document without its text, or None on a miss
+    """
+    return db.file_contents.find_one_and_update(
+        {"content_hash": content_hash},
+        {"$set": _touch(datetime.utcnow()), "$inc": {"hit_count": 1}},
+        projection=METADATA_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def get_content(db, file_content_id) -> Optional[str]:
+    """
+    Load the stored text of a file
+
+    Args:
+        db: pymongo.database.Database
+        file_content_id: file_contents _id
+
+    Returns:
+        Extracted text, or None if the file is gone
+    """
+    doc = db.file_contents.find_one({"_id": ObjectId(file_content_id)}, {"content": 1})
+    return doc.get("content") if doc else None
+
+
+def store_content(db, content_hash: str, filename: str, content_type: str, content: str) -> str:
+    """
+    Store extracted text once per content hash
+
+    Concurrent uploads of the same file end up with the same document.
+
+    Args:
+        db: pymongo.database.Database
+        content_hash: Hex SHA-256 of the upload
+        filename: Name of the first upload
+        content_type: MIME type of the upload
+        content: Extracted text
+
+    Returns:
+        str: fileContentId
+    """
+    now = datetime.utcnow()
+    update = {
+        "$setOnInsert": {
+            "content_hash": content_hash,
+            "filename": filename,
+            "content_type": content_type,
+            "content": content,
+            "uploaded_at": now,
+            "hit_count": 0
+        },
+        "$set": _touch(now)
+    }
+    for attempt in range(2):
+        try:
+            doc = db.file_contents.find_one_and_update(
+                {"content_hash": content_hash},
+                update,
+                upsert=True,
+                projection={"_id": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            return str(doc["_id"])
+        except DuplicateKeyError:
+            # Another request inserted the same file between our lookup and upsert
+            if attempt:
+                raise
+            logger.debug(f"Concurrent upload of file {content_hash[:12]}; retrying")
+
+
+def get_summary(doc: Optional[Dict[str, Any]], model: str) -> Optional[str]:
+    """
+    Get the cached summary of a file if it was made by the given model
+
+    Args:
+        doc: file_contents document from lookup()
+        model: Summarization model
+
+    Returns:
+        Summary text, or None if it has to be generated
+    """
+    if doc and doc.get("summary") and doc.get("summary_model") == model:
+        return doc["summary"]
+    return None
+
+
+def store_summary(db, file_content_id: str, summary: str, model: str, tree: Dict[str, Any] = None) -> None:
+    """
+    Cache the summary of a file
+
+    Args:
+        db: pymongo.database.Database
+        file_content_id: file_contents _id
+        summary: Generated summary
+        model: Model that generated it
+        tree: Summary tree the summary is the root of (see summarizer.build_tree)
+    """
+    fields = {"summary": summary, "summary_model": model, "summarized_at": datetime.utcnow()}
+    update = {"$set": fields}
+    if tree is not None:
+        fields["summary_tree"] = tree
+    else:
+        update["$unset"] = {"summary_tree": ""}
+    db.file_contents.update_one({"_id": ObjectId(file_content_id)}, update)
+
+
+def get_summary_tree(db, file_content_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Load the summary tree of a file
+
+    Args:
+        db: pymongo.database.Database
+        file_content_id: file_contents _id
+
+    Returns:
+        Document with filename, summary, summary_model and summary_tree (if any), or None if the file is gone
+    """
+    return db.file_contents.find_one(
+        {"_id": ObjectId(file_content_id)},
+        {"filename": 1, "summary": 1, "summary_model": 1, "summary_tree": 1}
+    )
+
+
+def add_tree_section(db, file_content_id: str, node: Dict[str, Any]) -> None:
+    """
+    Add the summary of a previously skipped section to a file's summary tree
+
+    Args:
+        db: pymongo.database.Database
+        file_content_id: file_contents _id
+        node: Section summary node
+    """
+    db.file_contents.update_one(
+        {
+            "_id": ObjectId(file_content_id),
+            # Another request may have added it meanwhile
+            "summary_tree.levels.0": {"$not": {"$elemMatch": {"start": node["start"], "end": node["end"]}}}
+        },
+        {"$push": {"summary_tree.levels.0": {"$each": [node], "$sort": {"start": 1}}}}
+    )
+
+
+def set_tree_short_summary(db, file_content_id: str, short: str) -> None:
+    """
+    Store the short summary of a file in its summary tree
+
+    Args:
+        db: pymongo.database.Database
+        file_content_id: file_contents _id
+        short: Short summary
+    """
+    db.file_contents.update_one(
+        {"_id": ObjectId(file_content_id), "summary_tree": {"$exists": True}},
+        {"$set": {"summary_tree.short": short}}
+    )
@@ -0,0 +1,178 @@
+"""
+Spoken language identification for speech recognition.
+
+A language identifier ranks the candidate languages of an utterance from the
+decoded audio, so only the most likely one or two languages are sent to
+speech recognition instead of every supported language.
+
+Identifiers are pluggable (SPEECH_LANGUAGE_ID):
+- ``auto``: ``whisper`` if the package is installed, otherwise ``none`` (default)
+- ``none``: no ranking, every candidate is recognized
+- ``whisper``: the language-detection head of an OpenAI Whisper model
+  (requires the optional ``openai-whisper`` package)
+"""
+import os
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import whisper
+    whisper_available = True
+except ImportError:
+    whisper = None
+    whisper_available = False
+
+SPEECH_LANGUAGE_ID = os.getenv("SPEECH_LANGUAGE_ID", "auto")
+SPEECH_LANGUAGE_ID_MODEL = os.getenv("SPEECH_LANGUAGE_ID_MODEL", "tiny")
+# Number of ranked languages sent to recognition
+SPEECH_LANGUAGE_ID_TOP_K = int(os.getenv("SPEECH_LANGUAGE_ID_TOP_K", "2"))
+# Send only the top language when it is at least this likely
+SPEECH_LANGUAGE_ID_CONFIDENT = float(os.getenv("SPEECH_LANGUAGE_ID_CONFIDENT", "0.8"))
+
+# Whisper models expect 16 kHz mono audio
+SAMPLE_RATE = 16000
+
+
+class LanguageIdentifier:
+    """
+    Base identifier: ranks nothing, so every candidate goes to recognition
+    """
+
+    name = "none"
+
+    def __init__(self, top_k: int = SPEECH_LANGUAGE_ID_TOP_K, confident: float = SPEECH_LANGUAGE_ID_CONFIDENT):
+        """
+        Args:
+            top_k: Number of ranked languages to keep
+            confident: Probability above which only the top language is kept
+        """
+        self.top_k = top_k
+        self.confident = confident
+        self._stats = {"requests": 0, "narrowed": 0, "failures": 0}
+
+    def rank(self, audio_data, candidates: Sequence[str]) -> Optional[Dict[str, float]]:
+        """
+        Score candidate languages for an utterance
+
+        Args:
+            audio_data: speech_recognition.AudioData
+            candidates: Language codes to score
+
+        Returns:
+            Dict of language -> probability, or None if the identifier can't rank
+        """
+        return None
+
+    def select(self, audio_data, candidates: Sequence[str], preferred: Optional[str] = None) -> List[str]:
+        """
+        Pick the languages to run recognition in
+
+        Args:
+            audio_data: speech_recognition.AudioData
+            candidates: Supported languages in fallback order
+            preferred: Language the user asked for, always kept first
+
+        Returns:
+            Languages to try, most likely first
+        """
+        candidates = list(dict.fromkeys(candidates))
+        self._stats["requests"] += 1
+        try:
+            scores = self.rank(audio_data, candidates)
+        except Exception as e:
+            self._stats["failures"] += 1
+            logger.warning(f"Spoken language identification failed: {str(e)}")
+            scores = None
+        if not scores:
+            if preferred and preferred in candidates:
+                candidates = [preferred] + [language for language in candidates if language != preferred]
+            return candidates
+
+        ranked = sorted(candidates, key=lambda language: scores.get(language, 0.0), reverse=True)
+        keep = 1 if scores.get(ranked[0], 0.0) >= self.confident else self.top_k
+        selected = ranked[:keep]
+        if preferred and preferred in candidates:
+            selected = [preferred] + [language for language in selected if language != preferred]
+
+        self._stats["narrowed"] += 1
+        ranking = ", ".join(f"{language}={scores.get(language, 0.0):.2f}" for language in ranked)
+        logger.info(f"Spoken language ranking: {ranking}; recognizing in {selected}")
+        return selected
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Get identification counters
+
+        Returns:
+            Dict of identifier statistics
+        """
+        return {**self._stats, "identifier": self.name}
+
+
+class WhisperLanguageIdentifier(LanguageIdentifier):
+    """
+    Ranks languages with Whisper's language-detection head (one encoder pass over 30s of audio)
+    """
+
+    name = "whisper"
+
+    def __init__(self, model_name: str = SPEECH_LANGUAGE_ID_MODEL, **kwargs):
+        """
+        Args:
+            model_name: Whisper model size ("tiny", "base", ...)
+            **kwargs: Passed to LanguageIdentifier
+        """
+        super().__init__(**kwargs)
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def rank(self, audio_data, candidates: Sequence[str]) -> Optional[Dict[str, float]]:
+        model = self._get_model()
+        samples = np.frombuffer(audio_data.get_raw_data(convert_rate=SAMPLE_RATE, convert_width=2), dtype=np.int16)
+        audio = whisper.pad_or_trim(samples.astype(np.float32) / 32768.0)
+        mel = whisper.log_mel_spectrogram(audio).to(model.device)
+
+        # The model isn't safe to run from several request threads at once
+        with self._lock:
+            _, probabilities = model.detect_language(mel)
+
+        # Renormalize over the supported languages
+        scores = {language: float(probabilities.get(language, 0.0)) for language in candidates}
+        total = sum(scores.values())
+        return {language: score / total for language, score in scores.items()} if total else None
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    logger.info(f"Loading Whisper model '{self.model_name}' for spoken language identification")
+                    self._model = whisper.load_model(self.model_name)
+        return self._model
+
+
+def create_language_identifier(name: str = SPEECH_LANGUAGE_ID) -> LanguageIdentifier:
+    """
+    Create the configured language identifier
+
+    Args:
+        name: Identifier name ("auto", "none" or "whisper")
+
+    Returns:
+        LanguageIdentifier (the pass-through one if the requested identifier is unavailable)
+    """
+    if name == "auto":
+        if whisper_available:
+            return WhisperLanguageIdentifier()
+        logger.info("openai-whisper is not installed; recognizing speech in every candidate language")
+    elif name == "whisper":
+        if whisper_available:
+            return WhisperLanguageIdentifier()
+        logger.warning("SPEECH_LANGUAGE_ID=whisper but openai-whisper is not installed; recognizing in every language")
+    elif name != "none":
+        logger.warning(f"Unknown spoken language identifier '{name}'; recognizing in every language")
+    return LanguageIdentifier()
@@ -0,0 +1,272 @@
+"""
+Asynchronous gateway for Groq chat completions.
+
+All LLM calls run on one asyncio event loop in a background thread using the
+Groq async client. Each model gets a bounded semaphore so a burst of chats
+can't exceed the upstream rate limits. Identical prompts that are in flight
+at the same time share one upstream call. Rate-limit errors are retried
+with exponential backoff and jitter.
+
+Flask request threads call the synchronous complete()/stream() wrappers, which
+hand the work to the event loop and wait for the result.
+"""
+import os
+import json
+import queue
+import random
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+from groq import AsyncGroq, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1.0"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+
+_STREAM_END = object()
+
+
+class LLMGateway:
+    """
+    Concurrency-limited, coalescing front end to the Groq async client
+    """
+
+    def __init__(self, api_key: Optional[str], model_limits: Dict[str, int] = None,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, max_retries: int = LLM_MAX_RETRIES,
+                 retry_base_seconds: float = LLM_RETRY_BASE_SECONDS):
+        """
+        Args:
+            api_key: Groq API key
+            model_limits: Per-model overrides of max_concurrency
+            max_concurrency: Maximum in-flight requests per model
+            max_retries: Retries after a rate-limit error
+            retry_base_seconds: Base delay for exponential backoff
+        """
+        self.model_limits = dict(model_limits or {})
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-gateway", daemon=True)
+        self._thread.start()
+
+        # The SDK's own retries are disabled so only the jittered retry below applies
+        self._client = AsyncGroq(api_key=api_key, max_retries=0)
+
+        # Only touched from the event loop thread; semaphores are created there on first use
+        self._semaphores = {}
+        self._inflight = {}
+        self._stats = {"requests": 0, "coalesced": 0, "retries": 0, "errors": 0, "active": 0}
+
+    def complete(self, model: str, messages: List[Dict[str, str]], timeout: float = LLM_TIMEOUT_SECONDS,
+                 **params) -> str:
+        """
+        Get a chat completion, blocking the calling thread until it is available
+
+        Args:
+            model: Groq model name
+            messages: Chat messages
+            timeout: Seconds to wait for the result
+            **params: Extra completion parameters (temperature, max_tokens, ...)
+
+        Returns:
+            str: Completion text
+        """
+        future = asyncio.run_coroutine_threadsafe(self.acomplete(model, messages, **params), self._loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    async def acomplete(self, model: str, messages: List[Dict[str, str]], **params) -> str:
+        """
+        Get a chat completion, sharing the upstream call with identical in-flight requests
+
+        Args:
+            model: Groq model name
+            messages: Chat messages
+            **params: Extra completion parameters
+
+        Returns:
+            str: Completion text
+        """
+        self._stats["requests"] += 1
+        key = (model, json.dumps(messages, sort_keys=True), json.dumps(params, sort_keys=True))
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(self._complete_with_retry(model, messages, **params))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def complete_many(self, model: str, message_lists: List[List[Dict[str, str]]], max_concurrency: int = None,
+                      timeout: float = LLM_TIMEOUT_SECONDS, **params) -> List[Optional[str]]:
+        """
+        Get several chat completions concurrently, blocking until all are done
+
+        Args:
+            model: Groq model name
+            message_lists: Chat messages of each completion
+            max_concurrency: Maximum completions of this batch in flight at once
+                (the per-model limit applies on top)
+            timeout: Seconds to wait for the whole batch
+            **params: Extra completion parameters shared by all completions
+
+        Returns:
+            Completion text for each message list, in order, or None where it failed
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self._complete_many(model, message_lists, max_concurrency, **params), self._loop
+        )
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def stream(self, model: str, messages: List[Dict[str, str]], timeout: float = LLM_TIMEOUT_SECONDS,
+               **params) -> Iterator[str]:
+        """
+        Stream completion tokens to the calling thread as they arrive
+
+        Args:
+            model: Groq model name
+            messages: Chat messages
+            timeout: Seconds to wait for each token
+            **params: Extra completion parameters
+
+        Yields:
+            str: Completion tokens
+        """
+        tokens = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._stream_into(tokens, model, messages, **params), self._loop)
+        try:
+            while True:
+                item = tokens.get(timeout=timeout)
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Stop the upstream stream if the consumer went away early
+            future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get request, coalescing and retry counters
+
+        Returns:
+            Dict of gateway statistics
+        """
+        return {
+            **self._stats,
+            "inflight": len(self._inflight),
+            "max_concurrency": self.max_concurrency,
+            "model_limits": self.model_limits
+        }
+
+    def _semaphore(self, model: str) -> asyncio.Semaphore:
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.model_limits.get(model, self.max_concurrency))
+        return self._semaphores[model]
+
+    async def _complete_with_retry(self, model: str, messages: List[Dict[str, str]], **params) -> str:
+        async with self._semaphore(model):
+            self._stats["active"] += 1
+            try:
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        completion = await self._client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            **params
+                        )
+                        return completion.choices[0].message.content
+                    except RateLimitError as e:
+                        if attempt == self.max_retries:
+                            raise
+                        await self._backoff(model, attempt, e)
+            except Exception:
+                self._stats["errors"] += 1
+                raise
+            finally:
+                self._stats["active"] -= 1
+
+    async def _complete_many(self, model: str, message_lists: List[List[Dict[str, str]]],
+                             max_concurrency: Optional[int], **params) -> List[Optional[str]]:
+        limit = asyncio.Semaphore(max_concurrency or max(len(message_lists), 1))
+
+        async def complete_one(messages):
+            async with limit:
+                try:
+                    return await self.acomplete(model, messages, **params)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Batched completion for model {model} failed: {str(e)}")
+                    return None
+
+        return list(await asyncio.gather(*(complete_one(messages) for messages in message_lists)))
+
+    async def _stream_into(self, tokens: queue.Queue, model: str, messages: List[Dict[str, str]], **params) -> None:
+        try:
+            async with self._semaphore(model):
+                self._stats["requests"] += 1
+                self._stats["active"] += 1
+                try:
+                    for attempt in range(self.max_retries + 1):
+                        try:
+                            stream = await self._client.chat.completions.create(
+                                model=model,
+                                messages=messages,
+                                stream=True,
+                                **params
+                            )
+                            break
+                        except RateLimitError as e:
+                            if attempt == self.max_retries:
+                                raise
+                            await self._backoff(model, attempt, e)
+
+                    try:
+                        async for chunk in stream:
+                            token = chunk.choices[0].delta.content if chunk.choices else None
+                            if token:
+                                tokens.put(token)
+                    finally:
+                        # Return the HTTP connection to the pool even if the stream was cancelled or failed
+                        await stream.close()
+                finally:
+                    self._stats["active"] -= 1
+            tokens.put(_STREAM_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._stats["errors"] += 1
+            tokens.put(e)
+
+    async def _backoff(self, model: str, attempt: int, error: RateLimitError) -> None:
+        """Sleep before retrying, honouring Retry-After when the API sends it"""
+        self._stats["retries"] += 1
+        delay = self.retry_base_seconds * (2 ** attempt)
+        try:
+            retry_after = error.response.headers.get("retry-after")
+            if retry_after:
+                delay = max(delay, float(retry_after))
+        except Exception:
+            pass
+        delay *= random.uniform(0.5, 1.5)
+        logger.warning(f"Rate limited by Groq for model {model}, retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Migrate chats with an embedded messages array to bucketed message storage
+
+Chats are also migrated lazily the first time they are read, so this only
+needs to run once to convert old chats in bulk. It is safe to re-run and to
+run while the server is up.
+
+Usage:
+    python migrate_chats.py [--dry-run] [--user-id USER_ID]
+"""
+import argparse
+import logging
+
+from db import get_database
+import chat_store
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def migrate_chats(dry_run=False, user_id=None):
+    """
+    Move every chat that still embeds its messages into chat_messages buckets
+
+    Args:
+        dry_run: Only count the chats that would be migrated
+        user_id: Restrict the migration to one user's chats
+
+    Returns:
+        int: Number of chats migrated (or found, for a dry run)
+    """
+    db = get_database()
+    if db is None:
+        logger.error("Database connection is not available")
+        return 0
+
+    query = {"messages": {"$exists": True}}
+    if user_id:
+        query["user_id"] = user_id
+
+    migrated = 0
+    for chat in db.chats.find(query):
+        if dry_run:
+            logger.info(f"Would migrate chat {chat['_id']} ({len(chat['messages'])} messages)")
+            migrated += 1
+        elif chat_store.migrate_chat(db, chat):
+            migrated += 1
+
+    logger.info(f"{'Found' if dry_run else 'Migrated'} {migrated} chats with embedded messages "
+                f"(bucket size {chat_store.CHAT_BUCKET_SIZE})")
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate chats to bucketed message storage")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the chats that would be migrated")
+    parser.add_argument("--user-id", help="Only migrate this user's chats")
+    args = parser.parse_args()
+
+    migrate_chats(dry_run=args.dry_run, user_id=args.user_id)
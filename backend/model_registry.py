@@ -0,0 +1,187 @@
+"""
+Process-wide registry for loaded embedding models.
+
+Loading a SentenceTransformer from disk takes seconds, so each model is
+loaded once per process and kept in memory. When the estimated footprint of
+the loaded models exceeds the configured budget, the least recently used
+models are evicted.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_model_size(model: Any) -> int:
+    """
+    Estimate the memory footprint of a model in bytes
+
+    Args:
+        model: Loaded model instance (torch modules are measured by their parameters)
+
+    Returns:
+        int: Estimated size in bytes, or 0 if it cannot be determined
+    """
+    try:
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    except Exception:
+        return 0
+
+
+class ModelRegistry:
+    """
+    Thread-safe LRU cache of loaded models keyed by model name
+    """
+
+    def __init__(self, loader: Callable[[str], Any], memory_budget_bytes: int = 0):
+        """
+        Args:
+            loader: Function that loads a model by name and returns None on failure
+            memory_budget_bytes: Maximum estimated size of all loaded models (0 disables eviction)
+        """
+        self._loader = loader
+        self._memory_budget_bytes = memory_budget_bytes
+        self._models = OrderedDict()  # name -> {"model", "size", "last_used"}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "load_failures": 0,
+            "evictions": 0,
+            "load_seconds_total": 0.0,
+            "last_load_seconds": {}
+        }
+
+    def get(self, name: str) -> Optional[Any]:
+        """
+        Return the model for name, loading it on first use
+
+        Args:
+            name: Model name passed to the loader
+
+        Returns:
+            Loaded model or None if loading failed
+        """
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is not None:
+                self._models.move_to_end(name)
+                entry["last_used"] = time.time()
+                self._stats["hits"] += 1
+                return entry["model"]
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # Only one thread loads a given model; the others wait and reuse it
+        with load_lock:
+            with self._lock:
+                entry = self._models.get(name)
+                if entry is not None:
+                    self._models.move_to_end(name)
+                    entry["last_used"] = time.time()
+                    self._stats["hits"] += 1
+                    return entry["model"]
+                self._stats["misses"] += 1
+
+            start = time.perf_counter()
+            model = self._loader(name)
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                if model is None:
+                    self._stats["load_failures"] += 1
+                    return None
+
+                self._models[name] = {
+                    "model": model,
+                    "size": estimate_model_size(model),
+                    "last_used": time.time()
+                }
+                self._stats["load_seconds_total"] += elapsed
+                self._stats["last_load_seconds"][name] = round(elapsed, 3)
+                self._evict_over_budget(keep=name)
+
+            logger.info(f"Loaded model {name} into registry in {elapsed:.2f}s")
+            return model
+
+    def warm_up(self, names: Iterable[str], probe: Callable[[Any], None] = None) -> Dict[str, bool]:
+        """
+        Load models ahead of the first request
+
+        Args:
+            names: Model names to load
+            probe: Optional function run against each loaded model (e.g. a dummy encode)
+
+        Returns:
+            Dict mapping model name to whether it was loaded successfully
+        """
+        results = {}
+        for name in names:
+            model = self.get(name)
+            if model is not None and probe is not None:
+                try:
+                    probe(model)
+                except Exception as e:
+                    logger.warning(f"Warm-up probe failed for model {name}: {str(e)}")
+            results[name] = model is not None
+        return results
+
+    def evict(self, name: str) -> bool:
+        """
+        Remove a model from the registry
+
+        Args:
+            name: Model name to remove
+
+        Returns:
+            bool: True if the model was loaded and has been removed
+        """
+        with self._lock:
+            if self._models.pop(name, None) is None:
+                return False
+            self._stats["evictions"] += 1
+        logger.info(f"Evicted model {name} from registry")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get registry counters and the currently loaded models
+
+        Returns:
+            Dict with hit/miss counters, load times and loaded model sizes
+        """
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "hits": self._stats["hits"],
+                "misses": self._stats["misses"],
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "load_failures": self._stats["load_failures"],
+                "evictions": self._stats["evictions"],
+                "load_seconds_total": round(self._stats["load_seconds_total"], 3),
+                "last_load_seconds": dict(self._stats["last_load_seconds"]),
+                "memory_budget_bytes": self._memory_budget_bytes,
+                "memory_used_bytes": sum(entry["size"] for entry in self._models.values()),
+                "loaded_models": {
+                    name: {"size_bytes": entry["size"], "last_used": entry["last_used"]}
+                    for name, entry in self._models.items()
+                }
+            }
+
+    def _evict_over_budget(self, keep: str) -> None:
+        """Evict least recently used models until the budget is met (caller holds the lock)"""
+        if not self._memory_budget_bytes:
+            return
+
+        used = sum(entry["size"] for entry in self._models.values())
+        for name in list(self._models.keys()):
+            if used <= self._memory_budget_bytes:
+                break
+            if name == keep:
+                continue
+            used -= self._models.pop(name)["size"]
+            self._stats["evictions"] += 1
+            logger.info(f"Evicted idle model {name} to stay within memory budget")
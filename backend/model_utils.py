@@ -5,6 +5,8 @@ import os
 import json
 import logging
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
 import numpy as np
 from bson.objectid import ObjectId
@@ -36,6 +38,9 @@ except ImportError:
 
 # Import local modules
 from db import get_database
+from model_registry import ModelRegistry
+from vector_index import VectorIndex
+from embedding_store import EmbeddingStore
 
 # Directories for model storage
 EMBEDDING_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embedding_models')
@@ -49,33 +54,101 @@ for directory in [EMBEDDING_MODEL_DIR, CACHED_EMBEDDINGS_DIR]:
 # Default embedding model to use
 DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 
-def get_embedding_model():
+# Number of chunks embedded and written to MongoDB per batch when indexing
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "64"))
+
+# Memory budget for loaded embedding models; least recently used models are evicted beyond it
+EMBEDDING_MODEL_MEMORY_BUDGET_MB = int(os.getenv("EMBEDDING_MODEL_MEMORY_BUDGET_MB", "1024"))
+
+def _load_embedding_model(model_name: str):
     """
-    Get a sentence transformer model for generating embeddings
+    Load a sentence transformer model from disk, downloading it on first use
     
+    Args:
+        model_name: Name of the sentence transformer model
+        
     Returns:
-        SentenceTransformer model instance or None if not available
+        SentenceTransformer model instance or None if loading failed
     """
-    if not sentence_transformers_available:
-        logger.warning("Sentence-Transformers not available. Cannot generate embeddings.")
-        return None
-        
     try:
         # Check if model is already downloaded
-        model_path = os.path.join(EMBEDDING_MODEL_DIR, DEFAULT_EMBEDDING_MODEL)
+        model_path = os.path.join(EMBEDDING_MODEL_DIR, model_name)
         if os.path.exists(model_path):
             model = SentenceTransformer(model_path)
         else:
             # Download and save the model
-            model = SentenceTransformer(DEFAULT_EMBEDDING_MODEL)
+            model = SentenceTransformer(model_name)
             model.save(model_path)
             
-        logger.info(f"Loaded embedding model: {DEFAULT_EMBEDDING_MODEL}")
+        logger.info(f"Loaded embedding model: {model_name}")
         return model
     except Exception as e:
         logger.error(f"Error loading embedding model: {str(e)}")
         return None
 
+# Loaded models are shared by every request in this process
+embedding_model_registry = ModelRegistry(
+    _load_embedding_model,
+    memory_budget_bytes=EMBEDDING_MODEL_MEMORY_BUDGET_MB * 1024 * 1024
+)
+
+# Chunk embeddings are persisted as memory-mapped segments shared by all worker processes
+embedding_store = EmbeddingStore(CACHED_EMBEDDINGS_DIR)
+
+# Compact the store once this fraction of its rows belongs to deleted or replaced documents
+EMBEDDING_STORE_COMPACT_FRACTION = float(os.getenv("EMBEDDING_STORE_COMPACT_FRACTION", "0.3"))
+
+# Also keep embedding vectors inside document_embeddings (only needed by older deployments)
+STORE_EMBEDDINGS_IN_MONGO = os.getenv("STORE_EMBEDDINGS_IN_MONGO", "false").lower() == "true"
+
+# In-memory index over the store; _vector_index_generation is the store generation it reflects
+vector_index = VectorIndex()
+_vector_index_generation = None
+_vector_index_lock = threading.Lock()
+
+def get_embedding_model(model_name: str = DEFAULT_EMBEDDING_MODEL):
+    """
+    Get a sentence transformer model for generating embeddings
+    
+    Args:
+        model_name: Name of the sentence transformer model
+        
+    Returns:
+        SentenceTransformer model instance or None if not available
+    """
+    if not sentence_transformers_available:
+        logger.warning("Sentence-Transformers not available. Cannot generate embeddings.")
+        return None
+        
+    return embedding_model_registry.get(model_name)
+
+def warm_up_embedding_models(model_names: List[str] = None) -> Dict[str, bool]:
+    """
+    Load embedding models and run a dummy encode so the first request doesn't pay for it
+    
+    Args:
+        model_names: Models to load (defaults to the default embedding model)
+        
+    Returns:
+        Dict mapping model name to whether it was loaded successfully
+    """
+    if not sentence_transformers_available:
+        return {}
+        
+    return embedding_model_registry.warm_up(
+        model_names or [DEFAULT_EMBEDDING_MODEL],
+        probe=lambda model: model.encode(["warm-up"])
+    )
+
+def get_embedding_model_stats() -> Dict[str, Any]:
+    """
+    Get load-time and hit/miss counters for the embedding model registry
+    
+    Returns:
+        Dict of registry statistics
+    """
+    return embedding_model_registry.stats()
+
 def generate_embeddings(texts: List[str]) -> Optional[List[List[float]]]:
     """
     Generate embeddings for a list of texts
@@ -123,21 +196,26 @@ def chunk_document(text: str, chunk_size: int = 500, overlap: int = 50) -> List[
         
         # Adjust end position to not cut words
         if end < len(text):
+            # Split points within the overlap would not move the next chunk forward
+            window = text[start:end]
+            
             # Try to find a period, question mark, or exclamation mark
             for punct in ['. ', '? ', '! ']:
-                punct_pos = text[start:end].rfind(punct)
+                punct_pos = window.rfind(punct, overlap)
                 if punct_pos != -1:
                     end = start + punct_pos + 2  # Include the punctuation and space
                     break
             
             # If no punctuation found, try to find a space
             if end == start + chunk_size:
-                space_pos = text[start:end].rfind(' ')
+                space_pos = window.rfind(' ', overlap)
                 if space_pos != -1:
                     end = start + space_pos + 1  # Include the space
         
         chunks.append(text[start:end])
-        start = end - overlap
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
     
     return chunks
 
@@ -185,6 +263,142 @@ def extract_structured_data(text: str, schema: Dict[str, str]) -> Dict[str, Any]
     
     return result
 
+def _write_chunk_batch(db, chunk_docs: List[Dict[str, Any]]) -> int:
+    """
+    Insert a batch of chunk documents in a single unordered round trip
+    
+    Args:
+        db: MongoDB database
+        chunk_docs: Chunk documents to insert
+        
+    Returns:
+        int: Number of inserted documents
+    """
+    result = db.document_embeddings.insert_many(chunk_docs, ordered=False)
+    return len(result.inserted_ids)
+
+def index_documents(
+    documents: List[Dict[str, Any]],
+    chunk_size: int = 500,
+    batch_size: int = INDEX_BATCH_SIZE
+) -> Dict[str, bool]:
+    """
+    Index many documents for semantic search in batches
+    
+    Chunks from all documents are embedded in fixed-size batches, and each
+    batch is written with one insert_many while the next batch is embedded.
+    
+    Args:
+        documents: List of dicts with document_id, text and optional metadata
+        chunk_size: Size of chunks to split documents into
+        batch_size: Number of chunks embedded and written per batch
+        
+    Returns:
+        Dict mapping each document ID to whether it was indexed successfully
+    """
+    # A document listed twice is indexed once, using its last entry
+    documents = list({doc["document_id"]: doc for doc in documents}.values())
+    results = {doc["document_id"]: False for doc in documents}
+    
+    db = get_database()
+    if db is None:
+        logger.error("Database connection failed")
+        return results
+        
+    try:
+        # Chunk every document up front so batches can span document boundaries
+        chunks_by_document = {}
+        metadata_by_document = {}
+        pending = []  # (document_id, chunk_index, chunk_text)
+        for doc in documents:
+            document_id = doc["document_id"]
+            chunks = chunk_document(doc.get("text", ""), chunk_size=chunk_size)
+            if not chunks:
+                logger.error(f"No chunks generated from document {document_id}")
+                continue
+            chunks_by_document[document_id] = chunks
+            metadata_by_document[document_id] = doc.get("metadata")
+            pending.extend((document_id, i, chunk) for i, chunk in enumerate(chunks))
+        
+        if not chunks_by_document:
+            return results
+        
+        # Replace any existing chunks for these documents
+        db.document_embeddings.delete_many({"document_id": {"$in": list(chunks_by_document.keys())}})
+        
+        embeddings_by_document = {document_id: [] for document_id in chunks_by_document}
+        failed = set()
+        
+        def wait_for_write(future, batch_ids):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error writing chunk batch: {str(e)}")
+                failed.update(batch_ids)
+        
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            write_future, write_ids = None, None
+            for start in range(0, len(pending), batch_size):
+                batch = [item for item in pending[start:start + batch_size] if item[0] not in failed]
+                if not batch:
+                    continue
+                batch_ids = {document_id for document_id, _, _ in batch}
+                
+                embeddings = generate_embeddings([chunk for _, _, chunk in batch])
+                if not embeddings:
+                    logger.error("Failed to generate embeddings")
+                    failed.update(batch_ids)
+                    continue
+                
+                now = datetime.datetime.utcnow()
+                chunk_docs = []
+                for (document_id, chunk_index, chunk), embedding in zip(batch, embeddings):
+                    embeddings_by_document[document_id].append(embedding)
+                    chunk_doc = {
+                        "document_id": document_id,
+                        "chunk_index": chunk_index,
+                        "chunk_text": chunk,
+                        "metadata": metadata_by_document[document_id],
+                        "indexed_at": now
+                    }
+                    if STORE_EMBEDDINGS_IN_MONGO:
+                        chunk_doc["embedding"] = embedding
+                    chunk_docs.append(chunk_doc)
+                
+                # Embed the next batch while this one is being written
+                if write_future is not None:
+                    wait_for_write(write_future, write_ids)
+                write_future, write_ids = writer.submit(_write_chunk_batch, db, chunk_docs), batch_ids
+                
+            if write_future is not None:
+                wait_for_write(write_future, write_ids)
+        
+        for document_id, chunks in chunks_by_document.items():
+            if document_id in failed:
+                continue
+            embeddings = embeddings_by_document[document_id]
+            metadata = metadata_by_document[document_id]
+            try:
+                generation = embedding_store.put_document(document_id, chunks, embeddings, metadata)
+                _apply_to_vector_index(generation, document_id, chunks, embeddings, metadata)
+            except Exception as e:
+                logger.error(f"Error storing embeddings for document {document_id}: {str(e)}")
+                failed.add(document_id)
+                continue
+            results[document_id] = True
+            logger.info(f"Successfully indexed document {document_id} with {len(chunks)} chunks")
+        
+        if failed:
+            # Their old chunks are already gone from MongoDB; drop the old embeddings too so searches
+            # don't return stale chunks
+            _delete_documents(db, list(failed))
+        
+        return results
+        
+    except Exception as e:
+        logger.error(f"Error indexing documents: {str(e)}")
+        return results
+
 def index_document(
     document_id: str, 
     text: str, 
@@ -203,72 +417,218 @@ def index_document(
     Returns:
         bool: True if indexing was successful, False otherwise
     """
-    db = get_database()
-    if not db:
-        logger.error("Database connection failed")
-        return False
+    results = index_documents(
+        [{"document_id": document_id, "text": text, "metadata": metadata}],
+        chunk_size=chunk_size
+    )
+    return results[document_id]
+
+def _apply_to_vector_index(generation: int, document_id: str, chunks: List[str],
+                           embeddings: List[List[float]], metadata: Dict[str, Any] = None) -> None:
+    """
+    Add a freshly stored document to the in-memory index without reloading it
+    
+    Args:
+        generation: Store generation returned by the write
+        document_id: ID of the document
+        chunks: Chunk texts
+        embeddings: Embedding for each chunk
+        metadata: Metadata stored with the document
+    """
+    global _vector_index_generation
+    with _vector_index_lock:
+        # If another process wrote in between, the next search reloads from the store instead
+        if _vector_index_generation == generation - 1:
+            vector_index.add_document(document_id, chunks, embeddings, metadata)
+            _vector_index_generation = generation
+
+def _delete_documents(db, document_ids: List[str]) -> int:
+    """
+    Remove documents' chunks from MongoDB, the embedding store and the vector index
+    
+    Args:
+        db: MongoDB database (None to only clean up the store and index)
+        document_ids: IDs of the documents
         
-    try:
-        # Ensure document_embeddings collection exists
-        if "document_embeddings" not in db.list_collection_names():
-            db.create_collection("document_embeddings")
-            db.document_embeddings.create_index([("document_id", pymongo.ASCENDING)])
-            db.document_embeddings.create_index([("chunk_index", pymongo.ASCENDING)])
-            db.document_embeddings.create_index([
-                ("document_id", pymongo.ASCENDING),
-                ("chunk_index", pymongo.ASCENDING)
-            ], unique=True)
-        
-        # Check if embeddings already exist for this document
-        existing = db.document_embeddings.find_one({"document_id": document_id})
-        if existing:
-            logger.info(f"Deleting existing embeddings for document {document_id}")
-            db.document_embeddings.delete_many({"document_id": document_id})
-        
-        # Chunk the document
-        chunks = chunk_document(text, chunk_size=chunk_size)
-        if not chunks:
-            logger.error("No chunks generated from document")
-            return False
+    Returns:
+        int: Number of documents removed from the store
+    """
+    global _vector_index_generation
+    if db is not None:
+        try:
+            db.document_embeddings.delete_many({"document_id": {"$in": document_ids}})
+        except Exception as e:
+            logger.error(f"Error deleting chunks of {len(document_ids)} documents: {str(e)}")
+    
+    removed = 0
+    for document_id in document_ids:
+        try:
+            generation = embedding_store.delete_document(document_id)
+        except Exception as e:
+            logger.error(f"Error deleting embeddings of document {document_id}: {str(e)}")
+            continue
+        if generation is None:
+            continue
+        removed += 1
+        with _vector_index_lock:
+            # As in _apply_to_vector_index: otherwise the next search reloads from the store
+            if _vector_index_generation == generation - 1:
+                vector_index.remove_document(document_id)
+                _vector_index_generation = generation
+    return removed
+
+def delete_documents(document_ids: List[str]) -> int:
+    """
+    Remove documents from the search index
+    
+    Args:
+        document_ids: IDs of the documents
         
-        # Generate embeddings for chunks
-        embeddings = generate_embeddings(chunks)
-        if not embeddings:
-            logger.error("Failed to generate embeddings")
-            return False
+    Returns:
+        int: Number of documents that were indexed
+    """
+    if not document_ids:
+        return 0
+    removed = _delete_documents(get_database(), list(document_ids))
+    logger.info(f"Deleted {removed} documents from the search index")
+    return removed
+
+def list_indexed_documents(prefix: str = "") -> List[str]:
+    """
+    List the documents in the embedding store
+    
+    Args:
+        prefix: Only return IDs starting with this prefix
         
-        # Store chunks and embeddings
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            db.document_embeddings.insert_one({
-                "document_id": document_id,
-                "chunk_index": i,
-                "chunk_text": chunk,
-                "embedding": embedding,
-                "metadata": metadata,
-                "indexed_at": datetime.datetime.utcnow()
-            })
-        
-        logger.info(f"Successfully indexed document {document_id} with {len(chunks)} chunks")
-        return True
+    Returns:
+        List of document IDs
+    """
+    embedding_store.refresh()
+    return embedding_store.document_ids(prefix)
+
+def compact_embedding_store(min_dead_fraction: float = EMBEDDING_STORE_COMPACT_FRACTION) -> bool:
+    """
+    Reclaim the space of deleted and replaced documents once enough of it has built up
+    
+    The in-memory vector index reloads from the compacted segments on the next search.
+    
+    Args:
+        min_dead_fraction: Fraction of dead rows required before compacting
         
+    Returns:
+        bool: True if the store was compacted
+    """
+    embedding_store.refresh()
+    stats = embedding_store.stats()
+    dead_rows = stats["rows"] - stats["live_rows"]
+    if not dead_rows or dead_rows < min_dead_fraction * stats["rows"]:
+        return False
+    try:
+        embedding_store.compact()
     except Exception as e:
-        logger.error(f"Error indexing document: {str(e)}")
+        logger.error(f"Error compacting embedding store: {str(e)}")
         return False
+    logger.info(f"Compacted embedding store, dropping {dead_rows} dead rows")
+    return True
+
+def _import_mongo_embeddings(db) -> int:
+    """
+    Copy embeddings stored inside document_embeddings into the on-disk store
+    
+    Args:
+        db: MongoDB database
+        
+    Returns:
+        int: Number of documents imported
+    """
+    cursor = db.document_embeddings.find(
+        {"embedding": {"$exists": True}},
+        {"_id": 0, "document_id": 1, "chunk_index": 1, "chunk_text": 1, "embedding": 1, "metadata": 1}
+    ).sort([("document_id", pymongo.ASCENDING), ("chunk_index", pymongo.ASCENDING)])
+    
+    imported = 0
+    
+    def flush(document_id, chunks, embeddings, metadata):
+        nonlocal imported
+        if chunks and not embedding_store.has_document(document_id):
+            embedding_store.put_document(document_id, chunks, embeddings, metadata)
+            imported += 1
+    
+    # Chunks arrive grouped by document, so each document is written in one call
+    current_id = None
+    chunks, embeddings, metadata = [], [], None
+    for chunk in cursor:
+        if not chunk.get("embedding"):
+            continue
+        if chunk["document_id"] != current_id:
+            flush(current_id, chunks, embeddings, metadata)
+            current_id = chunk["document_id"]
+            chunks, embeddings, metadata = [], [], chunk.get("metadata")
+        chunks.append(chunk["chunk_text"])
+        embeddings.append(chunk["embedding"])
+    flush(current_id, chunks, embeddings, metadata)
+    
+    embedding_store.mark_mongo_imported()
+    logger.info(f"Imported embeddings for {imported} documents from MongoDB into the embedding store")
+    return imported
+
+def _ensure_vector_index_loaded() -> bool:
+    """
+    Make sure the in-memory vector index reflects the latest embedding store contents
+    
+    Returns:
+        bool: True if the index is ready
+    """
+    global vector_index, _vector_index_generation
+    embedding_store.refresh()
+    if _vector_index_generation == embedding_store.generation:
+        return True
+        
+    with _vector_index_lock:
+        embedding_store.refresh()
+        if _vector_index_generation == embedding_store.generation:
+            return True
+            
+        try:
+            # Embeddings written before the store existed only live in MongoDB
+            if not embedding_store.mongo_imported:
+                db = get_database()
+                if db is None:
+                    logger.error("Database connection failed")
+                    return False
+                _import_mongo_embeddings(db)
+            
+            index = VectorIndex()
+            for vectors, chunks in embedding_store.open_segments():
+                index.attach_segment(vectors, chunks)
+                
+            vector_index = index
+            _vector_index_generation = embedding_store.generation
+            logger.info(f"Loaded vector index with {len(index)} chunks from the embedding store")
+            return True
+        except Exception as e:
+            logger.error(f"Error loading vector index: {str(e)}")
+            return False
 
-def search_documents(query: str, limit: int = 5) -> List[Dict[str, Any]]:
+def search_documents(query: str, limit: int = 5, document_ids: List[str] = None,
+                     exclude_prefix: str = None) -> List[Dict[str, Any]]:
     """
     Search indexed documents using semantic similarity
     
     Args:
         query: Search query text
         limit: Maximum number of results to return
+        document_ids: Optionally restrict the search to these documents
+        exclude_prefix: Skip documents whose ID starts with this prefix
         
     Returns:
         List of matching document chunks with similarity scores
     """
-    db = get_database()
-    if not db or not sentence_transformers_available:
-        logger.error("Database connection failed or sentence_transformers not available")
+    if not sentence_transformers_available:
+        logger.error("sentence_transformers not available")
+        return []
+        
+    if not _ensure_vector_index_loaded():
         return []
         
     try:
@@ -278,41 +638,38 @@ def search_documents(query: str, limit: int = 5) -> List[Dict[str, Any]]:
             logger.error("Failed to generate embedding for query")
             return []
         
-        # For a real implementation, you would use a vector database or 
-        # an efficient nearest-neighbor search algorithm.
-        # Here we'll just retrieve all embeddings and compute similarity.
-        
-        all_chunks = list(db.document_embeddings.find({}))
-        results = []
-        
-        for chunk in all_chunks:
-            try:
-                # Calculate cosine similarity
-                chunk_embedding = chunk.get("embedding", [])
-                if not chunk_embedding:
-                    continue
-                    
-                similarity = np.dot(query_embedding[0], chunk_embedding) / (
-                    np.linalg.norm(query_embedding[0]) * np.linalg.norm(chunk_embedding)
-                )
-                
-                results.append({
-                    "document_id": chunk["document_id"],
-                    "chunk_text": chunk["chunk_text"],
-                    "similarity": float(similarity),
-                    "metadata": chunk.get("metadata", {})
-                })
-            except Exception as e:
-                logger.error(f"Error calculating similarity: {str(e)}")
-        
-        # Sort by similarity and return top results
-        results.sort(key=lambda x: x["similarity"], reverse=True)
-        return results[:limit]
+        return vector_index.search(query_embedding[0], limit, document_ids=document_ids,
+                                   exclude_prefix=exclude_prefix)
         
     except Exception as e:
         logger.error(f"Error searching documents: {str(e)}")
         return []
 
+def is_document_indexed(document_id: str) -> bool:
+    """
+    Check whether a document has embeddings in the store
+    
+    Args:
+        document_id: ID of the document
+        
+    Returns:
+        bool: True if the document is indexed
+    """
+    embedding_store.refresh()
+    return embedding_store.has_document(document_id)
+
+def get_vector_index_stats() -> Dict[str, Any]:
+    """
+    Get size and mode information for the in-memory vector index
+    
+    Returns:
+        Dict of index statistics
+    """
+    stats = vector_index.stats()
+    stats["generation"] = _vector_index_generation
+    stats["store"] = embedding_store.stats()
+    return stats
+
 def get_model_info(model_id: str) -> Optional[Dict[str, Any]]:
     """
     Get information about a trained model
@@ -324,7 +681,7 @@ def get_model_info(model_id: str) -> Optional[Dict[str, Any]]:
         Dict with model information or None if not found
     """
     db = get_database()
-    if not db:
+    if db is None:
         logger.error("Database connection failed")
         return None
         
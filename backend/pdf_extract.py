@@ -0,0 +1,301 @@
+"""
+Page-parallel PDF text extraction.
+
+A PDF is split into page ranges that are extracted on a shared process pool
+(text extraction is CPU-bound, so threads would serialize on the GIL). Each
+worker opens the document once and picks an extractor per page:
+
+- the fast extractor (PyMuPDF if installed, otherwise PyPDF2) runs first
+- pages whose text looks wrong - empty, unmapped glyphs, missing spaces -
+  are re-extracted with pdfminer, in one pass per range
+- pages without any fonts are images (scans) and are skipped, since no text
+  extractor can read them
+
+Page texts are collected in lists and joined once. Small documents are
+extracted in-process, where the pool's startup and pickling cost isn't worth it.
+"""
+import os
+import sys
+import math
+import logging
+import threading
+import multiprocessing
+import importlib.machinery
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# PyMuPDF is optional - it requires a compiler on some platforms
+try:
+    import fitz
+    fitz_available = True
+except ImportError:
+    fitz = None
+    fitz_available = False
+
+try:
+    import PyPDF2
+    pypdf2_available = True
+except ImportError:
+    PyPDF2 = None
+    pypdf2_available = False
+
+try:
+    from pdfminer.high_level import extract_text as pdfminer_extract_text
+    pdfminer_available = True
+except ImportError:
+    pdfminer_extract_text = None
+    pdfminer_available = False
+
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 2)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# Documents with fewer pages are extracted in the request process
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "24"))
+
+# Workers must not be forked from the server: its threads (event loop, MongoDB monitors, queue
+# workers) may hold locks at fork time that the child could never release
+PDF_EXTRACT_START_METHOD = os.getenv(
+    "PDF_EXTRACT_START_METHOD",
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# Heuristics for text that needs the slower, layout-aware extractor
+MIN_PAGE_CHARS = 20
+MIN_SPACE_RATIO = 0.05
+MAX_REPLACEMENT_RATIO = 0.01
+
+_executor = None
+_executor_lock = threading.Lock()
+# Serializes task submission, which is when the pool starts new workers
+_submit_lock = threading.Lock()
+
+
+def needs_fallback(text: Optional[str]) -> bool:
+    """
+    Check whether a page's text looks badly extracted
+
+    Args:
+        text: Text from the fast extractor
+
+    Returns:
+        bool: True if the page should be re-extracted with pdfminer
+    """
+    if not text:
+        return True
+    stripped = text.strip()
+    if len(stripped) < MIN_PAGE_CHARS:
+        return True
+    # Glyphs without a Unicode mapping
+    if "(cid:" in stripped or stripped.count("�") > len(stripped) * MAX_REPLACEMENT_RATIO:
+        return True
+    # Words run together - PyPDF2 drops spaces on some layouts
+    if len(stripped) > 200 and stripped.count(" ") < len(stripped) * MIN_SPACE_RATIO:
+        return True
+    return False
+
+
+def page_count(pdf_path: str) -> Optional[int]:
+    """
+    Count the pages of a PDF
+
+    Args:
+        pdf_path: Path to the PDF
+
+    Returns:
+        Number of pages, or None if no page-level extractor is installed
+    """
+    if fitz_available:
+        with fitz.open(pdf_path) as doc:
+            return doc.page_count
+    if pypdf2_available:
+        with open(pdf_path, 'rb') as file:
+            return len(PyPDF2.PdfReader(file).pages)
+    return None
+
+
+def _pypdf2_has_fonts(resources, depth: int = 0) -> bool:
+    """Check a PyPDF2 resource dictionary, including form XObjects, for fonts"""
+    if resources is None or depth > 3:
+        return False
+    resources = resources.get_object()
+    if "/Font" in resources:
+        return True
+    xobjects = resources.get("/XObject")
+    if xobjects is None:
+        return False
+    for xobject in xobjects.get_object().values():
+        xobject = xobject.get_object()
+        if xobject.get("/Subtype") == "/Form" and _pypdf2_has_fonts(xobject.get("/Resources"), depth + 1):
+            return True
+    return False
+
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> List[Tuple[int, str, str]]:
+    """
+    Extract pages [start, end) of a PDF, choosing the extractor per page
+
+    Runs in pool workers, so it only takes and returns picklable values.
+
+    Args:
+        pdf_path: Path to the PDF
+        start: First page index
+        end: Page index after the last page
+
+    Returns:
+        List of (page index, text, extractor name)
+    """
+    results = {}
+    retry = []
+
+    if fitz_available:
+        with fitz.open(pdf_path) as doc:
+            for index in range(start, end):
+                page = doc[index]
+                if not page.get_fonts():
+                    results[index] = ("", "image")
+                    continue
+                text = page.get_text()
+                results[index] = (text, "PyMuPDF")
+                if needs_fallback(text):
+                    retry.append(index)
+    else:
+        with open(pdf_path, 'rb') as file:
+            reader = PyPDF2.PdfReader(file)
+            for index in range(start, end):
+                page = reader.pages[index]
+                if not _pypdf2_has_fonts(page.get("/Resources")):
+                    results[index] = ("", "image")
+                    continue
+                try:
+                    text = page.extract_text() or ""
+                except Exception as e:
+                    logger.debug(f"PyPDF2 failed on page {index + 1}: {str(e)}")
+                    text = ""
+                results[index] = (text, "PyPDF2")
+                if needs_fallback(text):
+                    retry.append(index)
+
+    if retry and pdfminer_available:
+        try:
+            # pdfminer ends every page with a form feed
+            texts = pdfminer_extract_text(pdf_path, page_numbers=retry).split("\f")
+            for index, text in zip(retry, texts):
+                if text.strip() and len(text.strip()) > len(results[index][0].strip()):
+                    results[index] = (text, "pdfminer")
+        except Exception as e:
+            logger.warning(f"pdfminer failed on pages {retry[0] + 1}-{retry[-1] + 1}: {str(e)}")
+
+    return [(index, text, extractor) for index, (text, extractor) in sorted(results.items())]
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context(PDF_EXTRACT_START_METHOD)
+            )
+        return _executor
+
+
+@contextmanager
+def _main_module_hidden():
+    """
+    Keep workers started meanwhile from re-running the server's main module
+
+    forkserver and spawn workers re-import the parent's __main__ (app.py, with its
+    database client, models and thread pools) before running a task, unless it
+    presents itself as a plain "__main__" module, which multiprocessing leaves
+    alone. Tasks only need this module.
+    """
+    main = sys.modules["__main__"]
+    spec = getattr(main, "__spec__", None)
+    main.__spec__ = importlib.machinery.ModuleSpec("__main__", None)
+    try:
+        yield
+    finally:
+        main.__spec__ = spec
+
+
+def _reset_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = None
+
+
+def shutdown() -> None:
+    """Stop the extraction pool"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+        _executor = None
+
+
+def extract_pdf_text(pdf_path: str, pages_per_task: int = PDF_PAGES_PER_TASK,
+                     parallel_min_pages: int = PDF_PARALLEL_MIN_PAGES) -> Optional[str]:
+    """
+    Extract the text of a PDF, page ranges in parallel
+
+    Args:
+        pdf_path: Path to the PDF
+        pages_per_task: Pages per pool task
+        parallel_min_pages: Extract smaller documents in-process
+
+    Returns:
+        Extracted text, or None if no page-level extractor is installed or no page had text
+    """
+    count = page_count(pdf_path)
+    if not count:
+        return None
+
+    # Spread large documents over every worker, but keep tasks big enough to amortize opening the file
+    size = max(pages_per_task, math.ceil(count / (PDF_EXTRACT_WORKERS * 4)))
+    ranges = [(start, min(start + size, count)) for start in range(0, count, size)]
+
+    pages = []
+    if count < parallel_min_pages or len(ranges) == 1:
+        for start, end in ranges:
+            pages.extend(extract_page_range(pdf_path, start, end))
+    else:
+        try:
+            executor = _get_executor()
+            with _submit_lock, _main_module_hidden():
+                futures = [executor.submit(extract_page_range, pdf_path, start, end) for start, end in ranges]
+            for future in futures:
+                pages.extend(future.result())
+        except BrokenProcessPool:
+            logger.warning("PDF extraction pool died; extracting in-process")
+            _reset_executor()
+            pages = []
+            for start, end in ranges:
+                pages.extend(extract_page_range(pdf_path, start, end))
+
+    used = {}
+    for _, _, extractor in pages:
+        used[extractor] = used.get(extractor, 0) + 1
+    logger.info(f"Extracted {count} PDF pages in {len(ranges)} tasks: {used}")
+
+    texts = [text for _, text, _ in pages if text.strip()]
+    return "\n".join(texts) if texts else None
+
+
+def stats() -> Dict[str, Any]:
+    """
+    Get the available extractors and pool settings
+
+    Returns:
+        Dict of extraction settings
+    """
+    return {
+        "extractors": {"PyMuPDF": fitz_available, "PyPDF2": pypdf2_available, "pdfminer": pdfminer_available},
+        "workers": PDF_EXTRACT_WORKERS,
+        "pages_per_task": PDF_PAGES_PER_TASK,
+        "parallel_min_pages": PDF_PARALLEL_MIN_PAGES
+    }
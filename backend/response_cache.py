@@ -0,0 +1,239 @@
+"""
+Cache for LLM chat responses.
+
+Responses are keyed on (model, language, normalized prompt). The exact tier
+answers repeated prompts; the optional semantic tier also answers prompts
+whose embedding is close enough to a cached one. Entries expire after a TTL
+and the least recently used entries are evicted once the cache exceeds its
+byte budget.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() == "true"
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+
+# Fixed per-entry overhead added to the text sizes when accounting bytes
+ENTRY_OVERHEAD_BYTES = 200
+# Embeddings of missed prompts kept for the put() that usually follows
+PENDING_EMBEDDINGS = 256
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Normalize a prompt so trivially different spellings share a cache entry
+
+    Args:
+        prompt: Raw user prompt
+
+    Returns:
+        Lowercased prompt with collapsed whitespace and no trailing punctuation
+    """
+    prompt = re.sub(r"\s+", " ", prompt.strip().lower())
+    return prompt.rstrip(" .!?।")
+
+
+class ResponseCache:
+    """
+    Thread-safe TTL + LRU response cache with an optional embedding-similarity tier
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, ttl_seconds: int = RESPONSE_CACHE_TTL_SECONDS,
+                 embed: Callable[[List[str]], Optional[List[List[float]]]] = None,
+                 similarity_threshold: float = RESPONSE_CACHE_SIMILARITY):
+        """
+        Args:
+            max_bytes: Byte budget for cached prompts, responses and embeddings
+            ttl_seconds: Lifetime of an entry
+            embed: Embedding function enabling the semantic tier (None disables it)
+            similarity_threshold: Minimum cosine similarity for a semantic hit
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> {"response", "expires_at", "size", "embedding"}
+        self._bytes = 0
+        self._matrices = {}  # (model, language) -> (keys, stacked embeddings), rebuilt lazily
+        self._pending = OrderedDict()  # normalized prompt -> embedding computed by a missed get()
+        self._stats = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0
+        }
+
+    def get(self, prompt: str, model: str, language: str) -> Optional[str]:
+        """
+        Look up a cached response
+
+        Args:
+            prompt: User prompt
+            model: Model name
+            language: Response language code
+
+        Returns:
+            Cached response or None
+        """
+        key = (model, language, normalize_prompt(prompt))
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry["expires_at"] > now:
+                    self._entries.move_to_end(key)
+                    self._stats["exact_hits"] += 1
+                    return entry["response"]
+                self._remove(key)
+                self._stats["expirations"] += 1
+
+            if self.embed is None:
+                self._stats["misses"] += 1
+                return None
+
+        # Embedding happens outside the lock so lookups don't serialize on the model
+        embedding = self._embed(key[2])
+
+        with self._lock:
+            if embedding is not None:
+                match = self._nearest(model, language, embedding, now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self._stats["semantic_hits"] += 1
+                    return self._entries[match]["response"]
+
+                # Keep it for put() so a miss embeds the prompt only once
+                self._pending[key[2]] = embedding
+                self._pending.move_to_end(key[2])
+                if len(self._pending) > PENDING_EMBEDDINGS:
+                    self._pending.popitem(last=False)
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, prompt: str, model: str, language: str, response: str) -> None:
+        """
+        Store a response
+
+        Args:
+            prompt: User prompt
+            model: Model name
+            language: Response language code
+            response: Model response
+        """
+        normalized = normalize_prompt(prompt)
+        key = (model, language, normalized)
+        embedding = None
+        if self.embed is not None:
+            with self._lock:
+                embedding = self._pending.pop(normalized, None)
+            if embedding is None:
+                embedding = self._embed(normalized)
+
+        size = len(normalized.encode('utf-8')) + len(response.encode('utf-8')) + ENTRY_OVERHEAD_BYTES
+        if embedding is not None:
+            size += embedding.nbytes
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "response": response,
+                "expires_at": time.time() + self.ttl_seconds,
+                "size": size,
+                "embedding": embedding
+            }
+            self._bytes += size
+            if embedding is not None:
+                self._matrices.pop((model, language), None)
+
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        """Remove every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._matrices.clear()
+            self._pending.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get hit-rate metrics and cache size
+
+        Returns:
+            Dict of cache statistics
+        """
+        with self._lock:
+            hits = self._stats["exact_hits"] + self._stats["semantic_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "semantic": self.embed is not None
+            }
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Embed a normalized prompt as a unit-length float32 vector"""
+        try:
+            embeddings = self.embed([text])
+            if not embeddings:
+                return None
+            vector = np.asarray(embeddings[0], dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            return vector / norm if norm else None
+        except Exception as e:
+            logger.warning(f"Response cache embedding failed: {str(e)}")
+            return None
+
+    def _nearest(self, model: str, language: str, embedding: np.ndarray, now: float) -> Optional[Tuple]:
+        """Find the most similar live entry above the threshold (caller holds the lock)"""
+        partition = (model, language)
+        if partition not in self._matrices:
+            keys = [key for key, entry in self._entries.items()
+                    if key[:2] == partition and entry["embedding"] is not None]
+            matrix = np.stack([self._entries[key]["embedding"] for key in keys]) if keys else None
+            self._matrices[partition] = (keys, matrix)
+
+        keys, matrix = self._matrices[partition]
+        if matrix is None or matrix.shape[1] != embedding.shape[0]:
+            return None
+
+        scores = matrix @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+
+        key = keys[best]
+        entry = self._entries.get(key)
+        if entry is None or entry["expires_at"] <= now:
+            return None
+        return key
+
+    def _remove(self, key: Tuple) -> None:
+        """Drop an entry and invalidate its partition's embedding matrix (caller holds the lock)"""
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+        if entry["embedding"] is not None:
+            self._matrices.pop(key[:2], None)
@@ -0,0 +1,180 @@
+"""
+Parallel multi-language speech recognition.
+
+Recognition in each candidate language is a network round trip, so instead
+of trying languages one after another, every attempt is submitted to a
+shared thread pool. The result is picked by one of these strategies:
+
+- ``priority``: the first language in the candidate order that succeeds, as
+  soon as every language before it has failed (same answer as trying them in
+  order, but in the time of one call)
+- ``first``: whichever language succeeds first
+- ``best``: the success with the highest confidence
+
+Attempts still queued when a result is chosen are cancelled; attempts already
+in flight finish in the background and are ignored.
+"""
+import os
+import logging
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+SPEECH_RECOGNITION_WORKERS = int(os.getenv("SPEECH_RECOGNITION_WORKERS", "16"))
+SPEECH_RECOGNITION_STRATEGY = os.getenv("SPEECH_RECOGNITION_STRATEGY", "priority")
+SPEECH_RECOGNITION_TIMEOUT_SECONDS = float(os.getenv("SPEECH_RECOGNITION_TIMEOUT_SECONDS", "15"))
+# "google" (Google Web Speech API) or "sphinx" (offline CMU Sphinx, English only - useful for local testing)
+SPEECH_RECOGNIZER_BACKEND = os.getenv("SPEECH_RECOGNIZER_BACKEND", "google")
+
+STRATEGIES = ("priority", "first", "best")
+
+
+def google_backend(recognizer) -> Callable[[Any, str], Optional[Tuple[str, float]]]:
+    """
+    Build a recognition function backed by the Google Web Speech API
+
+    Args:
+        recognizer: speech_recognition.Recognizer
+
+    Returns:
+        Function (audio_data, language) -> (text, confidence) or None
+    """
+    def recognize(audio_data, language):
+        result = recognizer.recognize_google(audio_data, language=language, show_all=True)
+        if not result or not result.get("alternative"):
+            return None
+        best = result["alternative"][0]
+        # Google only reports confidence for some results
+        return best.get("transcript", ""), float(best.get("confidence", 0.5))
+
+    return recognize
+
+
+def sphinx_backend(recognizer) -> Callable[[Any, str], Optional[Tuple[str, float]]]:
+    """
+    Build an offline recognition function backed by CMU Sphinx (requires pocketsphinx)
+
+    Only English models ship with pocketsphinx, so other languages never match.
+
+    Args:
+        recognizer: speech_recognition.Recognizer
+
+    Returns:
+        Function (audio_data, language) -> (text, confidence) or None
+    """
+    def recognize(audio_data, language):
+        if language != "en":
+            return None
+        text = recognizer.recognize_sphinx(audio_data)
+        return (text, 0.5) if text else None
+
+    return recognize
+
+
+class SpeechRecognitionEngine:
+    """
+    Runs recognition attempts for several languages concurrently
+    """
+
+    def __init__(self, recognize: Callable[[Any, str], Optional[Tuple[str, float]]],
+                 max_workers: int = SPEECH_RECOGNITION_WORKERS, strategy: str = SPEECH_RECOGNITION_STRATEGY,
+                 timeout: float = SPEECH_RECOGNITION_TIMEOUT_SECONDS):
+        """
+        Args:
+            recognize: Function (audio_data, language) -> (text, confidence) or None,
+                raising or returning None when the speech isn't recognized
+            max_workers: Size of the shared recognition thread pool
+            strategy: Default strategy - "priority", "first" or "best"
+            timeout: Seconds to wait for attempts before giving up
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown speech recognition strategy: {strategy}")
+        self._recognize = recognize
+        self.strategy = strategy
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speech-recognition")
+        self._stats = {"requests": 0, "attempts": 0, "recognized": 0, "cancelled": 0}
+
+    def recognize(self, audio_data, languages: Sequence[str],
+                  strategy: str = None) -> Optional[Dict[str, Any]]:
+        """
+        Recognize speech, trying all candidate languages at once
+
+        Args:
+            audio_data: speech_recognition.AudioData
+            languages: Candidate language codes, most likely first
+            strategy: Override of the default strategy
+
+        Returns:
+            Dict with text, language and confidence, or None if no language matched
+        """
+        strategy = strategy or self.strategy
+        languages = list(dict.fromkeys(languages))
+        if not languages:
+            return None
+
+        self._stats["requests"] += 1
+        self._stats["attempts"] += len(languages)
+        futures = {self._executor.submit(self._attempt, audio_data, language): language for language in languages}
+        results = {}  # language -> (text, confidence) or None on failure
+        chosen = None
+
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout=self.timeout):
+                language = futures[future]
+                results[language] = future.result()
+
+                if strategy == "first" and results[language]:
+                    chosen = language
+                elif strategy == "priority":
+                    # The highest-priority language that hasn't failed decides
+                    for candidate in languages:
+                        if candidate not in results:
+                            break
+                        if results[candidate]:
+                            chosen = candidate
+                            break
+                if chosen:
+                    break
+        except concurrent.futures.TimeoutError:
+            logger.warning(f"Speech recognition timed out after {self.timeout}s "
+                           f"({len(results)}/{len(languages)} languages finished)")
+        finally:
+            for future in futures:
+                if future.cancel():
+                    self._stats["cancelled"] += 1
+
+        if chosen is None:
+            successes = [language for language in languages if results.get(language)]
+            if not successes:
+                return None
+            if strategy == "best":
+                chosen = max(successes, key=lambda language: results[language][1])
+            else:
+                # Timed out waiting for a higher-priority language: take the best-placed success
+                chosen = successes[0]
+
+        text, confidence = results[chosen]
+        self._stats["recognized"] += 1
+        logger.info(f"Recognized speech in {chosen} (confidence {confidence:.2f}, strategy {strategy})")
+        return {"text": text, "language": chosen, "confidence": confidence}
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get request and attempt counters
+
+        Returns:
+            Dict of engine statistics
+        """
+        return {**self._stats, "strategy": self.strategy}
+
+    def _attempt(self, audio_data, language: str) -> Optional[Tuple[str, float]]:
+        try:
+            result = self._recognize(audio_data, language)
+            if result and result[0]:
+                return result
+        except Exception as e:
+            logger.warning(f"Recognition failed for language {language}: {str(e)}")
+        return None
@@ -0,0 +1,288 @@
+"""
+Map-reduce summarization of long documents.
+
+The text is split into sections of about SUMMARY_SECTION_TOKENS tokens. All
+sections are summarized concurrently (map), then the section summaries are
+combined SUMMARY_REDUCE_FANIN at a time, level by level, until one summary is
+left (reduce). Every level runs concurrently, so a document takes about as long
+as one call per level rather than one call per section.
+
+SUMMARY_MAX_CALLS caps the LLM calls a single document may use. When a
+document has more sections than the cap allows, evenly spaced sections are
+summarized (always including the first and last) so the summary still covers
+the whole document.
+
+The summaries of every level are kept as a tree, stored per file, so follow-up
+requests (one section, a shorter or a more detailed summary) are answered from
+stored nodes. Only sections skipped by the call budget and the short summary
+need one more call, and their results are stored too.
+"""
+import os
+import math
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+import chat_context
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SECTION_TOKENS = int(os.getenv("SUMMARY_SECTION_TOKENS", "3000"))
+SUMMARY_REDUCE_FANIN = int(os.getenv("SUMMARY_REDUCE_FANIN", "8"))
+SUMMARY_MAX_CALLS = int(os.getenv("SUMMARY_MAX_CALLS", "16"))
+SUMMARY_MAX_CONCURRENCY = int(os.getenv("SUMMARY_MAX_CONCURRENCY", "8"))
+
+# Output tokens of section and intermediate summaries, and of the final summary
+PARTIAL_SUMMARY_TOKENS = 300
+FINAL_SUMMARY_TOKENS = 512
+
+FINAL_PROMPT = ("Summarize the following text extract from a file. Provide a clear, concise overview that tells "
+                "what the file is about, including key topics, structure, and important insights:\n\n{text}")
+SECTION_PROMPT = ("The following is part {part} of {parts} of a file. Summarize the key points, facts, names and "
+                  "figures of this part in a short paragraph:\n\n{text}")
+COMBINE_PROMPT = ("The following are summaries of consecutive parts of a file, in order. Combine them into one "
+                  "summary that keeps the key points, facts, names and figures:\n\n{text}")
+FINAL_COMBINE_PROMPT = ("The following are summaries of consecutive parts of a file, in order. Write a clear, concise "
+                        "overview of the whole file, including key topics, structure, and important "
+                        "insights:\n\n{text}")
+
+SHORT_PROMPT = ("Condense the following summary of a file into two or three sentences that say what the file is "
+                "about:\n\n{text}")
+
+# (prompts, max_tokens) -> completion for each prompt, None where it failed
+CompleteMany = Callable[[List[str], int], List[Optional[str]]]
+
+
+def split_sections(text: str, max_tokens: int = SUMMARY_SECTION_TOKENS) -> List[str]:
+    """
+    Split text into consecutive sections of at most max_tokens estimated tokens
+
+    Sections end at line breaks where possible; longer lines are cut.
+
+    Args:
+        text: Document text
+        max_tokens: Token limit per section
+
+    Returns:
+        List of sections in document order
+    """
+    sections = []
+    current = []
+    current_tokens = 0
+    for line in text.splitlines(keepends=True):
+        tokens = chat_context.estimate_tokens(line)
+        pieces = [line]
+        if tokens > max_tokens:
+            size = max(1, int(len(line) * max_tokens / tokens))
+            pieces = [line[i:i + size] for i in range(0, len(line), size)]
+        for piece in pieces:
+            piece_tokens = chat_context.estimate_tokens(piece) if len(pieces) > 1 else tokens
+            if current and current_tokens + piece_tokens > max_tokens:
+                sections.append("".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        sections.append("".join(current))
+    return [section for section in sections if section.strip()]
+
+
+def reduce_calls(count: int, fanin: int = SUMMARY_REDUCE_FANIN) -> int:
+    """
+    Number of reduce calls needed to combine count summaries into one
+
+    Args:
+        count: Number of section summaries
+        fanin: Summaries combined per call
+
+    Returns:
+        int: Number of reduce calls
+    """
+    calls = 0
+    while count > 1:
+        count = math.ceil(count / fanin)
+        calls += count
+    return calls
+
+
+def select_sections(count: int, max_calls: int = SUMMARY_MAX_CALLS, fanin: int = SUMMARY_REDUCE_FANIN) -> List[int]:
+    """
+    Choose which sections to summarize within the call budget
+
+    Args:
+        count: Number of sections
+        max_calls: Total LLM calls allowed for the document
+        fanin: Summaries combined per reduce call
+
+    Returns:
+        Indexes of the sections to summarize, evenly spread over the document
+    """
+    selected = min(count, max(max_calls, 1))
+    while selected > 1 and selected + reduce_calls(selected, fanin) > max_calls:
+        selected -= 1
+    if selected >= count:
+        return list(range(count))
+    if selected == 1:
+        return [0]
+    step = (count - 1) / (selected - 1)
+    return sorted({round(i * step) for i in range(selected)})
+
+
+def summarize(text: str, complete_many: CompleteMany, section_tokens: int = SUMMARY_SECTION_TOKENS,
+              fanin: int = SUMMARY_REDUCE_FANIN, max_calls: int = SUMMARY_MAX_CALLS) -> Dict[str, Any]:
+    """
+    Summarize a document with concurrent map and hierarchical reduce steps
+
+    Args:
+        text: Document text
+        complete_many: Function running a batch of prompts concurrently
+        section_tokens: Token limit per section
+        fanin: Summaries combined per reduce call
+        max_calls: Total LLM calls allowed for the document
+
+    Returns:
+        Dict with the final summary, the summaries of every level (section
+        summaries first, the root last) with the range of sections each one
+        covers, the character offset where each section starts, and the
+        number of LLM calls made
+
+    Raises:
+        RuntimeError: If no section could be summarized
+    """
+    sections = split_sections(text, section_tokens)
+    if not sections:
+        raise RuntimeError("No text to summarize")
+
+    # Sections are consecutive slices of the text, so they can be cut out again for follow-up requests
+    offsets = []
+    position = 0
+    for section in sections:
+        position = text.find(section, position)
+        offsets.append(position)
+        position += len(section)
+    offsets.append(position)
+
+    if len(sections) == 1:
+        summary = complete_many([FINAL_PROMPT.format(text=sections[0])], FINAL_SUMMARY_TOKENS)[0]
+        if not summary:
+            raise RuntimeError("Summary generation failed")
+        levels = [[{"summary": summary, "start": 0, "end": 1}]]
+        return {"summary": summary, "levels": levels, "sections": 1, "offsets": offsets, "calls": 1}
+
+    indexes = select_sections(len(sections), max_calls, fanin)
+    if len(indexes) < len(sections):
+        logger.info(f"Summarizing {len(indexes)} of {len(sections)} sections to stay within {max_calls} calls")
+
+    # Map: summarize the sections concurrently
+    prompts = [SECTION_PROMPT.format(part=i + 1, parts=len(sections), text=sections[i]) for i in indexes]
+    results = complete_many(prompts, PARTIAL_SUMMARY_TOKENS)
+    calls = len(prompts)
+    nodes = [{"summary": summary, "start": i, "end": i + 1} for i, summary in zip(indexes, results) if summary]
+    if not nodes:
+        raise RuntimeError("Summary generation failed for every section")
+    if len(nodes) < len(prompts):
+        logger.warning(f"{len(prompts) - len(nodes)} of {len(prompts)} section summaries failed")
+    levels = [nodes]
+
+    # Reduce: combine consecutive summaries level by level, each level concurrently
+    while len(nodes) > 1:
+        groups = [nodes[i:i + fanin] for i in range(0, len(nodes), fanin)]
+        final = len(groups) == 1
+        prompt = FINAL_COMBINE_PROMPT if final else COMBINE_PROMPT
+        prompts = [prompt.format(text="\n\n".join(node["summary"] for node in group)) for group in groups]
+        results = complete_many(prompts, FINAL_SUMMARY_TOKENS if final else PARTIAL_SUMMARY_TOKENS)
+        calls += len(prompts)
+
+        combined = []
+        for group, summary in zip(groups, results):
+            if not summary:
+                # Keep the parts rather than losing them; the next level combines them instead
+                summary = "\n\n".join(node["summary"] for node in group)
+                if final:
+                    raise RuntimeError("Final summary generation failed")
+            combined.append({"summary": summary, "start": group[0]["start"], "end": group[-1]["end"]})
+        nodes = combined
+        levels.append(nodes)
+
+    logger.info(f"Summarized {len(sections)} sections with {calls} LLM calls in {len(levels)} levels")
+    return {"summary": nodes[0]["summary"], "levels": levels, "sections": len(sections), "offsets": offsets,
+            "calls": calls}
+
+
+def build_tree(result: Dict[str, Any], model: str) -> Dict[str, Any]:
+    """
+    Build the stored summary tree of a document from a summarize() result
+
+    Args:
+        result: Return value of summarize()
+        model: Model that generated the summaries
+
+    Returns:
+        Dict with the section count and offsets, the summary levels and the model
+    """
+    return {
+        "sections": result["sections"],
+        "offsets": result["offsets"],
+        "levels": result["levels"],
+        "model": model
+    }
+
+
+def get_section(tree: Dict[str, Any], index: int) -> Optional[Dict[str, Any]]:
+    """
+    Find the summary of one section in a stored tree
+
+    Args:
+        tree: Summary tree from build_tree()
+        index: Section index (0-based)
+
+    Returns:
+        Section summary node, or None if the section wasn't summarized
+    """
+    for node in tree["levels"][0]:
+        if node["start"] == index and node["end"] == index + 1:
+            return node
+    return None
+
+
+def summarize_section(text: str, tree: Dict[str, Any], index: int, complete_many: CompleteMany) -> Dict[str, Any]:
+    """
+    Summarize a section that was skipped when the tree was built
+
+    Args:
+        text: Document text
+        tree: Summary tree from build_tree()
+        index: Section index (0-based)
+        complete_many: Function running a batch of prompts
+
+    Returns:
+        Section summary node
+
+    Raises:
+        RuntimeError: If the summary couldn't be generated
+    """
+    section = text[tree["offsets"][index]:tree["offsets"][index + 1]]
+    prompt = SECTION_PROMPT.format(part=index + 1, parts=tree["sections"], text=section)
+    summary = complete_many([prompt], PARTIAL_SUMMARY_TOKENS)[0]
+    if not summary:
+        raise RuntimeError(f"Summary generation failed for section {index + 1}")
+    return {"summary": summary, "start": index, "end": index + 1}
+
+
+def condense(summary: str, complete_many: CompleteMany) -> str:
+    """
+    Shorten a summary to a few sentences (one call over the summary, not the document)
+
+    Args:
+        summary: Summary to shorten
+        complete_many: Function running a batch of prompts
+
+    Returns:
+        str: Short summary
+
+    Raises:
+        RuntimeError: If the summary couldn't be generated
+    """
+    short = complete_many([SHORT_PROMPT.format(text=summary)], PARTIAL_SUMMARY_TOKENS)[0]
+    if not short:
+        raise RuntimeError("Short summary generation failed")
+    return short
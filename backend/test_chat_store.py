@@ -0,0 +1,243 @@
+"""
+Tests for bucketed chat storage
+
+Run from the backend directory: python -m unittest test_chat_store
+"""
+import copy
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+import chat_store
+
+BUCKET_SIZE = 3
+
+
+def _values(document, key):
+    """Values a query key refers to: the field itself, or a field of every element of an array"""
+    if "." in key:
+        array, field = key.split(".", 1)
+        return [element[field] for element in document.get(array, []) if field in element]
+    return [document[key]] if key in document else []
+
+
+def _matches(document, query):
+    for key, condition in query.items():
+        values = _values(document, key)
+        if not isinstance(condition, dict):
+            if condition not in values:
+                return False
+            continue
+        for operator, operand in condition.items():
+            if operator == "$exists" and bool(values) != operand:
+                return False
+            if operator == "$ne" and operand in values:
+                return False
+            if operator == "$in" and not any(value in operand for value in values):
+                return False
+            if operator == "$gte" and not any(value >= operand for value in values):
+                return False
+            if operator == "$lte" and not any(value <= operand for value in values):
+                return False
+    return True
+
+
+class FakeCollection:
+    """Just enough of a pymongo collection for chat_store, with a unique index on unique_keys"""
+
+    def __init__(self, unique_keys):
+        self.documents = []
+        self.unique_keys = unique_keys
+        self.fail_next_bulk_write = False
+
+    def insert_one(self, document):
+        if any(all(existing.get(key) == document.get(key) for key in self.unique_keys)
+               for existing in self.documents):
+            raise DuplicateKeyError("duplicate key")
+        self.documents.append(copy.deepcopy(document))
+
+    def find(self, query=None, projection=None):
+        return [copy.deepcopy(document) for document in self.documents if _matches(document, query or {})]
+
+    def find_one(self, query=None, projection=None):
+        found = self.find(query)
+        return found[0] if found else None
+
+    def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=None):
+        return self._update(query, update, upsert)
+
+    def update_one(self, query, update, upsert=False):
+        before = len(self.documents)
+        matched = self._update(query, update, upsert, count_only=True)
+        return SimpleNamespace(matched_count=matched, modified_count=matched,
+                               upserted_id=None if len(self.documents) == before else True)
+
+    def bulk_write(self, operations, ordered=True):
+        if self.fail_next_bulk_write:
+            # The first operation reaches the server before the connection drops
+            self.fail_next_bulk_write = False
+            self.update_one(*operations[0])
+            raise ConnectionError("connection reset")
+        errors = []
+        for index, (query, update, upsert) in enumerate(operations):
+            try:
+                self.update_one(query, update, upsert)
+            except DuplicateKeyError:
+                errors.append({"index": index, "code": 11000})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    def delete_one(self, query):
+        found = [document for document in self.documents if _matches(document, query)][:1]
+        for document in found:
+            self.documents.remove(document)
+        return SimpleNamespace(deleted_count=len(found))
+
+    def delete_many(self, query):
+        found = [document for document in self.documents if _matches(document, query)]
+        for document in found:
+            self.documents.remove(document)
+        return SimpleNamespace(deleted_count=len(found))
+
+    def _update(self, query, update, upsert, count_only=False):
+        for document in self.documents:
+            if _matches(document, query):
+                self._apply(document, update, False)
+                return 1 if count_only else copy.deepcopy(document)
+        if not upsert:
+            return 0 if count_only else None
+        document = {key: value for key, value in query.items() if not isinstance(value, dict)}
+        self._apply(document, update, True)
+        self.insert_one(document)
+        return 0 if count_only else copy.deepcopy(document)
+
+    @staticmethod
+    def _apply(document, update, inserting):
+        for operator, fields in update.items():
+            for key, value in fields.items():
+                if operator == "$set" or (operator == "$setOnInsert" and inserting):
+                    document[key] = copy.deepcopy(value)
+                elif operator == "$inc":
+                    document[key] = document.get(key, 0) + value
+                elif operator == "$push":
+                    document.setdefault(key, []).extend(copy.deepcopy(value["$each"]))
+                elif operator == "$unset":
+                    document.pop(key, None)
+
+
+def fake_update_one(query, update, upsert=False):
+    return (query, update, upsert)
+
+
+def turn(turn_id, chat_id="chat1", user_id="user1", count=2, title="Title"):
+    return {
+        "id": turn_id,
+        "chat_id": chat_id,
+        "user_id": user_id,
+        "title": title,
+        "messages": [{"role": "user", "content": f"{turn_id} message {i}", "turn_id": turn_id}
+                     for i in range(count)]
+    }
+
+
+class ChatStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.db = SimpleNamespace(chats=FakeCollection(["_id"]),
+                                  chat_messages=FakeCollection(["chat_id", "bucket"]))
+        for target, value in [("chat_store.CHAT_BUCKET_SIZE", BUCKET_SIZE),
+                              ("chat_store.UpdateOne", fake_update_one)]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def contents(self, chat_id="chat1"):
+        return [message["content"] for message in chat_store.get_message_range(self.db, chat_id, 0, 1000)]
+
+    def test_append_fills_buckets(self):
+        total = chat_store.append_messages(self.db, "chat1", "user1",
+                                           [{"role": "user", "content": f"m{i}"} for i in range(4)], title="Title")
+        self.assertEqual(total, 4)
+        total = chat_store.append_messages(self.db, "chat1", "user1",
+                                           [{"role": "assistant", "content": f"m{i}"} for i in range(4, 7)])
+        self.assertEqual(total, 7)
+
+        buckets = sorted(self.db.chat_messages.documents, key=lambda bucket: bucket["bucket"])
+        self.assertEqual([bucket["count"] for bucket in buckets], [3, 3, 1])
+        self.assertEqual([bucket["start"] for bucket in buckets], [0, 3, 6])
+        self.assertEqual(self.contents(), [f"m{i}" for i in range(7)])
+        self.assertEqual(chat_store.get_header(self.db, "chat1", "user1")["last_message"]["content"], "m6")
+
+    def test_append_needs_title_to_create_chat(self):
+        self.assertIsNone(chat_store.append_messages(self.db, "chat1", "user1", [{"role": "user", "content": "x"}]))
+        self.assertEqual(self.db.chat_messages.documents, [])
+
+    def test_message_pages(self):
+        chat_store.append_messages(self.db, "chat1", "user1",
+                                   [{"role": "user", "content": f"m{i}"} for i in range(10)], title="Title")
+
+        page = chat_store.get_messages(self.db, "chat1", "user1", limit=4)
+        self.assertEqual(page["total"], 10)
+        self.assertEqual([message["index"] for message in page["messages"]], [6, 7, 8, 9])
+        self.assertEqual(page["nextBefore"], 6)
+
+        contents = []
+        before = None
+        while True:
+            page = chat_store.get_messages(self.db, "chat1", "user1", before=before, limit=4)
+            contents = [message["content"] for message in page["messages"]] + contents
+            before = page["nextBefore"]
+            if before is None:
+                break
+        self.assertEqual(contents, [f"m{i}" for i in range(10)])
+
+        self.assertIsNone(chat_store.get_messages(self.db, "chat1", "someone-else"))
+        header, recent = chat_store.get_recent_messages(self.db, "chat1", "user1", 2)
+        self.assertEqual(header["message_count"], 10)
+        self.assertEqual([message["content"] for message in recent], ["m8", "m9"])
+
+    def test_append_batch_groups_turns_per_chat(self):
+        turns = [turn("t1"), turn("t2", chat_id="chat2"), turn("t3", count=3)]
+        written = chat_store.append_batch(self.db, turns)
+
+        self.assertEqual([t["id"] for t in written], ["t1", "t3", "t2"])
+        self.assertEqual(chat_store.get_header(self.db, "chat1", "user1")["message_count"], 5)
+        self.assertEqual([t["first_seq"] for t in turns], [0, 0, 2])
+        self.assertEqual(self.contents(), [f"t1 message {i}" for i in range(2)] + [f"t3 message {i}" for i in range(3)])
+        self.assertEqual(chat_store.find_written_turns(self.db, turns), {"t1", "t2", "t3"})
+
+    def test_retry_reuses_reserved_seqs(self):
+        turns = [turn("t1", count=2), turn("t2", count=2)]
+        self.db.chat_messages.fail_next_bulk_write = True
+        with self.assertRaises(ConnectionError):
+            chat_store.append_batch(self.db, turns)
+
+        chat_store.append_batch(self.db, turns)
+        self.assertEqual(chat_store.get_header(self.db, "chat1", "user1")["message_count"], 4)
+        messages = chat_store.get_message_range(self.db, "chat1", 0, 1000)
+        self.assertEqual([message["seq"] for message in messages], [0, 1, 2, 3])
+        self.assertEqual([message["content"] for message in messages],
+                         ["t1 message 0", "t1 message 1", "t2 message 0", "t2 message 1"])
+
+    def test_migrate_legacy_chat(self):
+        self.db.chats.insert_one({
+            "_id": "legacy", "user_id": "user1", "title": "Old",
+            "messages": [{"role": "user", "content": f"old{i}"} for i in range(5)]
+        })
+        total = chat_store.append_messages(self.db, "legacy", "user1", [{"role": "user", "content": "new"}])
+
+        self.assertEqual(total, 6)
+        self.assertNotIn("messages", self.db.chats.find_one({"_id": "legacy"}))
+        self.assertEqual(self.contents("legacy"), [f"old{i}" for i in range(5)] + ["new"])
+
+    def test_delete_chat_removes_buckets(self):
+        chat_store.append_messages(self.db, "chat1", "user1",
+                                   [{"role": "user", "content": f"m{i}"} for i in range(5)], title="Title")
+        self.assertFalse(chat_store.delete_chat(self.db, "chat1", "someone-else"))
+        self.assertTrue(chat_store.delete_chat(self.db, "chat1", "user1"))
+        self.assertEqual(self.db.chat_messages.documents, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
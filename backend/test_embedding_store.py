@@ -0,0 +1,105 @@
+"""
+Tests for the on-disk embedding store
+
+Run from the backend directory: python -m unittest test_embedding_store
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+
+def read_documents(store):
+    """Map each live document to its (chunk texts, vectors) as read back from the segments"""
+    documents = {}
+    for vectors, chunks in store.open_segments():
+        for row, chunk in enumerate(chunks):
+            if chunk is None:
+                continue
+            texts, rows = documents.setdefault(chunk["document_id"], ([], []))
+            texts.append(chunk["chunk_text"])
+            rows.append(np.array(vectors[row]))
+    return documents
+
+
+class EmbeddingStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.rng = np.random.default_rng(0)
+
+    def put(self, store, document_id, count):
+        chunks = [f"{document_id} chunk {i}" for i in range(count)]
+        embeddings = self.rng.random((count, 8)).astype(np.float32)
+        store.put_document(document_id, chunks, embeddings, {"source": document_id})
+        return chunks, embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    def assert_documents(self, store, expected):
+        documents = read_documents(store)
+        self.assertEqual(set(documents), set(expected))
+        for document_id, (chunks, vectors) in expected.items():
+            texts, rows = documents[document_id]
+            self.assertEqual(texts, chunks)
+            np.testing.assert_allclose(np.stack(rows), vectors, rtol=1e-6)
+
+    def test_put_and_read_back(self):
+        store = EmbeddingStore(self.directory, segment_rows=4)
+        expected = {document_id: self.put(store, document_id, count)
+                    for document_id, count in [("a", 3), ("b", 5), ("c", 1)]}
+        self.assert_documents(store, expected)
+        self.assert_documents(EmbeddingStore(self.directory), expected)
+
+    def test_replace_and_delete(self):
+        store = EmbeddingStore(self.directory)
+        self.put(store, "a", 3)
+        expected = {"a": self.put(store, "a", 2), "b": self.put(store, "b", 2)}
+        generation = store.delete_document("b")
+        del expected["b"]
+
+        self.assertEqual(generation, store.generation)
+        self.assertIsNone(store.delete_document("b"))
+        self.assert_documents(store, expected)
+        self.assertEqual(store.stats()["live_rows"], 2)
+        self.assertEqual(store.stats()["rows"], 7)
+
+    def test_compact_keeps_live_rows(self):
+        store = EmbeddingStore(self.directory, segment_rows=4)
+        expected = {document_id: self.put(store, document_id, 3) for document_id in "abcd"}
+        store.delete_document("b")
+        del expected["b"]
+        expected["c"] = self.put(store, "c", 2)
+
+        store.compact()
+        self.assert_documents(store, expected)
+        self.assertEqual(store.stats()["rows"], store.stats()["live_rows"])
+        self.assert_documents(EmbeddingStore(self.directory), expected)
+
+    def test_compact_overwrites_leftover_segment_files(self):
+        store = EmbeddingStore(self.directory)
+        expected = {document_id: self.put(store, document_id, 3) for document_id in "ab"}
+
+        # An interrupted compaction left the next segment's files behind
+        with open(os.path.join(self.directory, "segment_00001.f32"), 'wb') as f:
+            f.write(np.ones((5, 8), dtype=np.float32).tobytes())
+        with open(os.path.join(self.directory, "segment_00001.jsonl"), 'wb') as f:
+            f.write(b'{"document_id": "junk", "chunk_index": 0, "chunk_text": "junk"}\n' * 5)
+
+        store.compact()
+        self.assert_documents(store, expected)
+
+    def test_write_after_compact(self):
+        store = EmbeddingStore(self.directory)
+        expected = {"a": self.put(store, "a", 2)}
+        self.put(store, "a", 2)
+        store.compact()
+        expected["a"] = self.put(store, "a", 4)
+        expected["b"] = self.put(store, "b", 1)
+        self.assert_documents(store, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
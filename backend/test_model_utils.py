@@ -0,0 +1,49 @@
+"""
+Tests for document chunking
+
+Run from the backend directory: python -m unittest test_model_utils
+"""
+import unittest
+
+from model_utils import chunk_document
+
+
+class ChunkDocumentTest(unittest.TestCase):
+    def assert_covers(self, text, chunks, chunk_size):
+        self.assertTrue(all(0 < len(chunk) <= chunk_size for chunk in chunks))
+        self.assertTrue(text.startswith(chunks[0]))
+        self.assertTrue(text.endswith(chunks[-1]))
+
+    def test_sentence_end_within_overlap(self):
+        # The only split point is in the first 50 characters of the second window
+        text = "w" * 790 + ". " + "x" * 3000
+        chunks = chunk_document(text, chunk_size=800, overlap=50)
+        self.assert_covers(text, chunks, 800)
+        self.assertLess(len(chunks), 10)
+
+    def test_long_sentences(self):
+        text = ("word " * 150 + ". ") * 20
+        chunks = chunk_document(text, chunk_size=800, overlap=50)
+        self.assert_covers(text, chunks, 800)
+        self.assertLess(len(chunks), 40)
+
+    def test_text_without_split_points(self):
+        text = "x" * 3000
+        chunks = chunk_document(text, chunk_size=800, overlap=50)
+        self.assert_covers(text, chunks, 800)
+        self.assertEqual(len(chunks), 4)
+
+    def test_overlap_not_smaller_than_chunk_size(self):
+        text = "a b. " * 100
+        chunks = chunk_document(text, chunk_size=10, overlap=10)
+        self.assert_covers(text, chunks, 10)
+        self.assertLessEqual(len(chunks), len(text))
+
+    def test_no_overlap_is_exact_split(self):
+        text = "One sentence. Another one? A third! " * 40
+        chunks = chunk_document(text, chunk_size=100, overlap=0)
+        self.assertEqual("".join(chunks), text)
+
+
+if __name__ == "__main__":
+    unittest.main()
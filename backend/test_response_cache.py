@@ -0,0 +1,93 @@
+"""
+Tests for the LLM response cache
+
+Run from the backend directory: python -m unittest test_response_cache
+"""
+import unittest
+from unittest import mock
+
+from response_cache import ResponseCache, normalize_prompt
+
+
+class FakeEmbedder:
+    """Embeds prompts by their words, so prompts sharing words are similar"""
+
+    vocabulary = ["capital", "india", "france", "weather", "today", "what", "is", "the", "of"]
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.extend(texts)
+        return [[float(word in text.split()) for word in self.vocabulary] for text in texts]
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def test_normalize_prompt(self):
+        self.assertEqual(normalize_prompt("  What is   AI?  "), "what is ai")
+        self.assertEqual(normalize_prompt("नमस्ते।"), "नमस्ते")
+
+    def test_exact_hit_and_miss(self):
+        cache = ResponseCache(max_bytes=10000, ttl_seconds=60)
+        self.assertIsNone(cache.get("What is AI?", "model", "en"))
+        cache.put("What is AI?", "model", "en", "Artificial intelligence")
+
+        self.assertEqual(cache.get("what is  ai", "model", "en"), "Artificial intelligence")
+        self.assertIsNone(cache.get("What is AI?", "other-model", "en"))
+        self.assertIsNone(cache.get("What is AI?", "model", "hi"))
+
+        stats = cache.stats()
+        self.assertEqual(stats["exact_hits"], 1)
+        self.assertEqual(stats["misses"], 3)
+        self.assertEqual(stats["hit_rate"], 0.25)
+
+    def test_entries_expire(self):
+        cache = ResponseCache(max_bytes=10000, ttl_seconds=60)
+        with mock.patch("response_cache.time.time", return_value=1000.0):
+            cache.put("hello", "model", "en", "hi there")
+        with mock.patch("response_cache.time.time", return_value=1059.0):
+            self.assertEqual(cache.get("hello", "model", "en"), "hi there")
+        with mock.patch("response_cache.time.time", return_value=1061.0):
+            self.assertIsNone(cache.get("hello", "model", "en"))
+        self.assertEqual(cache.stats()["expirations"], 1)
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ResponseCache(max_bytes=700, ttl_seconds=60)
+        for prompt in ("first", "second", "third"):
+            cache.put(prompt, "model", "en", "x" * 20)
+        self.assertIsNotNone(cache.get("first", "model", "en"))
+        cache.put("fourth", "model", "en", "x" * 20)
+
+        self.assertIsNone(cache.get("second", "model", "en"))
+        self.assertIsNotNone(cache.get("first", "model", "en"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertLessEqual(cache.stats()["bytes"], 700)
+
+    def test_semantic_hit(self):
+        embedder = FakeEmbedder()
+        cache = ResponseCache(max_bytes=10000, ttl_seconds=60, embed=embedder, similarity_threshold=0.9)
+        cache.put("What is the capital of India", "model", "en", "New Delhi")
+
+        self.assertEqual(cache.get("the capital of India is what", "model", "en"), "New Delhi")
+        self.assertIsNone(cache.get("What is the capital of France", "model", "en"))
+        self.assertIsNone(cache.get("the capital of India is what", "model", "hi"))
+        self.assertEqual(cache.stats()["semantic_hits"], 1)
+
+    def test_missed_prompt_is_embedded_once(self):
+        embedder = FakeEmbedder()
+        cache = ResponseCache(max_bytes=10000, ttl_seconds=60, embed=embedder)
+        self.assertIsNone(cache.get("weather today", "model", "en"))
+        cache.put("weather today", "model", "en", "Sunny")
+        self.assertEqual(embedder.calls, ["weather today"])
+
+    def test_failing_embedder_falls_back_to_exact(self):
+        cache = ResponseCache(max_bytes=10000, ttl_seconds=60, embed=mock.Mock(side_effect=RuntimeError("down")))
+        with self.assertLogs("response_cache", "WARNING"):
+            cache.put("hello", "model", "en", "hi there")
+            self.assertEqual(cache.get("hello", "model", "en"), "hi there")
+            self.assertIsNone(cache.get("goodbye", "model", "en"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+Tests for map-reduce summarization
+
+Run from the backend directory: python -m unittest test_summarizer
+"""
+import unittest
+
+import summarizer
+from summarizer import reduce_calls, select_sections, split_sections, summarize
+
+
+class FakeCompleter:
+    """complete_many stand-in that records every batch and answers with a tag per prompt"""
+
+    def __init__(self, fail=()):
+        self.batches = []
+        self.fail = fail
+
+    def __call__(self, prompts, max_tokens):
+        self.batches.append(prompts)
+        return [None if any(marker in prompt for marker in self.fail) else f"summary {len(self.batches)}.{i}"
+                for i, prompt in enumerate(prompts)]
+
+    @property
+    def calls(self):
+        return sum(len(batch) for batch in self.batches)
+
+
+# One line of make_text() per section
+SECTION_TOKENS = 100
+
+
+def make_text(sections):
+    """Text of numbered lines of about 70 tokens each, so each line becomes one section"""
+    return "".join(f"section {i:04d}: " + "words of the document text " * 10 + "\n" for i in range(sections))
+
+
+class SplitSectionsTest(unittest.TestCase):
+    def test_sections_cover_text_in_order(self):
+        text = make_text(7)
+        sections = split_sections(text, max_tokens=SECTION_TOKENS)
+        self.assertEqual(len(sections), 7)
+        self.assertEqual("".join(sections), text)
+
+        sections = split_sections(text, max_tokens=2 * SECTION_TOKENS)
+        self.assertEqual(len(sections), 4)
+        self.assertEqual("".join(sections), text)
+        self.assertTrue(all(summarizer.chat_context.estimate_tokens(s) <= 2 * SECTION_TOKENS for s in sections))
+        self.assertTrue(all(section.endswith("\n") for section in sections))
+
+    def test_long_line_is_cut(self):
+        text = "x" * 5000
+        sections = split_sections(text, max_tokens=SECTION_TOKENS)
+        self.assertGreater(len(sections), 1)
+        self.assertEqual("".join(sections), text)
+
+
+class BudgetTest(unittest.TestCase):
+    def test_reduce_calls(self):
+        self.assertEqual(reduce_calls(1, fanin=8), 0)
+        self.assertEqual(reduce_calls(8, fanin=8), 1)
+        self.assertEqual(reduce_calls(9, fanin=8), 3)
+        self.assertEqual(reduce_calls(64, fanin=8), 9)
+
+    def test_select_all_sections_within_budget(self):
+        self.assertEqual(select_sections(10, max_calls=16, fanin=8), list(range(10)))
+
+    def test_select_spreads_sections_over_document(self):
+        for count in (20, 50, 1000):
+            for max_calls in (2, 5, 16, 40):
+                indexes = select_sections(count, max_calls=max_calls, fanin=8)
+                self.assertLessEqual(len(indexes) + reduce_calls(len(indexes), 8), max(max_calls, 1))
+                self.assertEqual(indexes, sorted(set(indexes)))
+                self.assertEqual(indexes[0], 0)
+                if len(indexes) > 1:
+                    self.assertEqual(indexes[-1], count - 1)
+
+    def test_select_with_budget_of_one(self):
+        self.assertEqual(select_sections(10, max_calls=1, fanin=8), [0])
+
+
+class SummarizeTest(unittest.TestCase):
+    def test_single_section_is_one_call(self):
+        complete = FakeCompleter()
+        result = summarize("A short document.", complete, section_tokens=SECTION_TOKENS)
+        self.assertEqual(result["calls"], 1)
+        self.assertEqual(complete.calls, 1)
+        self.assertEqual(result["levels"], [[{"summary": result["summary"], "start": 0, "end": 1}]])
+
+    def test_map_reduce_levels(self):
+        complete = FakeCompleter()
+        text = make_text(20)
+        result = summarize(text, complete, section_tokens=SECTION_TOKENS, fanin=4, max_calls=100)
+
+        self.assertEqual(result["sections"], 20)
+        # 20 sections, then 5 and 2 combined summaries, then the root
+        self.assertEqual([len(level) for level in result["levels"]], [20, 5, 2, 1])
+        self.assertEqual([len(batch) for batch in complete.batches], [20, 5, 2, 1])
+        self.assertEqual(result["calls"], complete.calls)
+        self.assertEqual(result["levels"][-1][0], {"summary": result["summary"], "start": 0, "end": 20})
+        self.assertIn("overview of the whole file", complete.batches[-1][0])
+
+        offsets = result["offsets"]
+        self.assertEqual(len(offsets), 21)
+        self.assertEqual(offsets[-1], len(text))
+        self.assertEqual("".join(text[offsets[i]:offsets[i + 1]] for i in range(20)), text)
+
+    def test_call_budget_is_respected(self):
+        complete = FakeCompleter()
+        result = summarize(make_text(50), complete, section_tokens=SECTION_TOKENS, fanin=8, max_calls=10)
+
+        self.assertLessEqual(complete.calls, 10)
+        self.assertEqual(result["calls"], complete.calls)
+        sections = result["levels"][0]
+        self.assertEqual(sections[0]["start"], 0)
+        self.assertEqual(sections[-1]["end"], 50)
+        self.assertEqual(result["levels"][-1][0]["end"], 50)
+
+    def test_failed_sections_are_skipped(self):
+        complete = FakeCompleter(fail=["part 2 of"])
+        with self.assertLogs("summarizer", "WARNING"):
+            result = summarize(make_text(4), complete, section_tokens=SECTION_TOKENS, fanin=8, max_calls=16)
+        self.assertEqual([node["start"] for node in result["levels"][0]], [0, 2, 3])
+
+    def test_every_section_failing_raises(self):
+        with self.assertRaises(RuntimeError):
+            summarize(make_text(4), FakeCompleter(fail=["part "]), section_tokens=SECTION_TOKENS)
+
+
+if __name__ == "__main__":
+    unittest.main()
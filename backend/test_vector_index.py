@@ -0,0 +1,116 @@
+"""
+Tests for the in-memory vector index
+
+Run from the backend directory: python -m unittest test_vector_index
+"""
+import unittest
+
+import numpy as np
+
+from vector_index import VectorIndex, normalize_rows
+
+
+class VectorIndexTest(unittest.TestCase):
+    def setUp(self):
+        # 20 tight clusters, one document per cluster
+        self.centers = normalize_rows(np.random.default_rng(0).normal(size=(20, 16)))
+
+    def add_clustered(self, index, per_document=30):
+        rng = np.random.default_rng(1)
+        for number, center in enumerate(self.centers):
+            vectors = center + 0.05 * rng.normal(size=(per_document, 16))
+            chunks = [f"doc{number} chunk {i}" for i in range(per_document)]
+            index.add_document(f"doc{number}", chunks, vectors, {"number": number})
+
+    def test_exact_search_finds_nearest_document(self):
+        index = VectorIndex(mode="exact")
+        self.add_clustered(index)
+
+        results = index.search(self.centers[3], limit=5)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result["document_id"] == "doc3" for result in results))
+        self.assertEqual(results[0]["metadata"], {"number": 3})
+        similarities = [result["similarity"] for result in results]
+        self.assertEqual(similarities, sorted(similarities, reverse=True))
+
+    def test_search_filters(self):
+        index = VectorIndex(mode="exact")
+        self.add_clustered(index)
+        index.add_document("file:upload", ["uploaded chunk"], [self.centers[3]])
+
+        restricted = index.search(self.centers[3], limit=5, document_ids=["doc7"])
+        self.assertTrue(restricted)
+        self.assertTrue(all(result["document_id"] == "doc7" for result in restricted))
+
+        self.assertEqual(index.search(self.centers[3], limit=1)[0]["document_id"], "file:upload")
+        excluded = index.search(self.centers[3], limit=50, exclude_prefix="file:")
+        self.assertFalse(any(result["document_id"].startswith("file:") for result in excluded))
+
+    def test_remove_document_compacts(self):
+        index = VectorIndex(mode="exact")
+        self.add_clustered(index)
+
+        for number in range(8):
+            self.assertTrue(index.remove_document(f"doc{number}"))
+        self.assertFalse(index.remove_document("doc0"))
+        self.assertEqual(len(index), 12 * 30)
+        # Once more than a quarter of the rows were dead the matrix was compacted
+        self.assertLess(index.stats()["dead_rows"], 8 * 30)
+
+        results = index.search(self.centers[2], limit=100)
+        self.assertFalse(any(result["document_id"] in {f"doc{n}" for n in range(8)} for result in results))
+        self.assertEqual(index.search(self.centers[12], limit=1)[0]["document_id"], "doc12")
+
+    def test_replace_document(self):
+        index = VectorIndex(mode="exact")
+        self.add_clustered(index, per_document=3)
+        index.add_document("doc3", ["replacement"], [self.centers[5]])
+
+        results = index.search(self.centers[5], limit=10, document_ids=["doc3"])
+        self.assertEqual([result["chunk_text"] for result in results], ["replacement"])
+
+    def test_ivf_matches_exact_when_probing_every_cluster(self):
+        exact = VectorIndex(mode="exact")
+        ivf = VectorIndex(mode="ivf", ivf_min_vectors=100, nprobe=1000)
+        self.add_clustered(exact)
+        self.add_clustered(ivf)
+
+        for center in self.centers[:5]:
+            expected = [(r["document_id"], r["chunk_index"]) for r in exact.search(center, limit=10)]
+            actual = [(r["document_id"], r["chunk_index"]) for r in ivf.search(center, limit=10)]
+            self.assertEqual(actual, expected)
+        self.assertEqual(ivf.stats()["mode"], "ivf")
+        self.assertGreater(ivf.stats()["ivf_clusters"], 1)
+
+    def test_ivf_search_and_removal(self):
+        index = VectorIndex(mode="ivf", ivf_min_vectors=100, nprobe=2)
+        self.add_clustered(index)
+
+        self.assertEqual(index.search(self.centers[4], limit=1)[0]["document_id"], "doc4")
+        index.remove_document("doc4")
+        results = index.search(self.centers[4], limit=10)
+        self.assertFalse(any(result["document_id"] == "doc4" for result in results))
+
+        # Documents added after training are assigned to the existing clusters
+        index.add_document("late", ["late chunk"], [self.centers[9]])
+        results = index.search(self.centers[9], limit=40)
+        self.assertIn("late", {result["document_id"] for result in results})
+
+    def test_attached_segment_is_searched_with_matrix(self):
+        index = VectorIndex(mode="exact")
+        vectors = normalize_rows(self.centers[:2])
+        index.attach_segment(vectors, [
+            {"document_id": "stored", "chunk_index": 0, "chunk_text": "stored", "metadata": None},
+            None
+        ])
+        index.add_document("fresh", ["fresh"], [self.centers[1]])
+
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.search(self.centers[0], limit=1)[0]["document_id"], "stored")
+        self.assertEqual(index.search(self.centers[1], limit=1)[0]["document_id"], "fresh")
+        with self.assertRaises(RuntimeError):
+            index.attach_segment(vectors, [None, None])
+
+
+if __name__ == "__main__":
+    unittest.main()
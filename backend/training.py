@@ -5,7 +5,7 @@ import os
 import json
 import logging
 import datetime
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, List, Any, Optional
 import pandas as pd
 import numpy as np
 from bson.objectid import ObjectId
@@ -16,7 +16,7 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 # Import local modules
-from db import initialize_db, get_database
+from db import get_database
 
 # Define supported model types
 MODEL_TYPES = {
@@ -36,20 +36,34 @@ for directory in [DATA_DIR, MODEL_DIR]:
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-def process_training_data(data_id: str) -> bool:
+# Rows parsed per chunk when processing CSV training data
+CSV_CHUNK_ROWS = int(os.getenv("TRAINING_CSV_CHUNK_ROWS", "50000"))
+
+def _processing_failed(db, data_id: str, message: str) -> bool:
+    """Log a processing failure and record it on the training data"""
+    logger.error(message)
+    db.training_data.update_one({"_id": ObjectId(data_id)}, {"$set": {"error": message}})
+    return False
+
+def process_training_data(data_id: str, progress: Callable[[float], None] = None) -> bool:
     """
     Process uploaded training data based on its format and prepare it for training
     
     Args:
         data_id: ID of the TrainingData document
+        progress: Optional callback receiving the fraction of the file processed (0.0-1.0)
         
     Returns:
-        bool: True if processing was successful, False otherwise
+        bool: True if processing was successful, False if the data is invalid
+        
+    Raises:
+        RuntimeError: If the database is unavailable
+        Exception: Database and file system errors are raised so the caller can retry
     """
+    report = progress or (lambda fraction: None)
     db = get_database()
-    if not db:
-        logger.error("Database connection failed")
-        return False
+    if db is None:
+        raise RuntimeError("Database connection failed")
         
     try:
         # Get training data document
@@ -61,23 +75,28 @@ def process_training_data(data_id: str) -> bool:
         file_path = data_doc["file_path"]
         file_type = data_doc["file_type"]
         data_format = data_doc["data_format"]
+        file_size = max(os.path.getsize(file_path), 1)
         
         logger.info(f"Processing training data {data_id} of type {file_type} in format {data_format}")
         
         # Process based on file type
         if file_type in ['.csv', 'text/csv']:
-            df = pd.read_csv(file_path)
-            row_count = len(df)
-            
-            # Basic validation based on data format
-            if data_format == "classification":
-                if "text" not in df.columns or "label" not in df.columns:
-                    logger.error("Classification data must have 'text' and 'label' columns")
-                    return False
-            
-            # Save processed data
+            # Parse and rewrite the file in chunks so memory stays bounded for large uploads
             processed_path = os.path.join(DATA_DIR, f"processed_{data_id}.csv")
-            df.to_csv(processed_path, index=False)
+            row_count = 0
+            columns = []
+            with open(file_path, 'rb') as source, open(processed_path, 'w', newline='', encoding='utf-8') as target:
+                for chunk in pd.read_csv(source, chunksize=CSV_CHUNK_ROWS, encoding_errors='replace'):
+                    if not columns:
+                        columns = chunk.columns.tolist()
+                        # Basic validation based on data format
+                        if data_format == "classification" and ("text" not in columns or "label" not in columns):
+                            target.close()
+                            os.remove(processed_path)
+                            return _processing_failed(db, data_id, "Classification data must have 'text' and 'label' columns")
+                    chunk.to_csv(target, index=False, header=row_count == 0)
+                    row_count += len(chunk)
+                    report(min(source.tell() / file_size, 0.99))
             
             # Update database record
             db.training_data.update_one(
@@ -86,7 +105,7 @@ def process_training_data(data_id: str) -> bool:
                     "processed": True,
                     "processed_path": processed_path,
                     "row_count": str(row_count),
-                    "metadata": json.dumps({"columns": df.columns.tolist()})
+                    "metadata": json.dumps({"columns": columns})
                 }}
             )
             logger.info(f"Successfully processed training data {data_id} with {row_count} rows")
@@ -96,6 +115,7 @@ def process_training_data(data_id: str) -> bool:
             # Load JSON data
             with open(file_path, 'r') as f:
                 data = json.load(f)
+            report(0.5)
             
             # Process based on format
             if isinstance(data, list):
@@ -119,19 +139,19 @@ def process_training_data(data_id: str) -> bool:
                 logger.info(f"Successfully processed JSON training data {data_id} with {row_count} items")
                 return True
             else:
-                logger.error("JSON data must be a list of records")
-                return False
+                return _processing_failed(db, data_id, "JSON data must be a list of records")
                 
         elif file_type in ['.txt', 'text/plain']:
-            with open(file_path, 'r') as f:
-                lines = f.readlines()
-            
-            row_count = len(lines)
-            
-            # Process based on format
+            # Copy line by line instead of reading the whole file into memory
             processed_path = os.path.join(DATA_DIR, f"processed_{data_id}.txt")
-            with open(processed_path, 'w') as f:
-                f.writelines(lines)
+            row_count = 0
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as source, \
+                    open(processed_path, 'w', encoding='utf-8') as target:
+                for line in source:
+                    target.write(line)
+                    row_count += 1
+                    if row_count % 100000 == 0:
+                        report(min(source.buffer.tell() / file_size, 0.99))
             
             # Update database record
             db.training_data.update_one(
@@ -147,12 +167,11 @@ def process_training_data(data_id: str) -> bool:
             return True
             
         else:
-            logger.error(f"Unsupported file type: {file_type}")
-            return False
+            return _processing_failed(db, data_id, f"Unsupported file type: {file_type}")
             
-    except Exception as e:
-        logger.error(f"Error processing training data: {str(e)}")
-        return False
+    except ValueError as e:
+        # Malformed content (CSV parser, JSON decoding and text decoding errors); retrying won't help
+        return _processing_failed(db, data_id, f"Error processing training data: {str(e)}")
 
 def create_training_job(config_id: str, data_ids: List[str], user_id: str, name: str) -> Optional[str]:
     """
@@ -168,7 +187,7 @@ def create_training_job(config_id: str, data_ids: List[str], user_id: str, name:
         str: ID of the created training job, or None if creation failed
     """
     db = get_database()
-    if not db:
+    if db is None:
         logger.error("Database connection failed")
         return None
         
@@ -222,7 +241,7 @@ def run_training_job(job_id: str) -> bool:
         bool: True if training was successful, False otherwise
     """
     db = get_database()
-    if not db:
+    if db is None:
         logger.error("Database connection failed")
         return False
         
@@ -361,7 +380,7 @@ def update_job_status(job_id: str, status: str, message: str = None) -> bool:
         bool: True if update was successful, False otherwise
     """
     db = get_database()
-    if not db:
+    if db is None:
         logger.error("Database connection failed")
         return False
         
@@ -404,7 +423,7 @@ def update_job_log(job_id: str, message: str) -> bool:
         bool: True if update was successful, False otherwise
     """
     db = get_database()
-    if not db:
+    if db is None:
         logger.error("Database connection failed")
         return False
         
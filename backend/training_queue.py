@@ -0,0 +1,267 @@
+"""
+Persistent background queue for training data processing.
+
+Uploads are enqueued as documents in ``training_data_queue`` and processed
+by a pool of worker threads, so the upload request returns immediately.
+Workers claim items atomically (find_one_and_update), so any number of
+server processes can share the queue.
+
+A claimed item carries a lease that a heartbeat thread renews while the item
+is processed. If a worker dies mid-item, the lease runs out and another worker
+claims the item again, up to TRAINING_QUEUE_MAX_ATTEMPTS times.
+
+Status and progress are mirrored onto the ``training_data`` document
+(``status``: queued, processing, ready or failed; ``progress``: 0-1) so they
+can be listed without reading the queue.
+"""
+import os
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+TRAINING_QUEUE_WORKERS = int(os.getenv("TRAINING_QUEUE_WORKERS", "2"))
+TRAINING_QUEUE_POLL_SECONDS = float(os.getenv("TRAINING_QUEUE_POLL_SECONDS", "5"))
+TRAINING_QUEUE_LEASE_SECONDS = int(os.getenv("TRAINING_QUEUE_LEASE_SECONDS", "300"))
+TRAINING_QUEUE_MAX_ATTEMPTS = int(os.getenv("TRAINING_QUEUE_MAX_ATTEMPTS", "3"))
+
+# Progress is written at most this often per item
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+
+class TrainingDataQueue:
+    """
+    Mongo-backed work queue with a pool of processing threads
+    """
+
+    def __init__(self, get_db: Callable[[], Any], process: Callable[..., bool],
+                 workers: int = TRAINING_QUEUE_WORKERS, poll_seconds: float = TRAINING_QUEUE_POLL_SECONDS,
+                 lease_seconds: int = TRAINING_QUEUE_LEASE_SECONDS, max_attempts: int = TRAINING_QUEUE_MAX_ATTEMPTS):
+        """
+        Args:
+            get_db: Function returning the MongoDB database (or None while unavailable)
+            process: Function (data_id, progress) -> bool processing one item;
+                progress is called with the fraction done
+            workers: Number of worker threads
+            poll_seconds: How often idle workers look for items enqueued by other processes
+            lease_seconds: Time after which an item whose worker stopped reporting is claimed again
+            max_attempts: Claims per item before it is marked failed
+        """
+        self.get_db = get_db
+        self.process = process
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._stats = {"enqueued": 0, "processed": 0, "failed": 0, "retried": 0, "active": 0}
+
+    def start(self) -> None:
+        """Start the worker threads"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"training-queue-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} training data workers")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        Stop the workers
+
+        Items being processed are left claimed and are picked up again after their lease expires.
+
+        Args:
+            timeout: Seconds to wait for each worker
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def enqueue(self, db, data_id: str) -> None:
+        """
+        Queue a training data document for processing
+
+        Args:
+            db: pymongo.database.Database
+            data_id: ID of the training_data document
+        """
+        now = datetime.utcnow()
+        db.training_data_queue.insert_one({
+            "data_id": data_id,
+            "status": "queued",
+            "attempts": 0,
+            "enqueued_at": now,
+            "lease_expires_at": None
+        })
+        db.training_data.update_one(
+            {"_id": ObjectId(data_id)},
+            {"$set": {"status": "queued", "progress": 0.0}}
+        )
+        self._stats["enqueued"] += 1
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get worker counters and queue depth
+
+        Returns:
+            Dict of queue statistics
+        """
+        stats = {**self._stats, "workers": self.workers}
+        db = self.get_db()
+        if db is not None:
+            stats["queued"] = db.training_data_queue.count_documents({"status": "queued"})
+            stats["processing"] = db.training_data_queue.count_documents({"status": "processing"})
+        return stats
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                db = self.get_db()
+                item = self._claim(db) if db is not None else None
+            except Exception as e:
+                logger.error(f"Error claiming training data: {str(e)}")
+                item = None
+
+            if item is None:
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+                continue
+
+            try:
+                self._handle(db, item)
+            except Exception as e:
+                # Whatever was left undone, the lease runs out and the item is claimed again
+                logger.error(f"Error handling training data {item['data_id']}: {str(e)}")
+
+    def _claim(self, db) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest queued item, or one whose worker's lease expired"""
+        now = datetime.utcnow()
+        self._fail_exhausted(db, now)
+        return db.training_data_queue.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "queued"},
+                    {"status": "processing", "lease_expires_at": {"$lt": now}}
+                ],
+                "attempts": {"$lt": self.max_attempts}
+            },
+            {
+                "$set": {
+                    "status": "processing",
+                    "claimed_by": self._owner,
+                    "claimed_at": now,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds)
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("enqueued_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _held(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Filter matching a queue item only while this worker's claim on it is current"""
+        return {"_id": item["_id"], "status": "processing", "claimed_by": self._owner, "attempts": item["attempts"]}
+
+    def _fail_exhausted(self, db, now: datetime) -> None:
+        """Give up on items whose worker died on every attempt"""
+        stuck = {"status": "processing", "lease_expires_at": {"$lt": now}, "attempts": {"$gte": self.max_attempts}}
+        for item in db.training_data_queue.find(stuck, {"data_id": 1}):
+            message = f"Processing was interrupted {self.max_attempts} times"
+            self._finish(db, item, "failed", message, claim={**stuck, "_id": item["_id"]})
+
+    def _heartbeat(self, db, item: Dict[str, Any], done: threading.Event) -> None:
+        """Renew the lease while the item is processed, so slow steps don't lose it"""
+        while not done.wait(self.lease_seconds / 3):
+            try:
+                result = db.training_data_queue.update_one(
+                    self._held(item),
+                    {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}}
+                )
+                if result.matched_count == 0:
+                    logger.warning(f"Lost the claim on training data {item['data_id']}")
+                    return
+            except Exception as e:
+                logger.error(f"Error renewing lease of training data {item['data_id']}: {str(e)}")
+
+    def _handle(self, db, item: Dict[str, Any]) -> None:
+        data_id = item["data_id"]
+        db.training_data.update_one(
+            {"_id": ObjectId(data_id)},
+            {"$set": {"status": "processing", "processing_started_at": datetime.utcnow()}}
+        )
+        logger.info(f"Processing training data {data_id} (attempt {item['attempts']})")
+
+        last_report = [0.0]
+
+        def progress(fraction):
+            # Throttled, and best effort: a failed report must not fail the item
+            now = time.monotonic()
+            if now - last_report[0] < PROGRESS_INTERVAL_SECONDS:
+                return
+            last_report[0] = now
+            try:
+                db.training_data.update_one({"_id": ObjectId(data_id)}, {"$set": {"progress": round(fraction, 3)}})
+            except Exception as e:
+                logger.warning(f"Could not report progress of training data {data_id}: {str(e)}")
+
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(db, item, done), daemon=True)
+        heartbeat.start()
+        self._stats["active"] += 1
+        try:
+            succeeded = self.process(data_id, progress)
+        except Exception as e:
+            logger.error(f"Training data worker error for {data_id}: {str(e)}")
+            if item["attempts"] < self.max_attempts:
+                result = db.training_data_queue.update_one(
+                    self._held(item),
+                    {"$set": {"status": "queued", "lease_expires_at": None, "error": str(e)}}
+                )
+                if result.matched_count:
+                    self._stats["retried"] += 1
+                    db.training_data.update_one({"_id": ObjectId(data_id)}, {"$set": {"status": "queued"}})
+            else:
+                self._finish(db, item, "failed", str(e))
+            return
+        finally:
+            done.set()
+            self._stats["active"] -= 1
+
+        self._finish(db, item, "ready" if succeeded else "failed")
+
+    def _finish(self, db, item: Dict[str, Any], status: str, error: str = None,
+                claim: Dict[str, Any] = None) -> None:
+        """
+        Record the outcome of an item on the queue and on the training data
+
+        Nothing is recorded if the claim was lost meanwhile (the lease expired and
+        another worker took the item over); that worker records the outcome.
+        """
+        now = datetime.utcnow()
+        result = db.training_data_queue.update_one(
+            claim or self._held(item),
+            {"$set": {"status": "done" if status == "ready" else "failed", "finished_at": now, "error": error}}
+        )
+        if result.matched_count == 0:
+            logger.warning(f"Not recording outcome of training data {item['data_id']}: claim was taken over")
+            return
+        fields = {"status": status, "processing_finished_at": now}
+        if status == "ready":
+            fields["progress"] = 1.0
+        if error:
+            fields["error"] = error
+        db.training_data.update_one({"_id": ObjectId(item["data_id"])}, {"$set": fields})
+        self._stats["processed" if status == "ready" else "failed"] += 1
+        logger.info(f"Training data {item['data_id']} {status}")
@@ -0,0 +1,196 @@
+"""
+Content-addressed cache for synthesized speech.
+
+Each MP3 is stored under the SHA-256 of (language, text), so the same reply
+spoken again is served straight from disk without calling the TTS service,
+and concurrent requests can never overwrite each other's files. The cache is
+bounded by total size, evicting the least recently used files first.
+
+The directory is shared by every worker process, but each process keeps its
+own index and enforces TTS_CACHE_MAX_MB against the files it knows about, so
+with several workers the directory can grow past the bound until a process
+rescans it on startup. Files evicted by another process are noticed on lookup.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+TTS_CACHE_DIR = os.getenv(
+    "TTS_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tts_cache')
+)
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+
+def tts_key(text: str, lang: str) -> str:
+    """
+    Get the cache key of an utterance
+
+    Args:
+        text: Text to speak
+        lang: Language code
+
+    Returns:
+        str: Hex SHA-256 digest
+    """
+    return hashlib.sha256(f"{lang}\0{text}".encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    """
+    Size-bounded LRU cache of MP3 files, keyed by content hash
+    """
+
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_bytes: int = TTS_CACHE_MAX_BYTES):
+        """
+        Args:
+            directory: Directory holding the cached MP3s
+            max_bytes: Total size above which least recently used files are deleted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = OrderedDict()  # key -> size, least recently used first
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "errors": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    def path(self, key: str) -> str:
+        """Path of a cached file (sharded by the first two hex digits)"""
+        return os.path.join(self.directory, key[:2], key + ".mp3")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached file by key
+
+        Args:
+            key: Cache key from tts_key()
+
+        Returns:
+            Path to the MP3, or None if it isn't cached
+        """
+        path = self.path(key)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            # Not cached, or evicted by another process since we indexed it
+            with self._lock:
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._bytes -= size
+            return None
+        with self._lock:
+            # Also picks up files written by other processes since we scanned
+            self._add(key, size)
+        return path
+
+    def get_or_create(self, text: str, lang: str, synthesize: Callable[[str, str, str], None]) -> Optional[str]:
+        """
+        Get the MP3 for an utterance, synthesizing it on a miss
+
+        Concurrent misses for the same utterance synthesize it only once.
+
+        Args:
+            text: Text to speak
+            lang: Language code
+            synthesize: Function (text, lang, path) writing an MP3 to path
+
+        Returns:
+            Path to the MP3, or None if synthesis failed
+        """
+        key = tts_key(text, lang)
+        path = self.get(key)
+        if path is not None:
+            self._stats["hits"] += 1
+            return path
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                path = self.get(key)
+                if path is not None:
+                    self._stats["hits"] += 1
+                    return path
+
+                self._stats["misses"] += 1
+                path = self.path(key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                try:
+                    synthesize(text, lang, tmp_path)
+                    os.replace(tmp_path, path)
+                except Exception as e:
+                    self._stats["errors"] += 1
+                    logger.error(f"Error in speech synthesis: {str(e)}")
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    return None
+
+                with self._lock:
+                    self._add(key, os.path.getsize(path))
+                    self._evict()
+                return path
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get hit counters and cache size
+
+        Returns:
+            Dict of cache statistics
+        """
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes
+            }
+
+    def _scan(self) -> None:
+        """Index files already on disk, oldest access first"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".mp3"):
+                    stat = os.stat(os.path.join(root, name))
+                    files.append((stat.st_atime, name[:-4], stat.st_size))
+                elif name.endswith(".tmp") and time.time() - os.path.getmtime(os.path.join(root, name)) > 3600:
+                    # Left behind by an interrupted synthesis
+                    os.remove(os.path.join(root, name))
+        for _, key, size in sorted(files):
+            self._add(key, size)
+        self._evict()
+        logger.info(f"TTS cache: {len(self._entries)} files, {self._bytes / (1024 * 1024):.1f} MB")
+
+    def _add(self, key: str, size: int) -> None:
+        """Record a file as most recently used (caller holds the lock)"""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        self._entries[key] = size
+        self._bytes += size
+
+    def _evict(self) -> None:
+        """Delete least recently used files until the cache fits (caller holds the lock)"""
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._stats["evictions"] += 1
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
@@ -0,0 +1,166 @@
+"""
+Sentence-chunked streaming speech synthesis.
+
+Long text is split into sentences that are synthesized in parallel on a
+worker pool (each through the TTS cache, so repeated sentences are reused)
+and streamed to the client in order as one continuous MP3. Playback can
+start as soon as the first sentence is ready instead of after the whole text.
+"""
+import os
+import re
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TTS_STREAM_WORKERS = int(os.getenv("TTS_STREAM_WORKERS", "8"))
+# Sentences synthesized ahead of the one being sent
+TTS_STREAM_LOOKAHEAD = int(os.getenv("TTS_STREAM_LOOKAHEAD", "4"))
+TTS_STREAM_MAX_CHARS = int(os.getenv("TTS_STREAM_MAX_CHARS", "20000"))
+
+# Sentences shorter than this are merged with the next one to avoid tiny requests
+MIN_SENTENCE_CHARS = 40
+MAX_SENTENCE_CHARS = 300
+READ_CHUNK_BYTES = 16 * 1024
+
+# Latin and Devanagari sentence terminators (the other Indic scripts use the danda too)
+_SENTENCE_END = re.compile(r"(?<=[.!?।॥])\s+|\n+")
+_CLAUSE_END = re.compile(r"(?<=[,;:])\s+")
+
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    """Split a sentence longer than max_chars at clause boundaries, then at spaces"""
+    parts = []
+    current = ""
+    for piece in _CLAUSE_END.split(sentence):
+        words = piece.split(" ") if len(piece) > max_chars else [piece]
+        for word in words:
+            candidate = f"{current} {word}".strip()
+            if current and len(candidate) > max_chars:
+                parts.append(current)
+                current = word
+            else:
+                current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_sentences(text: str, min_chars: int = MIN_SENTENCE_CHARS, max_chars: int = MAX_SENTENCE_CHARS) -> List[str]:
+    """
+    Split text into sentence-sized pieces for synthesis
+
+    Args:
+        text: Text to speak
+        min_chars: Merge pieces shorter than this with the following one
+        max_chars: Split pieces longer than this
+
+    Returns:
+        List of non-empty text pieces in order
+    """
+    pieces = []
+    pending = ""
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        pending = f"{pending} {sentence}".strip()
+        if len(pending) >= min_chars:
+            pieces.extend(_split_long(pending, max_chars) if len(pending) > max_chars else [pending])
+            pending = ""
+    if pending:
+        pieces.append(pending)
+    return pieces
+
+
+class SpeechStreamer:
+    """
+    Synthesizes sentences in parallel and yields their audio in order
+    """
+
+    def __init__(self, synthesize: Callable[[str, str], Optional[str]], max_workers: int = TTS_STREAM_WORKERS,
+                 lookahead: int = TTS_STREAM_LOOKAHEAD):
+        """
+        Args:
+            synthesize: Function (text, lang) -> path of an MP3 file, or None on failure
+            max_workers: Size of the shared synthesis pool
+            lookahead: Maximum sentences in flight per stream
+        """
+        self.synthesize = synthesize
+        self.lookahead = max(1, lookahead)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-stream")
+        self._stats = {"streams": 0, "sentences": 0, "failed": 0, "cancelled": 0}
+
+    def stream(self, text: str, lang: str) -> Iterator[bytes]:
+        """
+        Stream MP3 audio for text, sentence by sentence
+
+        Args:
+            text: Text to speak
+            lang: Language code
+
+        Yields:
+            bytes: MP3 data
+        """
+        sentences = split_sentences(text)
+        logger.info(f"Streaming speech for {len(sentences)} sentences in {lang}")
+        self._stats["streams"] += 1
+        self._stats["sentences"] += len(sentences)
+
+        pending = deque()
+        next_index = 0
+        try:
+            while next_index < len(sentences) or pending:
+                # Keep a bounded window of sentences synthesizing ahead of playback
+                while next_index < len(sentences) and len(pending) < self.lookahead:
+                    pending.append(self._executor.submit(self.synthesize, sentences[next_index], lang))
+                    next_index += 1
+
+                sentence = sentences[next_index - len(pending)]
+                f = self._open(pending.popleft().result(), sentence, lang)
+                if f is None:
+                    self._stats["failed"] += 1
+                    logger.warning("Skipping a sentence that could not be synthesized")
+                    continue
+                with f:
+                    while True:
+                        chunk = f.read(READ_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        yield chunk
+        finally:
+            # Client went away: don't synthesize sentences nobody will hear
+            for future in pending:
+                if future.cancel():
+                    self._stats["cancelled"] += 1
+
+    def _open(self, path: Optional[str], sentence: str, lang: str) -> Optional[BinaryIO]:
+        """
+        Open a synthesized sentence's MP3, synthesizing it again if the cache evicted it meanwhile
+
+        An open file stays readable after eviction unlinks it.
+        """
+        if path is None:
+            return None
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            logger.info("Synthesized audio was evicted before streaming; synthesizing it again")
+        path = self.synthesize(sentence, lang)
+        if path is None:
+            return None
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get stream and sentence counters
+
+        Returns:
+            Dict of streamer statistics
+        """
+        return dict(self._stats)
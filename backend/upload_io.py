@@ -0,0 +1,272 @@
+"""
+Streaming ingestion of file uploads.
+
+Multipart file fields of UPLOAD_LIMITS endpoints are written straight to disk
+as Werkzeug parses the request body, chunk by chunk. While the bytes are
+written, the upload is counted against the endpoint's byte limit (so
+oversized uploads fail as soon as they cross it, whether or not the client
+sent a Content-Length), hashed with SHA-256, and its first bytes are kept to
+sniff the real file type. Memory use per upload is one parser chunk.
+
+Ingested files are deleted when the request ends unless the endpoint keeps
+them with IngestedFile.persist().
+"""
+import io
+import os
+import hashlib
+import logging
+import tempfile
+from typing import BinaryIO, Optional
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from audio_io import InMemoryUploadRequest
+
+logger = logging.getLogger(__name__)
+
+FILE_UPLOAD_MAX_BYTES = int(os.getenv("FILE_UPLOAD_MAX_MB", "10")) * 1024 * 1024
+TRAINING_UPLOAD_MAX_BYTES = int(os.getenv("TRAINING_UPLOAD_MAX_MB", "50")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+# Endpoint -> (byte limit, directory uploads are written to)
+UPLOAD_LIMITS = {
+    "/api/summarize-pdf": (FILE_UPLOAD_MAX_BYTES, "temp"),
+    "/api/training/upload": (TRAINING_UPLOAD_MAX_BYTES, "training_data"),
+}
+
+# Bytes kept from the start of each upload for type sniffing
+SNIFF_BYTES = 512
+
+MAGIC_NUMBERS = [
+    (b"%PDF-", "pdf"),
+    (b"PK\x03\x04", "zip"),  # docx, xlsx, pptx
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "ole"),  # doc, xls, ppt
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"\x1f\x8b", "gzip"),
+    (b"MZ", "executable"),
+    (b"\x7fELF", "executable"),
+]
+
+# Legacy 8-bit text (latin-1, cp1252) has no NUL bytes and hardly any ASCII control characters
+MAX_CONTROL_RATIO = 0.01
+_TEXT_CONTROLS = b"\t\n\r\f\x1a"
+
+ZIP_EXTENSIONS = {".docx", ".xlsx", ".pptx"}
+OLE_EXTENSIONS = {".doc", ".xls", ".ppt"}
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    """Raised when an upload exceeds its endpoint's byte limit"""
+
+
+def sniff_type(head: bytes) -> str:
+    """
+    Identify a file from its first bytes
+
+    Args:
+        head: Start of the file
+
+    Returns:
+        str: "pdf", "zip", "ole", "png", "jpeg", "gif", "gzip", "executable",
+            "text" (UTF-8 or 8-bit text such as cp1252), "empty" or "binary"
+    """
+    if not head:
+        return "empty"
+    for magic, kind in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return kind
+    if b"\x00" in head:
+        return "binary"
+    try:
+        # The sniffed bytes may end in the middle of a multi-byte character
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start < len(head) - 3:
+            controls = sum(1 for byte in head if (byte < 0x20 and byte not in _TEXT_CONTROLS) or byte == 0x7f)
+            if controls > len(head) * MAX_CONTROL_RATIO:
+                return "binary"
+    return "text"
+
+
+class IngestedFile(io.RawIOBase):
+    """
+    Upload written to disk as it arrives, with its size, hash and sniffed type
+    """
+
+    def __init__(self, directory: str, max_bytes: int, filename: Optional[str] = None):
+        """
+        Args:
+            directory: Directory to write the upload to
+            max_bytes: Maximum accepted size
+            filename: Client file name (only its extension is used)
+        """
+        super().__init__()
+        os.makedirs(directory, exist_ok=True)
+        suffix = os.path.splitext(filename or "")[1].lower()
+        fd, self.path = tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=directory)
+        self._file = os.fdopen(fd, "w+b")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._head = b""
+        self._persisted = False
+
+    @property
+    def sha256(self) -> str:
+        """Hex SHA-256 of the bytes written so far"""
+        return self._sha256.hexdigest()
+
+    @property
+    def kind(self) -> str:
+        """File type sniffed from the first bytes (see sniff_type)"""
+        return sniff_type(self._head)
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.size + len(data) > self.max_bytes:
+            self.discard()
+            raise UploadTooLarge(f"Upload exceeds {self.max_bytes // (1024 * 1024)}MB limit")
+        self.size += len(data)
+        self._sha256.update(data)
+        if len(self._head) < SNIFF_BYTES:
+            self._head += bytes(data[:SNIFF_BYTES - len(self._head)])
+        return self._file.write(data)
+
+    def readinto(self, buffer) -> int:
+        return self._file.readinto(buffer)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def flush(self) -> None:
+        if not self._file.closed:
+            self._file.flush()
+
+    def persist(self, path: Optional[str] = None) -> str:
+        """
+        Keep the file after the request ends
+
+        Args:
+            path: Move the file here (default: keep its current path)
+
+        Returns:
+            str: Final path of the file
+        """
+        self._file.flush()
+        if path and path != self.path:
+            os.replace(self.path, path)
+            self.path = path
+        self._persisted = True
+        return self.path
+
+    def discard(self) -> None:
+        """Close and delete the file"""
+        self._persisted = False
+        self.close()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        if not self._persisted and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                logger.warning(f"Could not remove upload {self.path}: {str(e)}")
+        super().close()
+
+
+class UploadRequest(InMemoryUploadRequest):
+    """
+    Flask request that streams file uploads of UPLOAD_LIMITS endpoints to disk
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.path in UPLOAD_LIMITS:
+            max_bytes, directory = UPLOAD_LIMITS[self.path]
+            # The whole body is already known to be too large: fail before reading it
+            if total_content_length is not None and total_content_length > max_bytes + UPLOAD_CHUNK_BYTES:
+                raise UploadTooLarge(f"Upload exceeds {max_bytes // (1024 * 1024)}MB limit")
+            return IngestedFile(directory, max_bytes, filename)
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+def ingest(stream: BinaryIO, directory: str, max_bytes: int, filename: Optional[str] = None) -> IngestedFile:
+    """
+    Copy a stream to disk in chunks with the same size, hash and type accounting
+
+    Uploads already ingested while the request was parsed are returned as they are.
+
+    Args:
+        stream: Uploaded file stream or raw request body
+        directory: Directory to write the upload to
+        max_bytes: Maximum accepted size
+        filename: Client file name
+
+    Returns:
+        IngestedFile positioned at the start
+
+    Raises:
+        UploadTooLarge: If the upload is larger than max_bytes
+    """
+    if isinstance(stream, IngestedFile):
+        stream.seek(0)
+        return stream
+
+    upload = IngestedFile(directory, max_bytes, filename)
+    try:
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            upload.write(chunk)
+    except Exception:
+        upload.discard()
+        raise
+    upload.flush()
+    upload.seek(0)
+    return upload
+
+
+def detect_file_type(kind: str, filename: str, content_type: Optional[str]) -> Optional[str]:
+    """
+    Decide how to read an upload from its sniffed type and declared name
+
+    Args:
+        kind: Sniffed type from sniff_type()
+        filename: Client file name
+        content_type: Client MIME type
+
+    Returns:
+        File type for extract_text_from_file (extension or MIME type), or None
+        if the content is not a supported document or contradicts its extension
+    """
+    ext = os.path.splitext(filename or "")[1].lower()
+    if kind == "pdf":
+        return ".pdf"
+    if kind == "png":
+        return ".png"
+    if kind == "jpeg":
+        return ".jpg"
+    if kind == "zip":
+        return ext if ext in ZIP_EXTENSIONS else None
+    if kind == "ole":
+        return ext if ext in OLE_EXTENSIONS else None
+    if kind == "text":
+        if ext in {".pdf", ".png", ".jpg", ".jpeg"} | ZIP_EXTENSIONS | OLE_EXTENSIONS:
+            return None
+        return ext or content_type
+    return None
@@ -0,0 +1,401 @@
+"""
+In-memory vector index for document chunk embeddings.
+
+All chunk embeddings are kept in one contiguous, L2-normalized float32 matrix
+so a query is answered with a single matrix-vector product and argpartition.
+For large corpora an optional IVF (inverted file) mode clusters the vectors
+with k-means and only scores the clusters closest to the query.
+
+Read-only segments (e.g. memory-mapped files from the embedding store) can be
+attached in front of the in-memory matrix, so the vectors are scored in place
+without copying them into each process.
+"""
+import os
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# "exact" scans every vector, "ivf" probes the nearest clusters once the index is large enough
+VECTOR_INDEX_MODE = os.getenv("VECTOR_INDEX_MODE", "exact").lower()
+IVF_MIN_VECTORS = int(os.getenv("VECTOR_INDEX_IVF_MIN_VECTORS", "50000"))
+IVF_NPROBE = int(os.getenv("VECTOR_INDEX_IVF_NPROBE", "8"))
+
+# Compact the matrix once this fraction of rows belongs to removed documents
+COMPACT_DEAD_FRACTION = 0.25
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize each row of a matrix so dot products become cosine similarities
+
+    Args:
+        vectors: 2D array of vectors
+
+    Returns:
+        float32 array of unit-length rows (zero rows stay zero)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class VectorIndex:
+    """
+    Thread-safe cosine-similarity index over document chunks
+    """
+
+    def __init__(self, mode: str = VECTOR_INDEX_MODE, ivf_min_vectors: int = IVF_MIN_VECTORS,
+                 nprobe: int = IVF_NPROBE):
+        """
+        Args:
+            mode: "exact" or "ivf"
+            ivf_min_vectors: Minimum number of vectors before IVF is used
+            nprobe: Number of clusters scored per query in IVF mode
+        """
+        self.mode = mode
+        self.ivf_min_vectors = ivf_min_vectors
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._dim = None
+        self._segments = []  # read-only (first_row, vectors) blocks that precede the matrix
+        self._segment_rows = 0
+        self._matrix = None  # (capacity, dim) float32, rows [0, _size) are in use
+        self._size = 0
+        self._alive = np.zeros(0, dtype=bool)  # over segment rows followed by matrix capacity
+        self._chunks = []  # row -> {"document_id", "chunk_index", "chunk_text", "metadata"}
+        self._rows_by_document = {}  # document_id -> list of rows
+        self._dead_count = 0
+        self._matrix_dead_count = 0
+        self._centroids = None
+        self._assignments = None
+        self._ivf_trained_size = 0
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self._dim
+
+    def __len__(self) -> int:
+        return self._total_rows - self._dead_count
+
+    @property
+    def _total_rows(self) -> int:
+        return self._segment_rows + self._size
+
+    def attach_segment(self, vectors: np.ndarray, chunks: Sequence[Optional[Dict[str, Any]]]) -> None:
+        """
+        Attach read-only, already normalized vectors without copying them
+
+        Segments must be attached before any document is added with add_document.
+
+        Args:
+            vectors: (rows, dim) float32 array, typically an np.memmap
+            chunks: One chunk record per row, or None for rows that should be ignored
+        """
+        with self._lock:
+            if self._size:
+                raise RuntimeError("Segments must be attached before documents are added")
+            if len(chunks) != vectors.shape[0]:
+                raise ValueError("Segment vectors and chunks have different lengths")
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(f"Segment dimension {vectors.shape[1]} does not match index dimension {self._dim}")
+
+            first_row = self._segment_rows
+            self._segments.append((first_row, vectors))
+            self._segment_rows += vectors.shape[0]
+            self._matrix = None
+            self._alive = np.concatenate([
+                self._alive[:first_row],
+                np.array([chunk is not None for chunk in chunks], dtype=bool)
+            ])
+            self._chunks.extend(chunks)
+            for row, chunk in enumerate(chunks, start=first_row):
+                if chunk is None:
+                    self._dead_count += 1
+                else:
+                    self._rows_by_document.setdefault(chunk["document_id"], []).append(row)
+            self._centroids = None
+            self._assignments = None
+
+    def add_document(self, document_id: str, chunks: Sequence[str], embeddings: Sequence[Sequence[float]],
+                     metadata: Dict[str, Any] = None, start_index: int = 0) -> None:
+        """
+        Add or replace the chunks of a document
+
+        Args:
+            document_id: ID of the document
+            chunks: Chunk texts
+            embeddings: Embedding for each chunk
+            metadata: Metadata stored with every chunk
+            start_index: chunk_index of the first chunk (for documents added in batches)
+        """
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(len(chunks), -1))
+
+        with self._lock:
+            if start_index == 0:
+                self._remove_rows(document_id)
+            self._append(vectors, [
+                {
+                    "document_id": document_id,
+                    "chunk_index": start_index + i,
+                    "chunk_text": chunk,
+                    "metadata": metadata
+                }
+                for i, chunk in enumerate(chunks)
+            ])
+
+    def remove_document(self, document_id: str) -> bool:
+        """
+        Remove all chunks of a document
+
+        Args:
+            document_id: ID of the document
+
+        Returns:
+            bool: True if the document was in the index
+        """
+        with self._lock:
+            return self._remove_rows(document_id)
+
+    def search(self, query_embedding: Sequence[float], limit: int = 5,
+               document_ids: Sequence[str] = None, exclude_prefix: str = None) -> List[Dict[str, Any]]:
+        """
+        Find the chunks most similar to a query embedding
+
+        Args:
+            query_embedding: Query vector
+            limit: Maximum number of results to return
+            document_ids: Optionally restrict the search to these documents
+            exclude_prefix: Skip documents whose ID starts with this prefix
+
+        Returns:
+            List of matching chunks with similarity scores, best first
+        """
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+
+        with self._lock:
+            if self._dim is None or len(self) == 0 or limit <= 0:
+                return []
+            if query.shape[0] != self.dim:
+                logger.error(f"Query dimension {query.shape[0]} does not match index dimension {self.dim}")
+                return []
+
+            if document_ids is not None:
+                rows = np.array(
+                    [row for doc_id in document_ids for row in self._rows_by_document.get(doc_id, [])],
+                    dtype=np.int64
+                )
+            elif self._use_ivf():
+                rows = self._ivf_candidates(query)
+            else:
+                rows = None
+
+            excluded = None
+            if exclude_prefix:
+                excluded = np.array(
+                    [row for doc_id, doc_rows in self._rows_by_document.items()
+                     if doc_id.startswith(exclude_prefix) for row in doc_rows],
+                    dtype=np.int64
+                )
+
+            if rows is None:
+                scores = np.concatenate(
+                    [vectors @ query for _, vectors in self._segments] +
+                    ([self._matrix[:self._size] @ query] if self._size else [])
+                )
+                scores[~self._alive[:self._total_rows]] = -np.inf
+                if excluded is not None:
+                    scores[excluded] = -np.inf
+                candidate_rows = None
+            else:
+                if rows.size == 0:
+                    return []
+                scores = self._gather(rows) @ query
+                scores[~self._alive[rows]] = -np.inf
+                if excluded is not None:
+                    scores[np.isin(rows, excluded)] = -np.inf
+                candidate_rows = rows
+
+            k = min(limit, scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            results = []
+            for position in top:
+                score = scores[position]
+                if not np.isfinite(score):
+                    continue
+                row = candidate_rows[position] if candidate_rows is not None else position
+                chunk = self._chunks[row]
+                results.append({
+                    "document_id": chunk["document_id"],
+                    "chunk_index": chunk["chunk_index"],
+                    "chunk_text": chunk["chunk_text"],
+                    "similarity": float(score),
+                    "metadata": chunk["metadata"] or {}
+                })
+            return results
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get index size and mode information
+
+        Returns:
+            Dict of index statistics
+        """
+        with self._lock:
+            return {
+                "mode": "ivf" if self._use_ivf() else "exact",
+                "vectors": len(self),
+                "documents": len(self._rows_by_document),
+                "dim": self.dim,
+                "segments": len(self._segments),
+                "segment_rows": self._segment_rows,
+                "capacity": self._matrix.shape[0] if self._matrix is not None else 0,
+                "dead_rows": self._dead_count,
+                "ivf_clusters": self._centroids.shape[0] if self._centroids is not None else 0
+            }
+
+    def _append(self, vectors: np.ndarray, chunks: List[Dict[str, Any]]) -> None:
+        """Append rows, growing the matrix geometrically (caller holds the lock)"""
+        if not chunks:
+            return
+
+        if self._dim is None:
+            self._dim = vectors.shape[1]
+        elif vectors.shape[1] != self._dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self._dim}")
+
+        if self._matrix is None:
+            self._matrix = np.empty((max(1024, len(chunks)), self._dim), dtype=np.float32)
+            alive = np.zeros(self._segment_rows + self._matrix.shape[0], dtype=bool)
+            alive[:self._segment_rows] = self._alive[:self._segment_rows]
+            self._alive = alive
+
+        needed = self._size + len(chunks)
+        if needed > self._matrix.shape[0]:
+            capacity = max(needed, self._matrix.shape[0] * 2)
+            matrix = np.empty((capacity, self._dim), dtype=np.float32)
+            matrix[:self._size] = self._matrix[:self._size]
+            alive = np.zeros(self._segment_rows + capacity, dtype=bool)
+            alive[:self._total_rows] = self._alive[:self._total_rows]
+            self._matrix, self._alive = matrix, alive
+
+        start = self._total_rows
+        self._matrix[self._size:needed] = vectors
+        self._alive[start:start + len(chunks)] = True
+        self._chunks.extend(chunks)
+        self._size = needed
+
+        rows = self._rows_by_document.setdefault(chunks[0]["document_id"], [])
+        rows.extend(range(start, start + len(chunks)))
+
+        if self._centroids is not None:
+            if self._total_rows >= 2 * self._ivf_trained_size:
+                # Retrain on the next query once the corpus has doubled
+                self._centroids = None
+                self._assignments = None
+            else:
+                self._assignments = np.concatenate([self._assignments, self._nearest_centroids(vectors)])
+
+    def _remove_rows(self, document_id: str) -> bool:
+        """Mark a document's rows dead and compact if needed (caller holds the lock)"""
+        rows = self._rows_by_document.pop(document_id, None)
+        if not rows:
+            return False
+
+        self._alive[rows] = False
+        self._dead_count += len(rows)
+        self._matrix_dead_count += sum(1 for row in rows if row >= self._segment_rows)
+        for row in rows:
+            self._chunks[row] = None
+
+        # Only the in-memory matrix is compacted; dead segment rows stay masked
+        if self._matrix_dead_count > COMPACT_DEAD_FRACTION * self._size:
+            self._compact()
+        return True
+
+    def _compact(self) -> None:
+        """Drop dead matrix rows so the matrix stays contiguous (caller holds the lock)"""
+        base = self._segment_rows
+        keep = np.flatnonzero(self._alive[base:self._total_rows])
+        matrix = np.empty((max(1024, keep.size * 2), self._dim), dtype=np.float32)
+        matrix[:keep.size] = self._matrix[keep]
+        alive = np.zeros(base + matrix.shape[0], dtype=bool)
+        alive[:base] = self._alive[:base]
+        alive[base:base + keep.size] = True
+
+        self._chunks = self._chunks[:base] + [self._chunks[base + row] for row in keep]
+        self._rows_by_document = {}
+        for row, chunk in enumerate(self._chunks):
+            if chunk is not None:
+                self._rows_by_document.setdefault(chunk["document_id"], []).append(row)
+        if self._assignments is not None:
+            self._assignments = np.concatenate([self._assignments[:base], self._assignments[base + keep]])
+
+        self._matrix, self._alive = matrix, alive
+        self._size = keep.size
+        self._dead_count -= self._matrix_dead_count
+        self._matrix_dead_count = 0
+        logger.info(f"Compacted vector index to {len(self)} vectors")
+
+    def _gather(self, rows: np.ndarray) -> np.ndarray:
+        """Copy the vectors of the given rows out of the segments and matrix (caller holds the lock)"""
+        result = np.empty((rows.shape[0], self._dim), dtype=np.float32)
+        for first_row, vectors in self._segments:
+            mask = (rows >= first_row) & (rows < first_row + vectors.shape[0])
+            if mask.any():
+                result[mask] = vectors[rows[mask] - first_row]
+        mask = rows >= self._segment_rows
+        if mask.any():
+            result[mask] = self._matrix[rows[mask] - self._segment_rows]
+        return result
+
+    def _use_ivf(self) -> bool:
+        return self.mode == "ivf" and len(self) >= self.ivf_min_vectors
+
+    def _ivf_candidates(self, query: np.ndarray) -> np.ndarray:
+        """Return rows of the clusters nearest to the query (caller holds the lock)"""
+        if self._centroids is None:
+            self._train_ivf()
+        nprobe = min(self.nprobe, self._centroids.shape[0])
+        centroid_scores = self._centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.flatnonzero(np.isin(self._assignments, probe))
+
+    def _train_ivf(self, iterations: int = 10, sample_size: int = 100000) -> None:
+        """Cluster the vectors with spherical k-means (caller holds the lock)"""
+        n_clusters = max(1, int(np.sqrt(len(self))))
+        rng = np.random.default_rng(0)
+
+        alive_rows = np.flatnonzero(self._alive[:self._total_rows])
+        sample = self._gather(np.sort(rng.choice(alive_rows, size=min(sample_size, alive_rows.size), replace=False)))
+        centroids = sample[rng.choice(sample.shape[0], size=min(n_clusters, sample.shape[0]), replace=False)]
+
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=centroids.shape[0]) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+
+        self._centroids = centroids
+        self._assignments = np.concatenate(
+            [self._nearest_centroids(vectors) for _, vectors in self._segments] +
+            ([self._nearest_centroids(self._matrix[:self._size])] if self._size else [])
+        )
+        self._ivf_trained_size = self._total_rows
+        logger.info(f"Trained IVF index with {centroids.shape[0]} clusters over {len(self)} vectors")
+
+    def _nearest_centroids(self, vectors: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+        """Assign each vector to its closest centroid"""
+        labels = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], batch_size):
+            labels[start:start + batch_size] = np.argmax(vectors[start:start + batch_size] @ self._centroids.T, axis=1)
+        return labels